@@ -3,17 +3,21 @@
 import datetime
 import argparse
 import calendar
+import functools
 import os.path
 import decimal
-import jinja2
-import pytz
-import json
-import csv
 import os
-from io import StringIO
+import sys
+import glob
 
 from lib.row import Row, RowData
-from lib.rowset import RowSet
+from lib.rowset import RowSet, value_normalise
+from lib import profiler
+
+# The modules needed only by some of the sub-commands (eg: jinja2, json,
+# csv) are imported by the functions that use them.  Most runs of this
+# script (eg: "sum" from the Makefile tests) should not have to pay the
+# cost of loading them - see the "test.startup" make target
 
 FILES_DIR = 'cash'
 
@@ -21,6 +25,23 @@ FILES_DIR = 'cash'
 decimal.getcontext().rounding = decimal.ROUND_DOWN
 
 
+class CheckFailed(ValueError):
+    """A sub-command found problems in the data.  The exception message is
+    the full report, which is output before exiting with an error status
+    """
+
+    def __init__(self, report):
+        super().__init__(report)
+        self.report = report
+
+
+@functools.lru_cache(maxsize=None)
+def _timezone(name):
+    """Return the named timezone, looking each one up only once"""
+    import zoneinfo
+    return zoneinfo.ZoneInfo(name)
+
+
 def _iso8601_str(dt):
     """Why oh why is this so hard to do?
     """
@@ -28,7 +49,7 @@ def _iso8601_str(dt):
     # TODO:
     # - currently, we want to report any timestamp in HKT, but if this code is
     #   to be reused, that needs to become flexible
-    dt = dt.astimezone(pytz.timezone("Asia/Hong_Kong"))
+    dt = dt.astimezone(_timezone("Asia/Hong_Kong"))
 
     return dt.replace(microsecond=0).isoformat()
 
@@ -64,24 +85,121 @@ def grid_cell_tostr(cell):
     return cell
 
 
-def grid_render_onerow(prefix, prefix_len, rowdata, cell_len):
-    s = []
+def load_rows(args, includefuture=None):
+    """Load the cash files as directed by the commandline args"""
+    if includefuture is None:
+        includefuture = args.includefuture
 
-    s += "{:<{width}}".format(prefix, width=prefix_len)
+    if getattr(args, 'rev', None):
+        from lib.gitobjects import GitObjects
+        with GitObjects(args.dir) as git:
+            return load_git_rows(git, args.rev, includefuture)
 
-    for cell in rowdata:
-        s += "{:>{}}".format(grid_cell_tostr(cell), cell_len)
+    # first, load the main data
+    rows = RowSet()
+    with profiler.phase('load_directory') as p:
+        rows.load_directory(args.dir)
+        p.rows(rows)
 
-    s += "\n"
+    # next, optionally load additional directories
+    # TODO - make these loaders into a generic list of directories
+    if includefuture:
+        load_future(args, rows)
 
-    return s
+    return rows
 
 
-def grid_render_colheader(months, months_len, tags_len):
-    return grid_render_onerow(
-        ' ', tags_len,
-        [render_month(x) for x in months], months_len
-    )
+def load_git_rows(git, rev, includefuture):
+    """Load the cash files as recorded at a git revision, the GitObjects
+    must be for the cash directory
+    """
+    rows = RowSet()
+    with profiler.phase('load_git') as p:
+        rows.load_git(rev, '.', git=git)
+        if includefuture:
+            rows.load_git(rev, 'future', skip_balance_check=True, git=git)
+        p.rows(rows)
+    return rows
+
+
+def load_future(args, rows):
+    """Load the predicted future transactions into the given rows"""
+    with profiler.phase('load_future') as p:
+        rows.load_directory(
+            os.path.join(args.dir, "future"),
+            skip_balance_check=True
+        )
+        p.rows(rows)
+
+
+def prepare_rows(args, rows, split):
+    """Apply the splitting and filtering from the commandline args to a
+    freshly loaded set of rows
+    """
+
+    # optionally split multi-month transactions into one per month
+    if split:
+        with profiler.phase('autosplit') as p:
+            rows = rows.autosplit()
+            p.rows(rows)
+
+    # apply any filters requested
+    if args.asof:
+        with profiler.phase('filter_asof') as p:
+            rows = rows.filter_asof(args.asof)
+            p.rows(rows)
+    with profiler.phase('filter') as p:
+        rows = rows.filter(args.filter)
+        p.rows(rows)
+
+    return rows
+
+
+def cache_key(args):
+    """Return a key that identifies everything that the output of this
+    commandline depends on, or None if the output cannot be cached
+    """
+    from lib.cache import OutputCache, digest_files
+
+    cmd = subp_cmds[args.cmd]
+    if not cmd.get('cache', True):
+        return None
+
+    # Some outputs include the current time, which is only predictable
+    # if we have been told what time to use
+    if cmd.get('clock', False) and not args.asof:
+        return None
+
+    topdir = os.path.dirname(os.path.abspath(__file__))
+
+    if getattr(args, 'rev', None):
+        from lib.gitobjects import GitObjects
+        cash = GitObjects(args.dir).tree(args.rev)
+    else:
+        cash = digest_files(cash_files(args))
+
+    # Any other files that the command reads
+    files = cmd.get('files', lambda args: [])(args)
+
+    code = [os.path.abspath(__file__)]
+    code += sorted(glob.glob(os.path.join(topdir, 'lib', '*.py')))
+
+    templates = sorted(glob.glob(os.path.join(topdir, 'templates', '*.j2')))
+
+    params = {
+        k: v for k, v in vars(args).items() if k not in ('func', 'cache')
+    }
+
+    return OutputCache.key({
+        'cash': cash,
+        'files': digest_files(files),
+        'code': digest_files(code),
+        'templates': digest_files(templates),
+        'args': params,
+        # Anything using rel_months (or the MonthTD stats) changes with
+        # the date, even with an --asof
+        'today': datetime.datetime.now().date(),
+    })
 
 
 #
@@ -92,6 +210,31 @@ def grid_render_colheader(months, months_len, tags_len):
 #
 
 
+_jinja2_env = None
+
+
+def jinja2_env():
+    """Return the jinja2 environment shared by all the template renders.
+
+    Sharing the environment means that each template is only compiled once
+    per run, even when many outputs are rendered (eg: by "pages"), and the
+    bytecode cache lets later runs skip compiling the templates at all
+    """
+    global _jinja2_env
+    if _jinja2_env is None:
+        import jinja2
+        templatedir = os.path.join(os.path.dirname(__file__), './templates/')
+        _jinja2_env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(templatedir),
+                bytecode_cache=jinja2.FileSystemBytecodeCache(),
+                extensions=[
+                    'jinja2.ext.do',
+                    'jinja2.ext.loopcontrols',
+                ],
+        )
+    return _jinja2_env
+
+
 def subp_jinja2(args):
     def _hack_rentdue():
         last_payment = args.rows.group_by('hashtag')['bills:rent'].last()
@@ -119,19 +262,13 @@ def subp_jinja2(args):
 
         return date
 
-    template = args.template
-    templatedir = os.path.join(os.path.dirname(__file__), './templates/')
+    from lib.texttable import TextTable
 
-    env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(templatedir),
-            extensions=[
-                'jinja2.ext.do',
-                'jinja2.ext.loopcontrols',
-            ],
-    )
+    template = args.template
 
     # Load the template file
-    tpl = env.get_template(template)
+    with profiler.phase('template:' + template):
+        tpl = jinja2_env().get_template(template)
 
     if args.asof:
         today = args.asof
@@ -142,6 +279,7 @@ def subp_jinja2(args):
     variables = {
         # A convenience
         'today': today,
+        'texttable': TextTable,
 
         'args': args,
 
@@ -150,7 +288,8 @@ def subp_jinja2(args):
         '_hack_timenow': _iso8601_str(hack_now),
         '_hack_rentdue': _hack_rentdue,
     }
-    return tpl.render(variables)
+    with profiler.phase('render:' + template):
+        return tpl.render(variables)
 
 
 def subp_sum(args):
@@ -163,6 +302,21 @@ def subp_sum(args):
     return "{}".format(result)
 
 
+def subp_history(args):
+    """
+    Output the balance at the end of every month, or at each of the dates
+    given, all from one index of the running balance
+    """
+    from lib.texttable import TextTable
+
+    index = args.rows.asof_index()
+
+    table = TextTable((('<', 10, '  '), ('>', None)))
+    for date in args.dates or index.month_ends():
+        table.add_row([date, index.balance(date)])
+    return str(table).rstrip("\n")
+
+
 def subp_topay(args):
     args.template = "topay.txt.j2"
     return subp_jinja2(args)
@@ -173,33 +327,84 @@ def subp_topay_html(args):
     return subp_jinja2(args)
 
 
+def subp_bills_missing(args):
+    """
+    List the bills that have not been paid yet this month - by default
+    the rent and internet, which need a reminder when they are late
+    """
+    if args.asof:
+        today = args.asof
+    else:
+        today = datetime.datetime.now().date()
+
+    tags = getattr(args, 'tags', None) or ['bills:rent', 'bills:internet']
+    missing = args.rows.bill_matrix().missing(today, tags)
+
+    if not missing:
+        return None
+    return "\n".join(missing)
+
+
 def subp_party(args):
     balance = args.rows.value
     return "Success" if balance > 0 else "Fail"
 
 
-def subp_csv(args):
+def csv_rows(rows):
+    """Return an iterator over the rows that have a date, in date order.
 
-    # remove rows with no date (TODO: should csv output match input?)
-    filtered = RowSet()
-    filtered.append(list(filter(lambda d: d.date is not None, args.rows)))
+    The rows from each file are nearly in date order already, so each run
+    of rows from the same file is sorted on its own and the runs are then
+    merged together.  The merge prefers the earlier run when dates are
+    equal, giving the same order as a stable sort of all the rows.
+    """
+    import heapq
 
-    rows = RowSet()
-    rows.append(sorted(filtered, key=lambda x: x.date))
+    runs = []
+    run = None
+    filename = None
+    for row in rows:
+        # remove rows with no date (TODO: should csv output match input?)
+        if row.date is None:
+            continue
+        if run is None or row.filename != filename:
+            run = []
+            runs.append(run)
+            filename = row.filename
+        run.append(row)
+
+    for run in runs:
+        run.sort(key=lambda x: x.date)
+
+    return heapq.merge(*runs, key=lambda x: x.date)
+
+
+def subp_csv(args):
+    """Write the rows as csv, directly to the output stream (stdout if
+    none is given) as they are sorted, with the sum of the values as a
+    trailer
+    """
+    import csv
 
-    buf = StringIO()
-    writer = csv.writer(buf)
+    stream = getattr(args, 'stream', None) or sys.stdout
+    writer = csv.writer(stream)
 
     # Write header
     # TODO - this is the only user of the RowData in this file, remove it
     writer.writerow([row.capitalize() for row in RowData._fields])
 
-    writer.writerows(rows)
+    total = decimal.Decimal(0)
+    for row in csv_rows(args.rows):
+        writer.writerow(row)
+        total += row.value
 
     writer.writerow('')
     writer.writerow(('Sum',))
-    writer.writerow((rows.value,))
-    return buf.getvalue()
+    writer.writerow((value_normalise(total),))
+
+    # This output used to be printed, keep the same final newline
+    stream.write("\n")
+    return None
 
 
 def subp_grid(args):
@@ -207,7 +412,64 @@ def subp_grid(args):
     return subp_jinja2(args)
 
 
+def member_files(args):
+    """Return the list of extra files read by member_coverage() - the dues
+    forecasts, if they were not already loaded
+    """
+    if getattr(args, 'includefuture', False):
+        return []
+    dues = os.path.join(args.dir, 'future', 'dues.txt')
+    if not os.path.exists(dues):
+        return []
+    return [dues]
+
+
+def member_coverage(args):
+    """Return the MemberCoverage index for the rows and the current month.
+    The dues forecasts are loaded, if they were not already, so that the
+    arrears can be found
+    """
+    from lib.members import MemberCoverage
+
+    coverage = MemberCoverage()
+    coverage.load_RowSet(args.rows)
+
+    for dues in member_files(args):
+        future = RowSet()
+        future.load_file(dues, skip_balance_check=True)
+        coverage.load_RowSet(future.autosplit())
+
+    if args.asof:
+        today = args.asof
+    else:
+        today = datetime.datetime.now().date()
+
+    return coverage, today.replace(day=1)
+
+
 def subp_json_payments(args):
+    import json
+
+    if getattr(args, 'coverage', False):
+        coverage, month_now = member_coverage(args)
+
+        r = {}
+        for member, entry in coverage.result(month_now).items():
+            r[member] = {
+                'first': entry['first'] and render_month(entry['first']),
+                'paid_through': entry['paid_through'] and render_month(
+                    entry['paid_through']
+                ),
+                'gaps': [render_month(x) for x in entry['gaps']],
+                'forecast': entry['forecast'],
+                'arrears_months': [
+                    render_month(x) for x in entry['arrears_months']
+                ],
+                'arrears': str(value_normalise(
+                    decimal.Decimal(entry['arrears'])
+                )),
+            }
+        return json.dumps(r, indent=1, sort_keys=True)
 
     payments = args.rows.filter(['direction==incoming']).group_by('hashtag')
 
@@ -217,68 +479,239 @@ def subp_json_payments(args):
     return json.dumps((r))
 
 
+def subp_members(args):
+    """
+    Show how far each member has paid their dues, any months they missed
+    and how much they owe compared to the dues forecasts
+    """
+    from lib.texttable import TextTable
+
+    coverage, month_now = member_coverage(args)
+    result = coverage.result(month_now)
+
+    if not result:
+        return ''
+
+    month_len = render_month_len()
+
+    table = TextTable([
+        ('<', None, ' '),
+        ('>', month_len, ' '),
+        ('>', month_len, ' '),
+        ('>', 4, ' '),
+        ('>', 8),
+    ])
+    table.add_row(['member', 'first', 'paid to', 'gaps', 'arrears'])
+    for member, entry in result.items():
+        first = entry['first'] and render_month(entry['first'])
+        paid = entry['paid_through'] and render_month(entry['paid_through'])
+        arrears = value_normalise(decimal.Decimal(entry['arrears']))
+        if not entry['forecast']:
+            # Without a forecast, nothing is expected from this member
+            arrears = ''
+
+        table.add_row([
+            member, first or '', paid or '', len(entry['gaps']), arrears
+        ])
+
+    # A blank arrears column would leave trailing spaces
+    return ''.join([line.rstrip() + "\n" for line in str(table).splitlines()])
+
+
 def subp_make_balance(args):
     args.template = "make_balance.html.j2"
     return subp_jinja2(args)
 
 
 def subp_roundtrip(args):
-    """Allow round-tripping the input data"""
-    return str(args.rows)
+    """Allow round-tripping the input data, writing it directly to the
+    output stream (stdout if none is given)
+    """
+    stream = getattr(args, 'stream', None) or sys.stdout
+    args.rows.write(stream)
+
+    # This output used to be printed, keep the same final newline
+    stream.write("\n")
+    return None
+
+
+def fmt_file(filename):
+    """Return the contents of one cash file in the canonical format, or
+    None if the file is already formatted.  Each line is only parsed, the
+    balances are left to the commands that load the whole set of files.
+    A sealed file is left alone, as any change would break its seal
+    """
+    import io
+    from lib.verify import SEAL_RE
+
+    with open(filename, 'r') as f:
+        text = f.read()
+
+    if SEAL_RE.search(text):
+        return None
+
+    def canonical(text):
+        rows = RowSet()
+        for line in io.StringIO(text):
+            rows.append(Row.fromTxt(line.rstrip('\n')))
+        stream = io.StringIO()
+        rows.write(stream, canonical=True)
+        return rows, stream.getvalue()
+
+    rows, new = canonical(text)
+    if new == text:
+        return None
+
+    # Make sure that nothing was lost in the reformatting
+    again, check = canonical(new)
+    if check != new or again.value != rows.value:
+        raise ValueError('{}: canonical format does not roundtrip'.format(
+            filename
+        ))
+
+    return new
+
+
+def write_atomic(filename, text):
+    """Replace the file with the given text.  The new file is written
+    alongside and renamed over the old one, so nothing ever sees a partly
+    written file
+    """
+    import tempfile
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def subp_fmt(args):
+    """
+    Rewrite the cash files in the canonical format, with the value column
+    aligned and the tags in a fixed order.  Only the files that change are
+    written, and the names of those files are output
+    """
+    import concurrent.futures
+
+    files = args.files or cash_files(args)
+
+    # Each file is independent, so they can all be done at the same time.
+    # Nothing is written unless every file could be formatted
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        texts = list(executor.map(fmt_file, files))
+        changed = {f: text for f, text in zip(files, texts) if text}
+
+        if not args.check:
+            for job in [
+                executor.submit(write_atomic, *item)
+                for item in changed.items()
+            ]:
+                job.result()
+
+    if not changed:
+        return None
+
+    result = ''.join([f + "\n" for f in changed])
+    if args.check and changed:
+        raise CheckFailed(result)
+    return result
+
+
+def cash_files(args, includefuture=None):
+    """Return the list of cash files that would be loaded by the
+    commandline args
+    """
+    if includefuture is None:
+        includefuture = args.includefuture
+
+    files = sorted(glob.glob(os.path.join(args.dir, '*.txt')))
+    if includefuture:
+        files += sorted(glob.glob(os.path.join(args.dir, 'future', '*.txt')))
+    return files
+
+
+def file_digests(args):
+    """Return a dict of the digest of each cash file that would be loaded
+    by the commandline args
+    """
+    from lib.cache import digest_files
+
+    return {f: digest_files([f]) for f in cash_files(args)}
+
+
+def code_digest():
+    """Return a digest of the library code that parses the cash files"""
+    from lib.cache import digest_files
+
+    topdir = os.path.dirname(os.path.abspath(__file__))
+    return digest_files(sorted(glob.glob(os.path.join(topdir, 'lib', '*.py'))))
+
+
+def stats_store(args):
+    """Return the StatsStore requested by the commandline args, if any"""
+    from lib.stats import StatsStore
+
+    filename = getattr(args, 'stats_store', None)
+    if not filename:
+        return None
+
+    config = {
+        'split': args.split,
+        'includefuture': args.includefuture,
+        'filter': args.filter,
+        'asof': str(args.asof),
+        'code': code_digest(),
+    }
+
+    # A filter on the relative date keeps different months as time goes
+    # by, so the stored months are only valid until the month changes
+    if any('rel_' in x for x in args.filter or []):
+        config['month'] = datetime.datetime.now().date().replace(day=1).isoformat()
+
+    return StatsStore(filename, config, file_digests(args))
 
 
 def create_stats(args):
-    # stats are only likely to be valid for previous months
-    rows = args.rows.filter(['rel_months<0'])
-    current_month = args.rows.filter(['rel_months==0'])
-
-    def make_rowset(value):
-        fake = Row()
-        fake.value = value
-        r = RowSet()
-        r.append(fake)
-        return r
-
-    def stats_rowset(rowset):
-        r = {}
-        r['incoming'] = rowset.filter(['value>0'])
-        r['outgoing'] = rowset.filter(['value<0'])
-        # TODO - values of zero?  we have one member as such, but it is a
-        # exceptional case
-        r['dues'] = rowset.filter(['hashtag=~^dues:'])
-        r['members'] = len(r['dues'].group_by('hashtag').keys())
-        if r['members']:
-            r['ARPM'] = int(r['dues'].value / r['members'])
-        else:
-            r['ARPM'] = -1
+    from lib.stats import Stats
 
-        r['other'] = rowset.filter(['value>0', 'hashtag!~^dues:'])
+    store = stats_store(args)
 
-        return r
+    stats = Stats()
+    stats.load_RowSet(args.rows, store)
+
+    if store is not None:
+        store.save()
 
     result = {}
-    months = rows.group_by('month')
-    for k, month in months.items():
-        result[k] = stats_rowset(month)
+    for month, column in stats.months.items():
+        result[month] = column.result()
 
     months = sorted(result.keys())
 
-    result['Total'] = stats_rowset(rows)
+    result['Total'] = stats.total().result()
 
     result['Average'] = {}
     for tag in ('outgoing', 'incoming', 'dues', 'other'):
-        result['Average'][tag] = make_rowset(
-            result['Total'][tag].value / len(months))
+        result['Average'][tag] = value_normalise(
+            decimal.Decimal(0) + result['Total'][tag] / len(months))
     result['Average']['members'] = int(sum(
         [result[x]['members'] for x in months]
     ) / len(months))
     result['Average']['ARPM'] = int(
-        result['Total']['dues'].value /
+        result['Total']['dues'] /
         result['Average']['members'] /
         len(months)
     )
+    # The average is not made up of any real months
+    result['Average']['months'] = 0
 
-    result['MonthTD'] = stats_rowset(current_month)
+    result['MonthTD'] = stats.monthtd.result()
 
     months.append('Average')
     months.append('MonthTD')
@@ -287,8 +720,8 @@ def create_stats(args):
     balance = 0
     for month in months:
         result[month]['subtotal'] = (
-            result[month]['incoming'].value
-            + result[month]['outgoing'].value
+            result[month]['incoming']
+            + result[month]['outgoing']
         )
         balance += result[month]['subtotal']
         result[month]['balance'] = balance
@@ -296,8 +729,36 @@ def create_stats(args):
     return result, months
 
 
+def create_rolling(args, result, months):
+    """Return a dict of the rolling window stats for each requested window
+    size.  Only the real months have rolling stats
+    """
+    from lib.stats import rolling
+
+    real_months = [x for x in months if not isinstance(x, str)]
+
+    windows = {}
+    for size in getattr(args, 'window', None) or []:
+        windows[size] = rolling(result, real_months, size)
+    return windows
+
+
+# The rolling window fields shown in the stats outputs
+rolling_fields = (
+    'outgoing_sum',
+    'incoming_sum',
+    'dues_sum',
+    'outgoing_avg',
+    'incoming_avg',
+    'dues_avg',
+    'members_avg',
+    'ARPM',
+)
+
+
 def subp_statstsv(args):
     result, months = create_stats(args)
+    windows = create_rolling(args, result, months)
 
     fields = (
         'balance',
@@ -320,6 +781,10 @@ def subp_statstsv(args):
         s += field
         column_nr += 1
         s += "\n"
+    for size in windows:
+        for field in rolling_fields:
+            s += '#column {} {}_{}\n'.format(column_nr, field, size)
+            column_nr += 1
 
     today = args.asof or datetime.datetime.now().date()
     for month in months:
@@ -346,53 +811,168 @@ def subp_statstsv(args):
         #   clear to anyone spelunking in the stats
 
         for field in fields:
-            val = result[month][field]
-            if isinstance(val, (int, decimal.Decimal)):
-                s += str(val)
-            else:
-                s += str(result[month][field].value)
+            s += str(result[month][field])
             s += ' '
 
+        for window in windows.values():
+            for field in rolling_fields:
+                if window.get(month) is None:
+                    # gnuplot treats this as a missing value
+                    s += 'NaN'
+                else:
+                    s += str(window[month][field])
+                s += ' '
+
         s += "\n"
     return ''.join(s)
 
 
+def break_even_columns(result, months):
+    """Precompute the (outgoing total, number of months) pair that the
+    break-even calculations need for each of the given stats columns
+    """
+    columns = []
+    for month in months:
+        count = result[month]['months']
+        if count == 0:
+            # TODO HACK
+            # - since we use a 'magic' column name that is not a date, there
+            # is at least one column that doesnt group_by properly
+            count = 1
+        columns.append((result[month]['outgoing'], count))
+    return columns
+
+
+def members_needed(dues, columns):
+    """For each column, how many members paying these dues are needed to
+    cover the outgoing
+    """
+    return [
+        abs((outgoing / (dues * count)).to_integral_exact(
+            rounding=decimal.ROUND_FLOOR
+        ))
+        for outgoing, count in columns
+    ]
+
+
+def dues_needed(members, columns):
+    """For each column, what dues would this many members need to pay to
+    cover the outgoing
+    """
+    if members == 0:
+        # no value possible!
+        return [0 for x in columns]
+
+    return [
+        abs(outgoing / members / count).to_integral_exact(
+            rounding=decimal.ROUND_FLOOR
+        )
+        for outgoing, count in columns
+    ]
+
+
+def _parse_date(text):
+    """Convert a "YYYY-MM-DD" string into a date"""
+    return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def _parse_range(text):
+    """Convert a "start:stop[:step]" string into an inclusive range"""
+    fields = [int(x) for x in text.split(':')]
+    if len(fields) == 2:
+        fields.append(1)
+    if len(fields) != 3 or fields[2] < 1:
+        raise ValueError('range must be "start:stop[:step]": {}'.format(text))
+    return range(fields[0], fields[1] + 1, fields[2])
+
+
+def stats_sweep(args, result, months):
+    """Output the break-even matrix as a TSV, with one block for members
+    needed over a range of dues and one block for dues needed over a range
+    of member counts.  The blocks can be selected with the gnuplot "index"
+    """
+    dues_range = _parse_range(getattr(args, 'sweep_dues', None) or '100:1500:100')
+    members_range = _parse_range(getattr(args, 'sweep_members', None) or '5:50:5')
+
+    if 0 in dues_range:
+        raise ValueError('cannot calculate members needed with zero dues')
+
+    # As with the stats output, the Total and MonthTD are not useful here
+    months = months[:-2]
+    columns = break_even_columns(result, months)
+
+    def block(title, prefix, values, fn):
+        s = []
+        s += "# {}\n".format(title)
+        s += "timestamp month "
+        s += ' '.join(["{}_{}".format(prefix, x) for x in values])
+        s += "\n"
+
+        matrix = [fn(x, columns) for x in values]
+        for i, month in enumerate(months):
+            if isinstance(month, str):
+                s += "# x"
+            else:
+                s += month.strftime('%s')
+            s += ' '
+            s += render_month(month)
+            s += ' '
+            s += ' '.join([str(row[i]) for row in matrix])
+            s += "\n"
+        return ''.join(s)
+
+    return (
+        block('members needed', 'dues', dues_range, members_needed)
+        + "\n\n"
+        + block('dues needed', 'members', members_range, dues_needed)
+    )
+
+
 def subp_stats(args):
+    from lib.texttable import TextTable
+
     result, months = create_stats(args)
 
+    if getattr(args, 'sweep', False):
+        return stats_sweep(args, result, months)
+
+    windows = create_rolling(args, result, months)
+
     months_len = render_month_len()+2
     tags_len = 13
 
-    s = []
-    s += grid_render_colheader(months, months_len, tags_len)
+    table = TextTable([('<', tags_len)] + [('>', months_len)] * len(months))
+    table.add_row([' '] + [render_month(x) for x in months])
     for tag in ('outgoing', 'incoming'):
-        s += grid_render_onerow(
-            tag, tags_len,
-            [result[x][tag].value.to_integral_exact(
-                rounding=decimal.ROUND_FLOOR
-            ) for x in months],
-            months_len
-        )
-    s += "\n"
+        table.add_row([tag] + [
+            result[x][tag].to_integral_exact(rounding=decimal.ROUND_FLOOR)
+            for x in months
+        ])
+    table.add_line()
     for tag in ('dues', 'other'):
-        s += grid_render_onerow(
-            " {}:".format(tag), tags_len,
-            [result[x][tag].value.to_integral_exact(
-                rounding=decimal.ROUND_FLOOR
-            ) for x in months],
-            months_len
-        )
-    s += "\n"
-    s += grid_render_onerow(
-        'nr members', tags_len,
-        [result[x]['members'] for x in months],
-        months_len
-    )
-    s += grid_render_onerow(
-        'ARPM', tags_len,
-        [result[x]['ARPM'] for x in months],
-        months_len
-    )
+        table.add_row([" {}:".format(tag)] + [
+            result[x][tag].to_integral_exact(rounding=decimal.ROUND_FLOOR)
+            for x in months
+        ])
+    table.add_line()
+    table.add_row(['nr members'] + [result[x]['members'] for x in months])
+    table.add_row(['ARPM'] + [result[x]['ARPM'] for x in months])
+
+    def window_cell(window, month, field):
+        if window.get(month) is None:
+            return ''
+        value = window[month][field]
+        if isinstance(value, decimal.Decimal):
+            value = value.to_integral_exact(rounding=decimal.ROUND_FLOOR)
+        return value
+
+    for size, window in windows.items():
+        table.add_line()
+        table.add_line("rolling {} months".format(size))
+        for field in rolling_fields:
+            table.add_row([" " + field.replace('_', ' ')] + [
+                window_cell(window, x, field) for x in months
+            ])
 
     # The rows after this are identical in the Average and Total columns,
     # so to make that easier to see, remove the Total column from display
@@ -400,35 +980,10 @@ def subp_stats(args):
     # until near the end of the month
     months = months[:-2]
 
-    def members_given_dues_outgoing(dues, rowset):
-        months = len(rowset.group_by('month').keys())
-        if months == 0:
-            # TODO HACK
-            # - since we use a 'magic' column name that is not a date, there
-            # is at least one column that doesnt group_by properly
-            months = 1
-        total_dues = dues * months
-        return abs((rowset.value / total_dues).to_integral_exact(
-            rounding=decimal.ROUND_FLOOR
-        ))
+    columns = break_even_columns(result, months)
 
-    def dues_given_members_outgoing(members, rowset):
-        if members == 0:
-            # no value possible!
-            return 0
-
-        months = len(rowset.group_by('month').keys())
-        if months == 0:
-            # TODO HACK
-            # - since we use a 'magic' column name that is not a date, there
-            # is at least one column that doesnt group_by properly
-            months = 1
-        return abs(rowset.value / members / months).to_integral_exact(
-            rounding=decimal.ROUND_FLOOR
-        )
-
-    s += "\n"
-    s += "members needed\n"
+    table.add_line()
+    table.add_line("members needed")
 
     # Which fee rates do we want to see membership numbers for?
     # Add in the recent official numbers
@@ -437,14 +992,9 @@ def subp_stats(args):
     fees_rates.add(result['Average']['ARPM'])
     fees_rates.add(result['MonthTD']['ARPM'])
     for dues in sorted(fees_rates):
-        s += grid_render_onerow(
-            " dues {}".format(dues), tags_len,
-            [members_given_dues_outgoing(dues, result[x]['outgoing'])
-             for x in months],
-            months_len
-        )
+        table.add_row([" dues {}".format(dues)] + members_needed(dues, columns))
 
-    s += "dues needed\n"
+    table.add_line("dues needed")
 
     # Which membership numbers do we want to see needed fees for?
     members_count = set([17, 30])
@@ -453,54 +1003,265 @@ def subp_stats(args):
     members_count.add(result['MonthTD']['members'])
 
     for members in sorted(members_count):
-        s += grid_render_onerow(
-            " members {}".format(members), tags_len,
-            [dues_given_members_outgoing(members, result[x]['outgoing'])
-             for x in months],
-            months_len
-        )
+        table.add_row([" members {}".format(members)] + dues_needed(members, columns))
 
-    s += "\nNote: Total column does not include MonthTD numbers\n"
+    table.add_line()
+    table.add_line("Note: Total column does not include MonthTD numbers")
 
-    return ''.join(s)
+    return str(table)
 
 
 def subp_check_doubletxn(args):
     """
-    Go through each transaction in a month.  Alert if there are two
-    or more transactions that have the same dollar amount and the
-    same tag
+    Go through every transaction and alert if any two or more of them look
+    like they record the same thing - all duplicates found are reported
     """
+    import json
+    from lib.duplicates import DuplicateIndex
 
-    rows = args.rows.filter([
-        'hashtag=~^dues:',
-    ])
+    keys = getattr(args, 'keys', None) or 'dues,id'
+    index = DuplicateIndex(
+        keys=keys.split(','),
+        days=getattr(args, 'days', None) or 3,
+    )
+    index.load_RowSet(args.rows)
+    collisions = index.collisions()
 
-    # TODO:
-    # - get better at deduplicating the non dues payments too?
+    if getattr(args, 'format', None) == 'json':
+        result = json.dumps(index.collisions_dict(collisions), indent=1)
+        if collisions:
+            raise CheckFailed(result)
+        return result
 
-    db = {}
-    for row in rows:
-        month = row.month
-        if month not in db:
-            db[month] = {}
+    if not collisions:
+        return None
 
-        tag = row.hashtag
-        if tag is None:
-            # TODO - ensure that every line has a tag?
-            continue
+    s = []
+    for keyname, rows in collisions:
+        s += "Duplicate transaction found ({}):\n".format(keyname)
+        for row in rows:
+            s += "{}:{}: {}\n".format(row.filename, row.line_number, row)
+        s += "\n"
+    s += "{} duplicate(s) found".format(len(collisions))
+
+    raise CheckFailed(''.join(s))
+
+
+def verify_summaries(args):
+    """Return a dict of the summary of each cash file, used to check their
+    balances and seals.  The files are each summarised independently, in
+    parallel, and the summaries are cached so that only the files that
+    have changed need to be read again
+    """
+    import concurrent.futures
+    from lib.cache import OutputCache, digest_files
+    from lib.verify import file_summary
+
+    files = cash_files(args, includefuture=False)
+
+    summaries = {}
+    keys = {}
+    cache = None
+    if args.cache:
+        cache = OutputCache(args.cache)
+        code = code_digest()
+        for filename in files:
+            keys[filename] = OutputCache.key({
+                'verify': digest_files([filename]),
+                'code': code,
+            })
+            found, summary = cache.get(keys[filename])
+            if found:
+                summaries[filename] = summary
+
+    todo = [filename for filename in files if filename not in summaries]
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+            for filename, summary in zip(todo, executor.map(file_summary, todo)):
+                summaries[filename] = summary
+                if cache is not None:
+                    cache.put(keys[filename], summary)
+
+    return {filename: summaries[filename] for filename in files}
+
+
+def subp_verify(args):
+    """
+    Check the balance pragmas and the seals of every cash file and report
+    all of the mismatches, instead of stopping at the first one
+    """
+    from lib.verify import check_chain, check_seals
+
+    summaries = list(verify_summaries(args).items())
+    problems, balance = check_chain(summaries)
+    broken, sealed = check_seals(summaries)
+
+    # Report the problems in the order of the files, so that the first one
+    # is where the chain first breaks
+    order = {filename: i for i, (filename, summary) in enumerate(summaries)}
+    problems = sorted(
+        problems + broken, key=lambda x: (order[x.filename], x.line_number)
+    )
+
+    if problems:
+        raise CheckFailed(verify_report(problems))
+
+    return "{} files verified ({} sealed), closing balance {}".format(
+        len(summaries), sealed, value_normalise(balance)
+    )
+
+
+def verify_report(problems):
+    """Return the report of all the problems found by verify"""
+    s = []
+    for problem in problems:
+        s += "{}\n".format(problem)
+    s += "\n{} problem(s) found, the chain first breaks at {}:{}".format(
+        len(problems), problems[0].filename, problems[0].line_number
+    )
+    return ''.join(s)
+
+
+def seal_file(filename, line_number, seal):
+    """Write the seal onto the closing balance pragma of the file"""
+    from lib.verify import seal_line
+
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    lines[line_number - 1] = seal_line(lines[line_number - 1], seal)
+    write_atomic(filename, ''.join(lines))
+
+
+def subp_seal(args):
+    """
+    Seal every closed cash file with a digest of its content and the seal
+    of the file before it, so that any later change to the history can be
+    found by verify.  A broken seal is not replaced unless forced, and
+    the names of the files that were sealed are output
+    """
+    from lib.verify import check_chain, seal_changes
+
+    summaries = verify_summaries(args)
+
+    # Only seal the files if they balance
+    problems, balance = check_chain(summaries.items())
+    if problems:
+        raise CheckFailed(verify_report(problems))
+
+    changes, broken = seal_changes(summaries.items(), args.force)
+    if broken:
+        raise CheckFailed(''.join([
+            "{}: seal does not match, use --force to seal it again\n".format(
+                filename
+            ) for filename in broken
+        ]) + "\n{} broken seal(s) found".format(len(broken)))
+
+    for filename, seal in changes.items():
+        seal_file(filename, summaries[filename]['closing'], seal)
+
+    if not changes:
+        return None
+    return ''.join([filename + "\n" for filename in changes])
+
+
+def subp_lint(args):
+    """
+    Check the syntax, tags, splits, locations, balances, seals and
+    duplicates of all the cash files (including the future ones) in a
+    single pass, reporting every problem found - it only fails once all
+    of the files have been checked, and only if any are errors
+    """
+    from lib.lint import Linter, ERROR
+
+    linter = Linter()
+    with profiler.phase('lint'):
+        linter.lint_directory(args.dir)
+        linter.lint_directory(os.path.join(args.dir, 'future'), future=True)
+        diagnostics = linter.finish()
+
+    errors = len([x for x in diagnostics if x.severity == ERROR])
+    s = []
+    for diagnostic in diagnostics:
+        s += "{}\n".format(diagnostic)
+    s += "{} files checked, {} error(s), {} warning(s)".format(
+        linter.files, errors, len(diagnostics) - errors
+    )
+
+    if errors:
+        raise CheckFailed(''.join(s))
+    return ''.join(s)
+
+
+def diff_state(args, git, state):
+    """Load the rows of one side of a diff, from either a directory or a
+    git revision.  Returns the rows and the directory that their filenames
+    are relative to
+    """
+    if os.path.isdir(state):
+        rows = RowSet()
+        rows.load_directory(state)
+        if args.includefuture:
+            rows.load_directory(
+                os.path.join(state, 'future'), skip_balance_check=True
+            )
+        return rows, state
 
-        if tag not in db[month]:
-            db[month][tag] = {}
+    return load_git_rows(git, state, args.includefuture), git.prefix()
+
+
+def subp_diff(args):
+    """
+    Compare the rows of two states of the ledger, each either a directory
+    or a git revision, and show the rows that were added, removed or
+    changed - along with the change to each cell of the monthly grid and
+    to the final balance
+    """
+    from lib.gitobjects import GitObjects
+    from lib.rowdiff import RowDiff
+    from lib.texttable import TextTable
+
+    diff = RowDiff(split=args.split)
+    with GitObjects(args.dir) as git:
+        old, root_old = diff_state(args, git, args.old)
+        new, root_new = diff_state(args, git, args.new)
+        diff.load_RowSets(old, new, root_old, root_new)
+
+    def where(row, root):
+        return "{}:{}".format(
+            os.path.relpath(row.filename, root or '.'), row.line_number
+        )
+
+    lines = []
+    for row in diff.removed:
+        lines.append(('-', where(row, root_old), row))
+    for row in diff.added:
+        lines.append(('+', where(row, root_new), row))
+    for row_old, row_new in diff.changed:
+        lines.append(('~', where(row_old, root_old), row_old))
+        lines.append((' ', where(row_new, root_new), row_new))
+
+    s = []
+    width = max([len(line[1]) for line in lines], default=0)
+    for mark, location, row in lines:
+        s += "{} {:<{}} {}\n".format(mark, location, width, row)
+    if lines:
+        s += "\n"
 
-        value = row.value
-        if value in db[month][tag]:
-            raise ValueError(
-                "Duplicate transaction found:\n{}\n{}".format(
-                    db[month][tag][value],
-                    row))
+    if diff.cells:
+        cells = TextTable((('<', None, '  '), ('<', None, '  '), ('>', None)))
+        cells.add_row(['Month', 'Hashtag', 'Change'])
+        for (month, hashtag), value in sorted(diff.cells.items()):
+            cells.add_row([render_month(month), hashtag, value_normalise(value)])
+        s += str(cells)
+        s += "\n"
 
-        db[month][tag][value] = row
+    s += "{} added, {} removed, {} changed, balance {} -> {} ({})".format(
+        len(diff.added), len(diff.removed), len(diff.changed),
+        value_normalise(diff.balance_old), value_normalise(diff.balance_new),
+        diff.balance,
+    )
+    return ''.join(s)
 
 
 def subp_report_location(args):
@@ -512,19 +1273,286 @@ def subp_report_location(args):
     return subp_jinja2(args)
 
 
+def subp_locations_timeline(args):
+    """
+    Show the running balance of each location at the end of every month
+    """
+    args.template = "locations_timeline.txt.j2"
+    return subp_jinja2(args)
+
+
+def ledger_db(args, filename):
+    """Return the LedgerDB in the given file, after bringing it up to date
+    with the cash files
+    """
+    from lib.ledgerdb import LedgerDB
+
+    config = {
+        'includefuture': args.includefuture,
+        'code': code_digest(),
+    }
+    if args.includefuture:
+        # forecasts are split into months up to a date relative to today
+        config['today'] = datetime.datetime.now().date().isoformat()
+
+    db = LedgerDB(filename, config)
+    db.update(file_digests(args))
+    return db
+
+
+def sql_rows(args):
+    """Return all the rows, kept in the SQLite database instead of being
+    loaded into memory
+    """
+    from lib.sqlrowset import SQLRowSet
+
+    if not args.split:
+        raise ValueError('The sqlite engine only holds the split rows')
+
+    return SQLRowSet(ledger_db(args, args.db))
+
+
+def subp_sqlite(args):
+    """
+    Export all the rows, split into months, to a SQLite database.  Only
+    the cash files that have changed since the last export are loaded
+    """
+    db = ledger_db(args, args.out)
+    db.close()
+    return None
+
+
+def subp_query(args):
+    """
+    Run a SQL query against the SQLite database of the rows, updating it
+    first if needed.  The results are output as tab separated values
+    """
+    db = ledger_db(args, args.db)
+    columns, rows = db.query(args.sql)
+    db.close()
+
+    if not columns:
+        return None
+
+    lines = ['\t'.join(columns)]
+    for row in rows:
+        lines.append('\t'.join(['' if x is None else str(x) for x in row]))
+    return '\n'.join(lines)
+
+
+def _pages_sections(args, sections):
+    """Return the text of a report made of the given list of sections,
+    after the version of the data and a blank line
+    """
+    return _pages_describe(args) + "\n" + "".join(sections)
+
+
+def _pages_describe(args):
+    """The version of the data, shown at the top of the reports.  This is
+    found from the data directory, wherever we are run from
+    """
+    import subprocess
+
+    output = subprocess.run(
+        ['git', 'describe', '--always', '--dirty'],
+        cwd=args.dir,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return output
+
+
+def _pages_report(args):
+    args.display_days_prev = 410
+    args.display_days_post = 182
+    grid = subp_grid(args)
+
+    args.rows = args.rows_stats
+    stats = subp_stats(args)
+
+    return _pages_sections(args, [grid + "\n\n", stats + "\n\n"])
+
+
+def _pages_report_future(args):
+    args.display_days_prev = 270
+    args.display_days_post = 150
+    grid = subp_grid(args)
+
+    return _pages_sections(args, [grid + "\n\n"])
+
+
+def _pages_report_location(args):
+    return _pages_sections(args, [subp_report_location(args) + "\n"])
+
+
+def _pages_print(func):
+    """Wrap a sub-command so that its output matches being printed"""
+    def wrapper(args):
+        return func(args) + "\n"
+    return wrapper
+
+
+# The files generated by the pages sub-command, the view of the data that
+# they are generated from and the function that generates them
+pages_files = (
+    ('index.html', 'split', _pages_print(subp_make_balance)),
+    ('transactions.csv', 'nosplit', subp_csv),
+    ('payments.json', 'split', _pages_print(subp_json_payments)),
+    ('stats.tsv', 'split', _pages_print(subp_statstsv)),
+    ('report.txt', 'split', _pages_report),
+    ('report.future.txt', 'future', _pages_report_future),
+    ('report_location.txt', 'split', _pages_report_location),
+)
+
+
+def pages_views(args):
+    """Load the cash files only once and return the views of the rows that
+    the pages are generated from
+    """
+    rows = load_rows(args, includefuture=False)
+
+    future = RowSet()
+    future.append(list(rows))
+    load_future(args, future)
+
+    views = {
+        'nosplit': prepare_rows(args, rows, False),
+        'split': prepare_rows(args, rows, True),
+        'future': prepare_rows(args, future, True),
+    }
+    views['stats'] = views['split'].filter(['rel_months>-15'])
+    return views
+
+
+def pages_render(args, views, page, stream):
+    """Generate one of the pages_files from the views, writing it to the
+    stream
+    """
+    import copy
+
+    filename, view, func = page
+
+    this = copy.copy(args)
+    this.rows = views[view]
+    this.rows_stats = views['stats']
+
+    # Outputs can be written directly to the stream as they are generated,
+    # or returned to be written all at once
+    this.stream = stream
+    with profiler.phase('pages:' + filename):
+        output = func(this)
+    if output is not None:
+        stream.write(output)
+
+
+def subp_pages(args):
+    """
+    Generate all the output files for the published pages, loading the
+    cash files only once
+    """
+    import concurrent.futures
+
+    views = pages_views(args)
+
+    # The worker threads do not inherit our decimal rounding mode
+    context = decimal.getcontext()
+
+    def render(page):
+        with open(os.path.join(args.outdir, page[0]), 'w') as f:
+            with decimal.localcontext(context):
+                pages_render(args, views, page, f)
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        jobs = [
+            executor.submit(render, page) for page in pages_files
+        ]
+        for job in jobs:
+            # collect any exceptions
+            job.result()
+
+
+# Files copied from the docs directory alongside the pages
+pages_static = ('pressstart2p.ttf', 'circle.svg')
+
+
+def subp_serve(args):
+    """
+    Serve the published pages over HTTP.  The rows are kept in memory and
+    each page is generated only once, until the cash files change
+    """
+    import io
+    from lib.server import PageModel, make_server
+
+    topdir = os.path.dirname(os.path.abspath(__file__))
+
+    # The server threads do not inherit our decimal rounding mode
+    context = decimal.getcontext()
+
+    def inputs():
+        return cash_files(args, includefuture=True)
+
+    def today():
+        # The pages show the current date, unless we were told one
+        if args.asof:
+            return args.asof
+        return datetime.datetime.now().date()
+
+    def page_func(views, page):
+        def render():
+            stream = io.StringIO()
+            with decimal.localcontext(context):
+                pages_render(args, views, page, stream)
+            return stream.getvalue()
+        return render
+
+    def static_func(filename):
+        def render():
+            with open(os.path.join(topdir, 'docs', filename), 'rb') as f:
+                return f.read()
+        return render
+
+    def loader():
+        with decimal.localcontext(context):
+            views = pages_views(args)
+
+        pages = {page[0]: page_func(views, page) for page in pages_files}
+        for filename in pages_static:
+            pages[filename] = static_func(filename)
+        return pages
+
+    model = PageModel(inputs, loader, salt=today)
+    server = make_server(model, args.port, args.bind)
+    print('Serving on http://{}:{}/'.format(
+        args.bind or 'localhost', server.server_address[1]
+    ), flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return None
+
+
 # A list of all the sub-commands
 subp_cmds = {
     'jinja2': {
         'func': subp_jinja2,
         'help': 'Pass the rows to a jinja2 template to be rendered',
+        'clock': True,
     },
     'check_doubletxn': {
         'func': subp_check_doubletxn,
-        'help': 'Check for identical transactions in each month',
+        'help': 'Check for transactions that have been recorded twice',
     },
     'csv': {
         'func': subp_csv,
         'help': 'Output transactions as csv',
+        # streamed directly to stdout, so there is no output to cache
+        'cache': False,
     },
     'grid': {
         'func': subp_grid,
@@ -533,10 +1561,21 @@ subp_cmds = {
     'json_payments': {
         'func': subp_json_payments,
         'help': 'Output JSON of incoming payments',
+        # with the coverage option the arrears depend on the current date
+        # and the dues forecasts
+        'clock': True,
+        'files': member_files,
+    },
+    'members': {
+        'func': subp_members,
+        'help': 'Show the paid-through month and arrears of each member',
+        'clock': True,
+        'files': member_files,
     },
     'make_balance': {
         'func': subp_make_balance,
         'help': 'Output sum HTML page',
+        'clock': True,
     },
     'party': {
         'func': subp_party,
@@ -545,11 +1584,17 @@ subp_cmds = {
     'roundtrip': {
         'func': subp_roundtrip,
         'help': 'Output the database the same way as the input',
+        # streamed directly to stdout, so there is no output to cache
+        'cache': False,
     },
     'sum': {
         'func': subp_sum,
         'help': 'Sum all transactions',
     },
+    'history': {
+        'func': subp_history,
+        'help': 'Show the balance at the end of each month',
+    },
     'topay': {
         'func': subp_topay,
         'help': 'List all pending payments',
@@ -558,6 +1603,11 @@ subp_cmds = {
         'func': subp_topay_html,
         'help': 'List all pending payments as HTML table',
     },
+    'bills_missing': {
+        'func': subp_bills_missing,
+        'help': 'List the bills not yet paid this month',
+        'clock': True,
+    },
     'stats': {
         'func': subp_stats,
         'help': 'Output finance stats report',
@@ -570,6 +1620,64 @@ subp_cmds = {
         'func': subp_report_location,
         'help': 'Show where the cash is, using the location metadata',
     },
+    'locations_timeline': {
+        'func': subp_locations_timeline,
+        'help': 'Show the monthly running balance of each location',
+    },
+    'sqlite': {
+        'func': subp_sqlite,
+        'help': 'Export the rows to a SQLite database',
+        'rows': False,
+        'cache': False,
+    },
+    'query': {
+        'func': subp_query,
+        'help': 'Run a SQL query against the rows',
+        'rows': False,
+        'cache': False,
+    },
+    'pages': {
+        'func': subp_pages,
+        'help': 'Generate all the files for the published pages',
+        'rows': False,
+        'cache': False,
+    },
+    'fmt': {
+        'func': subp_fmt,
+        'help': 'Rewrite the cash files in the canonical format',
+        'rows': False,
+        'cache': False,
+    },
+    'verify': {
+        'func': subp_verify,
+        'help': 'Check the balance pragmas of all the cash files',
+        'rows': False,
+        'cache': False,
+    },
+    'seal': {
+        'func': subp_seal,
+        'help': 'Seal the closed cash files with a chain of digests',
+        'rows': False,
+        'cache': False,
+    },
+    'lint': {
+        'func': subp_lint,
+        'help': 'Check all the cash files and report every problem found',
+        'rows': False,
+        'cache': False,
+    },
+    'diff': {
+        'func': subp_diff,
+        'help': 'Show the rows changed between two directories or revisions',
+        'rows': False,
+        'cache': False,
+    },
+    'serve': {
+        'func': subp_serve,
+        'help': 'Serve the published pages over HTTP',
+        'rows': False,
+        'cache': False,
+    },
 }
 
 #
@@ -592,6 +1700,9 @@ if __name__ == '__main__':  # pragma: no cover
                            action='store_true',
                            help='Include predicted future transactions from '
                            'a separate input directory')
+    argparser.add_argument('--rev',
+                           help='Load the cash files as recorded at this git '
+                           'revision, instead of from the working tree')
     argparser.add_argument('--filter', action='append',
                            help='Add a key=value filter to the rows used')
     argparser.add_argument('--split', dest='split',
@@ -601,6 +1712,25 @@ if __name__ == '__main__':  # pragma: no cover
                            action='store_false',
                            help='Do not split rows that cover multiple months')
     argparser.set_defaults(split=True)
+    argparser.add_argument('--cache',
+                           default=os.environ.get('BALANCE_CACHE'),
+                           help='Directory used to cache previous outputs '
+                           '(default from $BALANCE_CACHE)')
+    argparser.add_argument('--engine',
+                           choices=['memory', 'sqlite'],
+                           default='memory',
+                           help='Where to keep the rows while working on '
+                           'them (default: %(default)s)')
+    argparser.add_argument('--db',
+                           default='ledger.db',
+                           help='The SQLite database used by the query '
+                           'sub-command and the sqlite engine '
+                           '(default: %(default)s)')
+    argparser.add_argument('--profile',
+                           help='Write a JSON report of the time, rows and '
+                           'memory used by each phase to this file')
+    argparser.add_argument('--cprofile',
+                           help='Write a cProfile dump of the run to this file')
 
     subp = argparser.add_subparsers(help='Subcommand', dest='cmd')
     subp.required = True
@@ -624,6 +1754,142 @@ if __name__ == '__main__':  # pragma: no cover
     )                                                                   # noqa
     subp_cmds['grid']['parser'].set_defaults(display_days_post=182)
 
+    subp_cmds['check_doubletxn']['parser'].add_argument(
+        '--keys',
+        default='dues,id',
+        help='Comma separated list of keys to check (dues,tag,id,near)'
+    )
+    subp_cmds['check_doubletxn']['parser'].add_argument(
+        '--days',
+        type=int,
+        default=3,
+        help='How many days apart are "near" rows'
+    )
+    subp_cmds['check_doubletxn']['parser'].add_argument(
+        '--format',
+        choices=('text', 'json'),
+        default='text',
+        help='Output a human or machine readable report'
+    )
+
+    for cmd in ('stats', 'statstsv'):
+        subp_cmds[cmd]['parser'].add_argument(
+            '--stats-store',
+            help='File used to keep the stats of past months between runs'
+        )
+        subp_cmds[cmd]['parser'].add_argument(
+            '--window',
+            action='append',
+            type=int,
+            help='Add rolling stats over this many months (may be repeated)'
+        )
+
+    subp_cmds['stats']['parser'].add_argument(
+        '--sweep',
+        action='store_true',
+        help='Output the members and dues needed to break even as a TSV'
+    )
+    subp_cmds['stats']['parser'].add_argument(
+        '--sweep-dues',
+        help='Range of dues for the sweep, as start:stop[:step]'
+    )
+    subp_cmds['stats']['parser'].add_argument(
+        '--sweep-members',
+        help='Range of member counts for the sweep, as start:stop[:step]'
+    )
+
+    subp_cmds['history']['parser'].add_argument(
+        'dates',
+        nargs='*',
+        type=_parse_date,
+        help='Show the balance at each of these dates instead (YYYY-MM-DD)'
+    )
+
+    subp_cmds['json_payments']['parser'].add_argument(
+        '--coverage',
+        action='store_true',
+        help='Output the paid-through month, gaps and arrears of each member'
+    )
+
+    subp_cmds['bills_missing']['parser'].add_argument(
+        'tags',
+        nargs='*',
+        help='The bill hashtags to check (default: bills:rent bills:internet)'
+    )
+
+    subp_cmds['sqlite']['parser'].add_argument(
+        '--out',
+        default='ledger.db',
+        help='The database file to write (default: %(default)s)'
+    )
+    subp_cmds['query']['parser'].add_argument(
+        'sql',
+        help='The query to run, eg: "SELECT * FROM rows"'
+    )
+
+    subp_cmds['pages']['parser'].add_argument(
+        '--outdir',
+        default='pages',
+        help='Directory to write the generated files into'
+    )
+    subp_cmds['pages']['parser'].add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='How many files to render at the same time'
+    )
+
+    subp_cmds['fmt']['parser'].add_argument(
+        '--check',
+        action='store_true',
+        help='Only list the files that would change, failing if there are any'
+    )
+    subp_cmds['fmt']['parser'].add_argument(
+        'files',
+        nargs='*',
+        help='The files to rewrite (default: all the cash files)'
+    )
+
+    subp_cmds['verify']['parser'].add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='How many files to read at the same time'
+    )
+
+    subp_cmds['seal']['parser'].add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='How many files to read at the same time'
+    )
+    subp_cmds['seal']['parser'].add_argument(
+        '--force',
+        action='store_true',
+        help='Seal the files again, even if their seal is broken'
+    )
+
+    subp_cmds['diff']['parser'].add_argument(
+        'old',
+        help='The directory or git revision to compare from'
+    )
+    subp_cmds['diff']['parser'].add_argument(
+        'new',
+        help='The directory or git revision to compare to'
+    )
+
+    subp_cmds['serve']['parser'].add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help='The port to listen on (default: %(default)s)'
+    )
+    subp_cmds['serve']['parser'].add_argument(
+        '--bind',
+        default='',
+        help='The address to listen on (default: all addresses)'
+    )
+
     subp_cmds['jinja2']['parser'].add_argument(
         'template',
         action='store',
@@ -636,29 +1902,56 @@ if __name__ == '__main__':  # pragma: no cover
     if not os.path.exists(args.dir):
         raise RuntimeError('Directory "{}" does not exist'.format(args.dir))
 
-    if args.asof:
-        args.asof = datetime.datetime.strptime(args.asof, '%Y-%m-%d').date()
+    if args.rev and args.engine == 'sqlite':
+        raise RuntimeError('The sqlite engine cannot load a git revision')
 
-    # first, load the main data
-    args.rows = RowSet()
-    args.rows.load_directory(args.dir)
-
-    # next, optionally load additional directories
-    # TODO - make these loaders into a generic list of directories
-    if args.includefuture:
-        args.rows.load_directory(
-            os.path.join(args.dir, "future"),
-            skip_balance_check=True
-        )
-
-    # optionally split multi-month transactions into one per month
-    if args.split:
-        args.rows = args.rows.autosplit()
-
-    # apply any filters requested
     if args.asof:
-        args.rows = args.rows.filter_asof(args.asof)
-    args.rows = args.rows.filter(args.filter)
-
-    result = args.func(args)
-    print(result)
+        args.asof = _parse_date(args.asof)
+
+    if args.profile:
+        profiler.start()
+    if args.cprofile:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    try:
+        key = None
+        if args.cache:
+            from lib.cache import OutputCache
+            cache = OutputCache(args.cache)
+            key = cache_key(args)
+
+        found = False
+        if key:
+            found, result = cache.get(key)
+
+        if not found:
+            if subp_cmds[args.cmd].get('rows', True):
+                if args.engine == 'sqlite':
+                    args.rows = prepare_rows(args, sql_rows(args), False)
+                else:
+                    args.rows = prepare_rows(
+                        args, load_rows(args), args.split
+                    )
+
+            try:
+                with profiler.phase('command:' + args.cmd):
+                    result = args.func(args)
+            except CheckFailed as e:
+                print(e.report)
+                sys.exit(1)
+
+            if key:
+                cache.put(key, result)
+    finally:
+        if args.cprofile:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+        if args.profile:
+            import json
+            with open(args.profile, 'w') as f:
+                json.dump(profiler.stop().report(), f, indent=1)
+
+    if result is not None:
+        print(result)
@@ -0,0 +1,64 @@
+# Licensed under GPLv3
+import hashlib
+import json
+import os
+import tempfile
+
+
+def digest_files(filenames):
+    """Return a digest covering the name and content of each given file
+    """
+    h = hashlib.sha256()
+    for filename in filenames:
+        h.update(os.path.basename(filename).encode('utf8'))
+        h.update(b'\0')
+        with open(filename, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+class OutputCache(object):
+    """A content addressed store of previously generated output.
+
+    The caller is responsible for constructing a key that includes
+    everything that the output depends on - the cache simply hashes it
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    @staticmethod
+    def key(parts):
+        """Return a cache key constructed from a dict of simple values"""
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.dirname, key[0:2], key + '.json')
+
+    def get(self, key):
+        """Return a (found, output) tuple for the given key"""
+        try:
+            with open(self._filename(key), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return (False, None)
+
+        return (True, data['output'])
+
+    def put(self, key, output):
+        """Store the output for the given key.  The file is written
+        atomically so that concurrent runs never see a partial entry
+        """
+        filename = self._filename(key)
+        dirname = os.path.dirname(filename)
+        os.makedirs(dirname, exist_ok=True)
+
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'output': output}, f)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
@@ -0,0 +1,163 @@
+# Licensed under GPLv3
+
+
+class DuplicateIndex(object):
+    """Look for rows that appear to record the same transaction twice.
+
+    Every data row is hashed on each of the selected keys as it is added,
+    so the whole ledger is checked in a single pass.  The available keys
+    are:
+
+        dues    - same month, same "dues:*" hashtag and same value
+        tag     - same month, same hashtag and same value
+        id      - same "!id" bangtag (eg: a paypal transaction id)
+        near    - same hashtag and same value within a number of days
+
+    Rows that were split from the same source line (eg: with "!months")
+    are never considered to be duplicates of each other.
+    """
+
+    KEYS = ('dues', 'tag', 'id', 'near')
+
+    def __init__(self, keys=('dues', 'id'), days=3):
+        for key in keys:
+            if key not in self.KEYS:
+                raise ValueError('Unknown duplicate key "{}"'.format(key))
+        if days < 0:
+            raise ValueError("a negative number of days is nonsense")
+
+        self.keys = keys
+        self.days = days
+        self._buckets = {}
+        # the "near" key links pairs of rows, remember which group each
+        # linked row has ended up in
+        self._near_group = {}
+        self._near_groups = []
+
+    @staticmethod
+    def _source(row):
+        """Return something that identifies the source line of a row"""
+        if row.filename is None:
+            return id(row)
+        return (row.filename, row.line_number)
+
+    def _hash_keys(self, row):
+        """Return the (keyname, key) tuples that this row is hashed on"""
+        result = []
+
+        if 'dues' in self.keys and row.hashtag is not None:
+            if row.hashtag.startswith('dues:'):
+                result.append(('dues', (row.month, row.hashtag, row.value)))
+
+        if 'tag' in self.keys and row.hashtag is not None:
+            result.append(('tag', (row.month, row.hashtag, row.value)))
+
+        if 'id' in self.keys and 'id' in row.bangtags:
+            result.append(('id', tuple(row.bangtags['id'])))
+
+        return result
+
+    def _add_hashed(self, keyname, key, row):
+        bucket = self._buckets.setdefault((keyname, key), [])
+        source = self._source(row)
+        for other in bucket:
+            if self._source(other) == source:
+                return
+        bucket.append(row)
+
+    def _near_link(self, row, other):
+        """Join the groups of two rows found to be near each other"""
+        group = self._near_group.get(id(row))
+        group_other = self._near_group.get(id(other))
+
+        if group is None and group_other is None:
+            group = [row, other]
+            self._near_groups.append(group)
+        elif group is None:
+            group = group_other
+            group.append(row)
+        elif group_other is None:
+            group.append(other)
+        elif group is not group_other:
+            group.extend(group_other)
+            group_other.clear()
+            for member in group:
+                self._near_group[id(member)] = group
+
+        self._near_group[id(row)] = group
+        self._near_group[id(other)] = group
+
+    def _add_near(self, row):
+        """Compare the row with the others in the neighbouring day buckets.
+        With buckets one wider than the allowed number of days, any near
+        row must be in this bucket or the one either side of it.
+        """
+        width = self.days + 1
+        day = row.date.toordinal()
+        index = day // width
+        source = self._source(row)
+
+        for i in (index - 1, index, index + 1):
+            key = ('near', (row.hashtag, row.value, i))
+            for other in self._buckets.get(key, []):
+                if self._source(other) == source:
+                    continue
+                if abs(other.date.toordinal() - day) <= self.days:
+                    self._near_link(row, other)
+
+        key = ('near', (row.hashtag, row.value, index))
+        self._buckets.setdefault(key, []).append(row)
+
+    def add(self, row):
+        """Add a single row to the index"""
+        if not row.isdata:
+            return
+
+        for keyname, key in self._hash_keys(row):
+            self._add_hashed(keyname, key, row)
+
+        if 'near' in self.keys and row.hashtag is not None:
+            self._add_near(row)
+
+    def load_RowSet(self, rowset):
+        """Load a RowSet into the index"""
+        for row in rowset:
+            self.add(row)
+
+    def collisions(self):
+        """Return a list of (keyname, rows) tuples for every group of rows
+        that collided, with the rows in each group sorted by file and line
+        """
+        def keyfn(row):
+            return (row.filename or '', row.line_number or 0)
+
+        result = []
+        for (keyname, key), rows in self._buckets.items():
+            if keyname == 'near':
+                continue
+            if len(rows) > 1:
+                result.append((keyname, sorted(rows, key=keyfn)))
+
+        for group in self._near_groups:
+            if group:
+                result.append(('near', sorted(group, key=keyfn)))
+
+        result.sort(key=lambda x: (keyfn(x[1][0]), x[0]))
+        return result
+
+    @staticmethod
+    def collisions_dict(collisions):
+        """Convert the collisions into simple types, ready for json output"""
+        result = []
+        for keyname, rows in collisions:
+            result.append({
+                'key': keyname,
+                'rows': [{
+                    'file': row.filename,
+                    'line': row.line_number,
+                    'date': row.date.isoformat(),
+                    'value': str(row.value),
+                    'row': str(row),
+                } for row in rows],
+            })
+        return result
@@ -0,0 +1,101 @@
+# Licensed under GPLv3
+import subprocess
+
+
+class GitObjects(object):
+    """Read the files recorded at any revision of a git repository, without
+    touching the working tree.
+
+    The content of each file is read with a single long running
+    "git cat-file --batch" process, so reading many files only starts git
+    once.  The parsed dict is kept for the users of the file content, to
+    remember anything derived from each blob (eg: its parsed rows) - as a
+    blob with the same hash always has the same content.
+
+    The paths are relative to the repo directory, which can be anywhere in
+    the working tree, and the returned filenames are relative to the top
+    of the repository.
+    """
+
+    def __init__(self, repo='.'):
+        self.repo = repo
+        self.parsed = {}
+        self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _git(self, *args):
+        """Run a git command and return its output"""
+        result = subprocess.run(
+            ['git', '-C', self.repo] + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            raise ValueError('git {} failed: {}'.format(
+                args[0], result.stderr.decode('utf8', 'replace').strip()
+            ))
+        return result.stdout
+
+    def prefix(self):
+        """Return the path of the repo directory from the top of the
+        repository, as used at the start of the returned filenames
+        """
+        return self._git('rev-parse', '--show-prefix').decode('utf8').strip()
+
+    def tree(self, rev, path='.'):
+        """Return the hash of the directory tree at the given revision"""
+        output = self._git('rev-parse', '--verify', '{}:./{}'.format(rev, path))
+        return output.decode('ascii').strip()
+
+    def ls_tree(self, rev, path='.'):
+        """Return a sorted list of (filename, blob) tuples for each file
+        directly within the directory at the given revision
+        """
+        output = self._git(
+            'ls-tree', '-z', '--full-name', rev, '--', path.rstrip('/') + '/'
+        )
+
+        result = []
+        for entry in output.decode('utf8').split('\0'):
+            if not entry:
+                continue
+            meta, filename = entry.split('\t', 1)
+            mode, kind, blob = meta.split()
+            if kind == 'blob':
+                result.append((filename, blob))
+        return sorted(result)
+
+    def read(self, blob):
+        """Return the content of the blob with the given hash"""
+        if self._process is None:
+            self._process = subprocess.Popen(
+                ['git', '-C', self.repo, 'cat-file', '--batch'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+
+        self._process.stdin.write(blob.encode('ascii') + b'\n')
+        self._process.stdin.flush()
+
+        header = self._process.stdout.readline().split()
+        if len(header) != 3 or header[1] != b'blob':
+            raise ValueError('git object {} is not a blob'.format(blob))
+
+        data = self._process.stdout.read(int(header[2]))
+        # the content is followed by a newline
+        self._process.stdout.read(1)
+        return data
+
+    def close(self):
+        """Stop the git process, if it was started"""
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        self._process.wait()
+        self._process.stdout.close()
+        self._process = None
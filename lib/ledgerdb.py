@@ -0,0 +1,216 @@
+# Licensed under GPLv3
+import decimal
+import json
+import re
+import sqlite3
+
+from lib.rowset import RowSet
+
+
+def _regexp(pattern, string):
+    """The SQL REGEXP function, matching the same way as the row filters"""
+    return re.search(pattern, str(string), re.I) is not None
+
+
+class LedgerDB(object):
+    """A SQLite copy of the ledger, for ad-hoc queries.
+
+    Each data line from the cash files is stored in the "lines" table and
+    the rows that autosplit turns it into are stored in the "rows" table,
+    referring back to their line - so any split can be undone by grouping
+    on the line_id.  The bangtags of each row are in the "bangtags" table.
+
+    The digest and total value of each file is stored too, so that when
+    the database is updated only the files that have changed need to be
+    loaded again.  Each of those is loaded starting with the total of all
+    the files before it, so its balance pragmas are still checked.
+
+    The config should describe everything else that the rows depend on,
+    if it changes then the whole database is rebuilt.
+
+    SQLite cannot store a Decimal, so the values are stored as numbers
+    along with their number of decimal places ("scale"), which is enough
+    to turn them (and their sums) back into the exact Decimal values.
+    """
+
+    VERSION = 2
+
+    TABLES = ('bangtags', 'rows', 'lines', 'files', 'meta')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            filename TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            total TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS lines (
+            id INTEGER PRIMARY KEY,
+            filename TEXT NOT NULL
+                REFERENCES files(filename) ON DELETE CASCADE,
+            line INTEGER,
+            value NUMERIC,
+            date TEXT,
+            text TEXT
+        );
+        CREATE TABLE IF NOT EXISTS rows (
+            id INTEGER PRIMARY KEY,
+            line_id INTEGER NOT NULL
+                REFERENCES lines(id) ON DELETE CASCADE,
+            split_index INTEGER,
+            value NUMERIC,
+            scale INTEGER,
+            date TEXT,
+            month TEXT,
+            taxyearhk TEXT,
+            hashtag TEXT,
+            location TEXT,
+            comment TEXT
+        );
+        CREATE TABLE IF NOT EXISTS bangtags (
+            row_id INTEGER NOT NULL
+                REFERENCES rows(id) ON DELETE CASCADE,
+            name TEXT,
+            args TEXT
+        );
+        CREATE INDEX IF NOT EXISTS lines_filename ON lines(filename);
+        CREATE INDEX IF NOT EXISTS rows_line_id ON rows(line_id);
+        CREATE INDEX IF NOT EXISTS rows_hashtag ON rows(hashtag);
+        CREATE INDEX IF NOT EXISTS rows_location ON rows(location);
+        CREATE INDEX IF NOT EXISTS rows_month ON rows(month);
+        CREATE INDEX IF NOT EXISTS rows_taxyearhk ON rows(taxyearhk);
+        CREATE INDEX IF NOT EXISTS bangtags_row_id ON bangtags(row_id);
+        CREATE INDEX IF NOT EXISTS bangtags_name ON bangtags(name, args);
+    """
+
+    def __init__(self, filename, config=None):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.create_function('regexp', 2, _regexp, deterministic=True)
+
+        config = dict(config or {})
+        config['version'] = self.VERSION
+        config = json.dumps(config, sort_keys=True)
+
+        try:
+            stored = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'config'"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            stored = None
+
+        with self.db:
+            if stored is None or stored[0] != config:
+                for table in self.TABLES:
+                    self.db.execute('DROP TABLE IF EXISTS {}'.format(table))
+            self.db.executescript(self.SCHEMA)
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('config', ?)", (config,)
+            )
+
+    def close(self):
+        self.db.close()
+
+    def _next_id(self, table):
+        return self.db.execute(
+            'SELECT coalesce(max(id), 0) + 1 FROM {}'.format(table)
+        ).fetchone()[0]
+
+    def _insert(self, filename, digest, rowset, opening):
+        """Add the rows loaded from one file"""
+        line_id = self._next_id('lines')
+        row_id = self._next_id('rows')
+
+        lines = []
+        rows = []
+        bangtags = []
+        for line in rowset:
+            if not line.isdata:
+                continue
+
+            lines.append((
+                line_id, filename, line.line_number,
+                str(line.value), line.date.isoformat(), str(line),
+            ))
+
+            for index, row in enumerate(line.autosplit()):
+                rows.append((
+                    row_id, line_id, index,
+                    str(row.value),
+                    max(0, -row.value.as_tuple().exponent),
+                    row.date.isoformat(),
+                    row.date.strftime('%Y-%m'),
+                    row.taxyearhk,
+                    row.hashtag,
+                    row.bangtags.get('locn', [None])[0],
+                    row.comment,
+                ))
+                for name, args in row.bangtags.items():
+                    bangtags.append((row_id, name, ':'.join(args)))
+                row_id += 1
+
+            line_id += 1
+
+        self.db.execute(
+            'INSERT INTO files VALUES (?, ?, ?)',
+            (filename, digest, str(rowset.balance - opening)),
+        )
+        self.db.executemany(
+            'INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?)', lines
+        )
+        self.db.executemany(
+            'INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+        )
+        self.db.executemany('INSERT INTO bangtags VALUES (?, ?, ?)', bangtags)
+
+    def update(self, digests):
+        """Bring the database up to date with the given files.  The digests
+        are a dict of the current digest of each file, in the order that
+        the files are to be loaded.  Everything is done in a single
+        transaction, and the list of loaded files is returned
+        """
+        stored = {}
+        totals = {}
+        for filename, digest, total in self.db.execute('SELECT * FROM files'):
+            stored[filename] = digest
+            totals[filename] = decimal.Decimal(total)
+
+        changed = [
+            filename for filename, digest in digests.items()
+            if stored.get(filename) != digest
+        ]
+        removed = sorted([
+            filename for filename in stored if filename not in digests
+        ])
+
+        with self.db:
+            for filename in removed + changed:
+                self.db.execute(
+                    'DELETE FROM files WHERE filename = ?', (filename,)
+                )
+
+            reload = set(changed)
+            balance = decimal.Decimal(0)
+            for filename in digests:
+                if filename not in reload:
+                    balance += totals[filename]
+                    continue
+
+                rowset = RowSet()
+                rowset.balance = balance
+                rowset.load_file(filename, skip_balance_check=True)
+                self._insert(filename, digests[filename], rowset, balance)
+                balance = rowset.balance
+
+        return changed
+
+    def query(self, sql, params=()):
+        """Run a query, returning the list of column names and the rows"""
+        cursor = self.db.execute(sql, params)
+        if cursor.description is None:
+            return [], []
+        columns = [x[0] for x in cursor.description]
+        return columns, cursor.fetchall()
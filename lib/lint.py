@@ -0,0 +1,284 @@
+# Licensed under GPLv3
+import decimal
+import glob
+import os
+
+from lib.duplicates import DuplicateIndex
+from lib.row import Row, RowData
+from lib.verify import FileSummary, check_chain, check_seals
+
+ERROR = 'error'
+WARNING = 'warning'
+
+
+class Diagnostic(object):
+    """A problem found on one line of a cash file"""
+
+    def __init__(self, filename, line_number, severity, message):
+        self.filename = filename
+        self.line_number = line_number
+        self.severity = severity
+        self.message = message
+
+    def __str__(self):
+        return '{}:{}: {}: {}'.format(
+            self.filename, self.line_number, self.severity, self.message
+        )
+
+
+class Validator(object):
+    """One of the checks run by the Linter.
+
+    The Linter calls these methods as it reads through the files, so each
+    check sees every row without needing to load the files again.  Each
+    row is visited as it was parsed and then each of the rows that it is
+    split into is visited.  Any problem is recorded with error() or
+    warning()
+    """
+
+    def __init__(self):
+        self.diagnostics = []
+        self.future = False
+
+    def error(self, row, message):
+        self.diagnostics.append(
+            Diagnostic(row.filename, row.line_number, ERROR, message)
+        )
+
+    def warning(self, row, message):
+        self.diagnostics.append(
+            Diagnostic(row.filename, row.line_number, WARNING, message)
+        )
+
+    def begin_file(self, filename, future):
+        """Called before the first row of each file"""
+        self.future = future
+
+    def visit(self, row):
+        """Called with each row, in the order found in the file"""
+        pass
+
+    def visit_split(self, row):
+        """Called with each row that a data row is split into"""
+        pass
+
+    def end_file(self, filename, lines):
+        """Called after the last row of each file, with all its lines"""
+        pass
+
+    def finish(self):
+        """Called once all of the files have been read"""
+        pass
+
+
+class ChainValidator(Validator):
+    """Check the balance pragmas and the seals of the regular files.  Each
+    file is summarised as it is read and the chain of files is checked at
+    the end, with the same checks as the verify sub-command.
+
+    The sum of all the regular rows is also checked, as the cash can
+    never have a negative balance
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.summaries = []
+        self.summary = None
+        self.last = None
+        self.sealed = 0
+
+    def begin_file(self, filename, future):
+        super().begin_file(filename, future)
+        self.summary = None if future else FileSummary()
+
+    def visit(self, row):
+        if self.summary is None:
+            return
+
+        self.summary.add(row.line_number, row)
+        if isinstance(row, RowData):
+            self.last = row
+
+    def end_file(self, filename, lines):
+        if self.summary is not None:
+            self.summaries.append((filename, self.summary.result(lines)))
+
+    def finish(self):
+        problems, balance = check_chain(self.summaries)
+        broken, self.sealed = check_seals(self.summaries)
+        for problem in problems + broken:
+            self.diagnostics.append(Diagnostic(
+                problem.filename, problem.line_number, ERROR, problem.message
+            ))
+
+        total = sum(
+            [decimal.Decimal(summary['delta']) for _, summary in self.summaries],
+            decimal.Decimal(0)
+        )
+        if total < 0:
+            self.error(
+                self.last,
+                'Impossible negative value cash balance: {}'.format(total)
+            )
+
+
+class LocationValidator(Validator):
+    """Check that every actual row has a location, once they are needed.
+    The split rows are checked, as a row split into later months can need
+    a location even though the date of the row itself does not.  Each
+    source line is only reported once
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reported = set()
+
+    def visit_split(self, row):
+        if row.isforecast or 'locn_xfer' in row.bangtags:
+            return
+
+        try:
+            row.location
+        except ValueError as e:
+            source = (row.filename, row.line_number)
+            if source not in self.reported:
+                self.reported.add(source)
+                self.error(row, str(e))
+
+
+class LocnXferValidator(Validator):
+    """Check that each location transfer can be split into its two rows"""
+
+    def visit(self, row):
+        if not isinstance(row, RowData) or 'locn_xfer' not in row.bangtags:
+            return
+
+        if len(row.bangtags['locn_xfer']) != 3:
+            self.error(row, 'locn_xfer must be !locn_xfer:<from>:<to>:<amount>')
+            return
+
+        try:
+            row._split_locn_xfer()
+        except (ValueError, decimal.InvalidOperation) as e:
+            self.error(row, str(e) or 'locn_xfer amount is not a number')
+
+
+class ForecastValidator(Validator):
+    """Warn about forecast rows outside of the future files, and actual
+    rows inside them
+    """
+
+    def visit(self, row):
+        if not isinstance(row, RowData):
+            return
+
+        if self.future and not row.isforecast:
+            self.warning(row, 'Row in a future file without a !forecast tag')
+        elif not self.future and row.isforecast:
+            self.warning(row, 'Forecast row in a regular cash file')
+
+
+class DuplicateValidator(Validator):
+    """Check for regular rows that appear to record the same transaction"""
+
+    def __init__(self, keys=('dues', 'id'), days=3):
+        super().__init__()
+        self.index = DuplicateIndex(keys=keys, days=days)
+
+    def visit_split(self, row):
+        if not self.future:
+            self.index.add(row)
+
+    def finish(self):
+        for keyname, rows in self.index.collisions():
+            first = rows[0]
+            for row in rows[1:]:
+                self.error(row, 'Duplicate transaction ({}) of {}:{}'.format(
+                    keyname, first.filename, first.line_number
+                ))
+
+
+def default_validators():
+    """Return a new instance of each of the standard checks"""
+    return [
+        ChainValidator(),
+        LocationValidator(),
+        LocnXferValidator(),
+        ForecastValidator(),
+        DuplicateValidator(),
+    ]
+
+
+class Linter(object):
+    """Read the cash files once, running all of the validators over each
+    row, and collect every problem found instead of stopping at the first.
+
+    The syntax of each line and splitting each data row are checked by
+    the Linter itself, the rows that fail are not passed on to the
+    validators.
+    """
+
+    def __init__(self, validators=None):
+        if validators is None:
+            validators = default_validators()
+        self.validators = validators
+        self.diagnostics = []
+        self.files = 0
+
+    def lint_file(self, filename, future=False):
+        """Check one file, future files do not have balance pragmas"""
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+
+        self.files += 1
+        for validator in self.validators:
+            validator.begin_file(filename, future)
+
+        for line_number, text in enumerate(lines, 1):
+            try:
+                row = Row.fromTxt(text.rstrip('\n'))
+            except Exception as e:
+                self.diagnostics.append(Diagnostic(
+                    filename, line_number, ERROR, 'Syntax error: {}'.format(e)
+                ))
+                continue
+            row.filename = filename
+            row.line_number = line_number
+
+            for validator in self.validators:
+                validator.visit(row)
+
+            if not isinstance(row, RowData):
+                continue
+
+            try:
+                split = row.autosplit()
+            except Exception as e:
+                self.diagnostics.append(Diagnostic(
+                    filename, line_number, ERROR, 'Cannot split: {}'.format(e)
+                ))
+                continue
+
+            for child in split:
+                for validator in self.validators:
+                    validator.visit_split(child)
+
+        for validator in self.validators:
+            validator.end_file(filename, lines)
+
+    def lint_directory(self, dirname, future=False):
+        """Check all of the cash files in the directory, in order"""
+        for filename in sorted(glob.glob(os.path.join(dirname, '*.txt'))):
+            self.lint_file(filename, future)
+
+    def finish(self):
+        """Return the list of every Diagnostic found, sorted by file and
+        line
+        """
+        result = list(self.diagnostics)
+        for validator in self.validators:
+            validator.finish()
+            result += validator.diagnostics
+
+        result.sort(key=lambda x: (x.filename, x.line_number))
+        return result
@@ -0,0 +1,113 @@
+# Licensed under GPLv3
+import decimal
+
+
+class MemberCoverage(object):
+    """An index of which months each member's dues have paid for.
+
+    This is built in one pass over the split rows, so a "!months"
+    prepayment covers each of the months that it was split into.  Any
+    forecast dues rows (eg: from "future/dues.txt") are remembered as the
+    amount expected from that member in each month, and are used to find
+    the months that are in arrears.
+    """
+
+    def __init__(self):
+        # for each member, a dict of the total paid in each month
+        self.paid = {}
+        # for each member, a dict of the forecast amount in each month
+        self.expected = {}
+
+    def add(self, row):
+        """Add a single row to the index"""
+        if not row.isdata or row.hashtag is None:
+            return
+        if not row.hashtag.startswith('dues:'):
+            return
+
+        month = row.date.replace(day=1)
+        if row.isforecast:
+            months = self.expected.setdefault(row.hashtag, {})
+        else:
+            months = self.paid.setdefault(row.hashtag, {})
+
+        months[month] = months.get(month, decimal.Decimal(0)) + row.value
+
+    def load_RowSet(self, rowset):
+        """Load a RowSet into the index"""
+        for row in rowset:
+            self.add(row)
+
+    def members(self):
+        """Return a sorted list of all the members that have paid dues or
+        are forecast to
+        """
+        return sorted(set(self.paid.keys()) | set(self.expected.keys()))
+
+    def first(self, member):
+        """Return the first month that the member has paid for, if any"""
+        months = self.paid.get(member)
+        if not months:
+            return None
+        return min(months)
+
+    def paid_through(self, member):
+        """Return the last month that the member has paid for, if any"""
+        months = self.paid.get(member)
+        if not months:
+            return None
+        return max(months)
+
+    def gaps(self, member):
+        """Return the list of months between the first and last paid month
+        that the member did not pay for
+        """
+        months = self.paid.get(member)
+        if not months:
+            return []
+
+        this = min(months)
+        last = max(months)
+
+        gaps = []
+        while this < last:
+            if this not in months:
+                gaps.append(this)
+            this = _next_month(this)
+        return gaps
+
+    def arrears(self, member, month_now):
+        """Return the list of (month, amount) for each forecast month, up to
+        and including the given month, that was not fully paid
+        """
+        paid = self.paid.get(member, {})
+
+        arrears = []
+        for month, expected in sorted(self.expected.get(member, {}).items()):
+            if month > month_now:
+                break
+            short = expected - paid.get(month, 0)
+            if short > 0:
+                arrears.append((month, short))
+        return arrears
+
+    def result(self, month_now):
+        """Return a dict with the coverage details of each member"""
+        r = {}
+        for member in self.members():
+            arrears = self.arrears(member, month_now)
+            r[member] = {
+                'first': self.first(member),
+                'paid_through': self.paid_through(member),
+                'gaps': self.gaps(member),
+                'forecast': member in self.expected,
+                'arrears_months': [month for month, short in arrears],
+                'arrears': sum([short for month, short in arrears]),
+            }
+        return r
+
+
+def _next_month(date):
+    if date.month == 12:
+        return date.replace(year=date.year + 1, month=1)
+    return date.replace(month=date.month + 1)
@@ -0,0 +1,145 @@
+# Licensed under GPLv3
+import threading
+import time
+import tracemalloc
+
+
+class _NullPhase(object):
+    """The phase returned when profiling is not enabled - it does nothing
+    at all, so the instrumentation can stay in the code
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def rows(self, rows):
+        pass
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase(object):
+    """A phase of the processing that is being timed"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        stack.append(self.name)
+
+        self.record = {
+            'name': '/'.join(stack),
+            'depth': len(stack) - 1,
+            'start': time.perf_counter() - self.profiler.started,
+            'seconds': None,
+            'rows': None,
+            'allocated': None,
+        }
+        self.profiler.records.append(self.record)
+
+        if self.profiler.trace_malloc:
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record['seconds'] = time.perf_counter() - self._time
+        if self.profiler.trace_malloc:
+            memory = tracemalloc.get_traced_memory()[0]
+            self.record['allocated'] = memory - self._memory
+
+        self.profiler._stack().pop()
+        return False
+
+    def rows(self, rows):
+        """Record how many rows this phase produced"""
+        self.record['rows'] = len(rows)
+
+
+class Profiler(object):
+    """Record the wall time, row counts and memory allocations of each of
+    the named phases of a run.
+
+    Phases can be nested, and each thread has its own stack of phases.
+    The memory allocations are the change in the memory traced by
+    tracemalloc, so they include anything allocated by other threads at
+    the same time.
+    """
+
+    def __init__(self, trace_malloc=True):
+        self.trace_malloc = trace_malloc
+        self.records = []
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.peak = None
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.trace_malloc:
+            tracemalloc.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        if self.trace_malloc:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def phase(self, name):
+        """Return a context manager that times the named phase"""
+        return _Phase(self, name)
+
+    def report(self):
+        """Return the profile as simple types, ready for json output"""
+        return {
+            'elapsed': self.elapsed,
+            'peak_memory': self.peak,
+            'phases': self.records,
+        }
+
+
+# The profiler for this process, if profiling has been enabled
+_active = None
+
+
+def start(trace_malloc=True):
+    """Enable profiling of all the phases from now on"""
+    global _active
+    _active = Profiler(trace_malloc=trace_malloc)
+    _active.start()
+    return _active
+
+
+def stop():
+    """Disable profiling, returning the profiler with the results"""
+    global _active
+    profiler = _active
+    _active = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def phase(name):
+    """Return a context manager that times the named phase, if profiling
+    is enabled.  Use as:
+
+        with profiler.phase('load') as p:
+            rows = load()
+            p.rows(rows)
+    """
+    if _active is None:
+        return _null_phase
+    return _active.phase(name)
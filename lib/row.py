@@ -37,6 +37,12 @@ class Row(object):
     def __str__(self):
         return ""
 
+    def canonical(self, width=0):
+        """Output the row in the canonical format written by "fmt".  The
+        width is the size of the value column, which only data rows use
+        """
+        return str(self).rstrip()
+
     def __add__(self, other):
         if isinstance(other, Row):
             other = other.value
@@ -58,6 +64,8 @@ class Row(object):
         self.isdata = False
         self.location = None
         self.taxyearhk = None
+        self.filename = None
+        self.line_number = None
 
     def _getvalue_simple(self, field):
         """return the field value as a simple number or string
@@ -248,6 +256,33 @@ class RowData(Row):
 
         return ' '.join(fields)
 
+    def canonical(self, width=0):
+        """Output the row in the canonical format written by "fmt" - the
+        value column padded to the given width, followed by the date, any
+        comment text, the hashtag and then the bangtags in name order
+        """
+        # The tags are removed from the comment text and added back after
+        text = re.sub(r'{[^}]*}', '', self._comment)
+        fields = text.split()
+
+        if self.hashtag:
+            fields.append('#' + self.hashtag)
+        for k in sorted(self.bangtags):
+            fields.append('!' + ':'.join([k] + self.bangtags[k]))
+
+        return '{:<{}}  {}  {}'.format(
+            str(self.value), width, str(self.date), ' '.join(fields)
+        )
+
+    def _new_child(self, value, date):
+        """Return a new row derived from this one, remembering which line
+        of which file it originally came from
+        """
+        new = RowData(value, date, self._comment)
+        new.filename = self.filename
+        new.line_number = self.line_number
+        return new
+
     def __init__(self, value, date, comment):
         if not isinstance(date, datetime.date):
             raise ValueError("{} is not a date object".format(date))
@@ -258,6 +293,8 @@ class RowData(Row):
         self.date = date
         self.comment = comment
         self.isdata = True
+        self.filename = None
+        self.line_number = None
 
         if 'months' in self.bangtags and 'forecast' in self.bangtags:
             raise ValueError('Cannot have both months and forecast bang tags')
@@ -588,14 +625,14 @@ class RowData(Row):
         amount = decimal.Decimal(self.bangtags['locn_xfer'][2])
 
         # FIXME: DRY
-        row_source = RowData(-amount, self.date, self._comment)
+        row_source = self._new_child(-amount, self.date)
         row_source.comment = self.comment + ' !locn:{}'.format(source)
 
         # mutate the bangtags to show this is a child
         row_source._set_bangtag('child', ['locn_xfer'])
 
         # FIXME: DRY
-        row_dest = RowData(amount, self.date, self._comment)
+        row_dest = self._new_child(amount, self.date)
         row_dest.comment = self.comment + ' !locn:{}'.format(dest)
 
         # mutate the bangtags to show this is a child
@@ -627,14 +664,15 @@ class RowData(Row):
         rows = []
         this = self.date
         while this <= lastdate:
-            new = RowData(self.value, this, self._comment)
+            new = self._new_child(self.value, this)
             if self.hashtag:
                 new.hashtag = self.hashtag
 
             new.bangtags = self.bangtags.copy()
 
-            # mutate the bangtags to show this is a child
-            new.bangtags['forecast'][0] = 'child'
+            # mark the bangtags to show this is a child, without changing
+            # the bangtags of this row
+            new.bangtags['forecast'] = ['child'] + args[1:]
 
             rows.append(new)
 
@@ -686,7 +724,7 @@ class RowData(Row):
             for date in dates:
                 this_value = each_value + remainder
                 remainder = 0  # only add the remainder to the first child
-                new = RowData(this_value, date, self._comment)
+                new = self._new_child(this_value, date)
                 if self.hashtag:
                     new.hashtag = self.hashtag
 
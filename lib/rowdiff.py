@@ -0,0 +1,131 @@
+# Licensed under GPLv3
+import decimal
+import os
+
+from lib.rowset import value_normalise
+
+
+def _text(row):
+    """Return the comment of the row in the canonical format, so that the
+    spacing and the order of the tags do not matter
+    """
+    return row.canonical().split('  ', 2)[2]
+
+
+class RowDiff(object):
+    """The differences between the data rows of two ledgers.
+
+    The rows of both are joined with a hash table on their file, date,
+    value and comment - any rows left over are then paired up as changed
+    if they only differ by their value, or by their comment.  Each pass is
+    linear, so large ledgers can be compared quickly.
+
+    The filename of each row is made relative to the root directory given
+    for its ledger, so a working tree can be compared with a git revision.
+
+    The change that each difference makes to the cells of the monthly grid
+    (month by hashtag) is added up as the rows are compared - after the
+    rows are split, if asked to.
+    """
+
+    def __init__(self, split=True):
+        self.split = split
+        self.added = []
+        # (old, new) tuples
+        self.changed = []
+        self.removed = []
+        # for each (month, hashtag), the change in its total
+        self.cells = {}
+        self.balance_old = decimal.Decimal(0)
+        self.balance_new = decimal.Decimal(0)
+
+    @staticmethod
+    def _keyed(rowset, root):
+        """Return a list of the data rows of the rowset, each in a
+        (filename, row) tuple
+        """
+        result = []
+        for row in rowset:
+            if row.isdata:
+                result.append((os.path.relpath(row.filename, root or '.'), row))
+        return result
+
+    @staticmethod
+    def _join(old, new, keyfn):
+        """Pair up the rows from old and new that have the same key,
+        returning the pairs and the rows of each that were left over
+        """
+        buckets = {}
+        for item in old:
+            buckets.setdefault(keyfn(item), []).append(item)
+
+        pairs = []
+        left_new = []
+        for item in new:
+            bucket = buckets.get(keyfn(item))
+            if bucket:
+                pairs.append((bucket.pop(0), item))
+            else:
+                left_new.append(item)
+
+        left_old = [item for bucket in buckets.values() for item in bucket]
+        return pairs, left_old, left_new
+
+    def _cells(self, row, sign):
+        """Add the change to the grid cells from adding or removing a row"""
+        rows = row.autosplit() if self.split else [row]
+        for child in rows:
+            key = (child.month, child.hashtag or 'unknown')
+            self.cells[key] = self.cells.get(key, 0) + sign * child.value
+
+    def load_RowSets(self, old, new, root_old=None, root_new=None):
+        """Compare the rows of two RowSets"""
+        old = self._keyed(old, root_old)
+        new = self._keyed(new, root_new)
+
+        for filename, row in old:
+            self.balance_old += row.value
+        for filename, row in new:
+            self.balance_new += row.value
+
+        def exact(item):
+            filename, row = item
+            return (filename, row.date, row.value, _text(row))
+
+        def same_value(item):
+            filename, row = item
+            return (filename, row.date, row.value)
+
+        def same_text(item):
+            filename, row = item
+            return (filename, row.date, _text(row))
+
+        pairs, old, new = self._join(old, new, exact)
+        for keyfn in (same_text, same_value):
+            pairs, old, new = self._join(old, new, keyfn)
+            for (filename_old, row_old), (filename_new, row_new) in pairs:
+                self.changed.append((row_old, row_new))
+                self._cells(row_old, -1)
+                self._cells(row_new, 1)
+
+        for filename, row in old:
+            self.removed.append(row)
+            self._cells(row, -1)
+        for filename, row in new:
+            self.added.append(row)
+            self._cells(row, 1)
+
+        def keyfn(row):
+            return (row.filename, row.line_number)
+
+        self.added.sort(key=keyfn)
+        self.removed.sort(key=keyfn)
+        self.changed.sort(key=lambda x: keyfn(x[1]))
+
+        # Changes that cancel out within a cell are not interesting
+        self.cells = {k: v for k, v in self.cells.items() if v != 0}
+
+    @property
+    def balance(self):
+        """Return the change in the final balance"""
+        return value_normalise(self.balance_new - self.balance_old)
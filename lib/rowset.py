@@ -1,4 +1,7 @@
 # Licensed under GPLv3
+import bisect
+import calendar
+import datetime
 import decimal
 import os
 import sys
@@ -9,6 +12,15 @@ from lib.row import RowPragmaBalance
 from lib.row import RowData
 
 
+def value_normalise(value):
+    """ensure that values that have been promoted to have some digits
+    of significance return to being simple integers when possible.
+    """
+    if int(value) == value:
+        value = value.to_integral_exact()
+    return value
+
+
 class RowSet(object):
     """Contain a bunch of rows, allowing statistics to be done on them
     """
@@ -25,10 +37,20 @@ class RowSet(object):
         return len(self.rows)
 
     def __str__(self):
-        s = ""
-        for entry in self.rows:
-            s += str(entry) + "\n"
-        return s
+        return ''.join([str(entry) + "\n" for entry in self.rows])
+
+    def write(self, stream, canonical=False):
+        """Write the rows to the stream in the same format as the input
+        file, or in the canonical format with the value column aligned
+        """
+        if not canonical:
+            for entry in self:
+                stream.write(str(entry) + "\n")
+            return
+
+        width = max([len(str(row.value)) for row in self], default=0)
+        for entry in self:
+            stream.write(entry.canonical(width) + "\n")
 
     @property
     def value(self):
@@ -39,12 +61,7 @@ class RowSet(object):
         if self.balance != sum:
             raise ValueError("here {} {}".format(self.balance, sum))
 
-        # ensure that values that have been promoted to have some digits
-        # of significance return to being simple integers when possible.
-        if int(sum) == sum:
-            sum = sum.to_integral_exact()
-
-        return sum
+        return value_normalise(sum)
 
     def _add_one_value(self, item):
         """Given an object that looks like a Row, add its data to our current set
@@ -82,16 +99,35 @@ class RowSet(object):
         else:
             raise ValueError('dont know how to append {}'.format(item))
 
-    def load_file(self, stream, skip_balance_check=False):
-        """Given an open file handle, read Row lines into this RowSet
+    @staticmethod
+    def parse_lines(lines, filename):
+        """Parse the lines of one file into a list of Row objects.  Every
+        line is tried before the last syntax error found is raised
         """
-        if isinstance(stream, str):
-            filename = stream
-            stream = open(filename, 'r')
-        else:
-            filename = '(stream)'
-        line_number = 0
+        rows = []
+        last_error = None
+        for line_number, text in enumerate(lines, 1):
+            try:
+                obj = Row.fromTxt(text.rstrip('\n'))
+                obj.filename = filename
+                obj.line_number = line_number
+            except Exception as e:
+                print("{}:{} Syntax error".format(filename, line_number), file=sys.stderr)
+                last_error = e
+                continue
+
+            rows.append(obj)
+
+        if last_error is not None:
+            print("Error: at least one syntax error. Trace is from last", file=sys.stderr)
+            raise last_error
 
+        return rows
+
+    def load_rows(self, rows, filename, skip_balance_check=False):
+        """Append the parsed rows of one file to this RowSet, checking the
+        balance pragmas against the running balance
+        """
         need_balance = True
 
         # TODO
@@ -102,17 +138,7 @@ class RowSet(object):
         if skip_balance_check:
             need_balance = False
 
-        last_error = None
-        for row in stream.readlines():
-            row = row.rstrip('\n')
-            line_number += 1
-
-            try:
-                obj = Row.fromTxt(row)
-            except Exception as e:
-                print("{}:{} Syntax error".format(filename, line_number), file=sys.stderr)
-                last_error = e
-
+        for obj in rows:
             if isinstance(obj, RowPragmaBalance):
                 # TODO - move more of the pragma logic in to the pragma class
 
@@ -122,7 +148,7 @@ class RowSet(object):
                         'ated {}'.
                         format(
                             filename,
-                            line_number,
+                            obj.line_number,
                             obj.balance,
                             self.balance
                         )
@@ -138,9 +164,19 @@ class RowSet(object):
 
             self.append(obj)
 
-        if last_error is not None:
-            print("Error: at least one syntax error. Trace is from last", file=sys.stderr)
-            raise last_error
+    def load_file(self, stream, skip_balance_check=False):
+        """Given an open file handle, read Row lines into this RowSet
+        """
+        if isinstance(stream, str):
+            filename = stream
+            with open(filename, 'r') as f:
+                lines = f.readlines()
+        else:
+            filename = '(stream)'
+            lines = stream.readlines()
+
+        rows = self.parse_lines(lines, filename)
+        self.load_rows(rows, filename, skip_balance_check)
 
     def load_directory(self, dirname, skip_balance_check=False):
         """Given the pathname to a directory, load all the relevant files found
@@ -155,6 +191,34 @@ class RowSet(object):
         for filename in files:
             self.load_file(filename, skip_balance_check)
 
+    def load_git(self, rev, path='cash', skip_balance_check=False, git=None):
+        """Load all the relevant files found in the directory as recorded at
+        the given git revision, reading them straight from the git objects
+        so that the working tree is not touched.
+
+        Each parsed file is kept by the GitObjects, using the hash of its
+        blob, so loading many revisions with the same GitObjects only
+        parses the files that have changed
+        """
+        from lib.gitobjects import GitObjects
+
+        if git is None:
+            with GitObjects() as git:
+                return self.load_git(rev, path, skip_balance_check, git)
+
+        for filename, blob in git.ls_tree(rev, path):
+            if not filename.endswith('.txt'):
+                continue
+
+            key = (filename, blob)
+            rows = git.parsed.get(key)
+            if rows is None:
+                text = git.read(blob).decode('utf8')
+                rows = self.parse_lines(text.splitlines(True), filename)
+                git.parsed[key] = rows
+
+            self.load_rows(rows, filename, skip_balance_check)
+
     def filter(self, filter_strings):
         """Apply the given list of human readable filters to the rows
         """
@@ -299,6 +363,33 @@ class RowSet(object):
 
         return grid
 
+    def location_ledger(self):
+        """Sweep the rowset once and return a ledger of the cash held at
+        each location"""
+
+        ledger = LocationLedger()
+        ledger.load_RowSet(self)
+
+        return ledger
+
+    def bill_matrix(self):
+        """Sweep the rowset once and return a table of the outgoing payments
+        in each month for each hashtag"""
+
+        matrix = BillMatrix()
+        matrix.load_RowSet(self)
+
+        return matrix
+
+    def asof_index(self):
+        """Sweep the rowset once and return an index of the running balance
+        at the end of each day"""
+
+        index = AsofIndex()
+        index.load_RowSet(self)
+
+        return index
+
     def last(self):
         """Return the chronologically last row from the rowset
         """
@@ -362,6 +453,25 @@ class RowGrid(object):
 
         return self._headings_x.keys()
 
+    def column(self, value_x):
+        """Return a RowSet of all the rows with the given x heading"""
+        return self._headings_x[value_x]
+
+    def running_balance(self):
+        """Return a dict of the balance of all the rows up to and including
+        each x heading, as a (value, isforecast) tuple.  The balances are
+        found with one pass over the sorted x headings (eg: months)
+        """
+        result = {}
+        balance = decimal.Decimal(0)
+        isforecast = False
+        for value_x in sorted(self._headings_x):
+            column = self._headings_x[value_x]
+            balance += column.value
+            isforecast = isforecast or column.isforecast
+            result[value_x] = (value_normalise(balance), isforecast)
+        return result
+
     @property
     def headings_y(self):
         return self.rows.keys()
@@ -385,3 +495,273 @@ class RowGrid(object):
             result.append(fn(arg))
 
         return result
+
+
+class BillCell(object):
+    """The payments for one bill in one month"""
+
+    def __init__(self):
+        self._value = decimal.Decimal(0)
+        self.last = None
+        self.isforecast = False
+        # has anything actually been paid, not just forecast
+        self.ispaid = False
+
+    def _add_row(self, row):
+        self._value += row.value
+        if self.last is None or row.date > self.last:
+            self.last = row.date
+        if row.isforecast:
+            self.isforecast = True
+        else:
+            self.ispaid = True
+
+    @property
+    def value(self):
+        return value_normalise(self._value)
+
+
+class BillMatrix(object):
+    """Contain the outgoing payments as a month by hashtag table.
+
+    Each cell holds the total paid, the date of the last payment and
+    whether any of the payments are a forecast, so a report of the bills
+    can be made without grouping or scanning the rows again.
+    """
+
+    def __init__(self):
+        # for each month, a dict of the BillCell for each hashtag
+        self.cells = {}
+        self._tags = set()
+
+    def _add_row(self, row):
+        """Add a single outgoing row into the table"""
+        tag = row.hashtag
+        if tag is None:
+            tag = 'unknown'
+
+        month = row.date.replace(day=1)
+        cells = self.cells.setdefault(month, {})
+        if tag not in cells:
+            cells[tag] = BillCell()
+            self._tags.add(tag)
+
+        cells[tag]._add_row(row)
+
+    def load_RowSet(self, rowset):
+        """Load the outgoing rows from a RowSet into the table"""
+        for row in rowset:
+            if row.direction == 'outgoing':
+                self._add_row(row)
+
+    @property
+    def months(self):
+        """Return a sorted list of every month with any payments"""
+        return sorted(self.cells)
+
+    @property
+    def tags(self):
+        """Return a sorted list of every hashtag that has been paid"""
+        return sorted(self._tags)
+
+    def cell(self, month, tag):
+        """Return the BillCell for the given month and tag, or None if
+        nothing was paid"""
+        return self.cells.get(month, {}).get(tag)
+
+    def missing(self, month, tags=None):
+        """Return the sorted list of the given tags (or every tag, if none
+        are given) that have no payment in the given month - a cell with
+        only forecast payments has not been paid
+        """
+        if tags is None:
+            tags = self._tags
+        cells = self.cells.get(month.replace(day=1), {})
+        return sorted([
+            tag for tag in tags if tag not in cells or not cells[tag].ispaid
+        ])
+
+
+class AsofIndex(object):
+    """Contain the running balance of a RowSet at the end of each day.
+
+    The data rows are sorted by date once, when the index is loaded, so
+    that the balance as of any date can then be found with a binary search
+    instead of another pass over all of the rows.
+    """
+
+    def __init__(self):
+        # each distinct date, in order
+        self.dates = []
+        # the balance at the end of each date
+        self.balances = []
+
+    def load_RowSet(self, rowset):
+        """Load a RowSet into the index"""
+        rows = sorted(
+            (row for row in rowset if row.isdata), key=lambda row: row.date
+        )
+
+        balance = decimal.Decimal(0)
+        for row in rows:
+            balance += row.value
+            if self.dates and self.dates[-1] == row.date:
+                self.balances[-1] = balance
+            else:
+                self.dates.append(row.date)
+                self.balances.append(balance)
+
+    def _find(self, date):
+        """Return the index of the last date on or before the given date,
+        or -1 if there is none
+        """
+        return bisect.bisect_right(self.dates, date) - 1
+
+    def balance(self, date):
+        """Return the balance of all the rows up to and including the date"""
+        i = self._find(date)
+        if i < 0:
+            return value_normalise(decimal.Decimal(0))
+        return value_normalise(self.balances[i])
+
+    def month_ends(self):
+        """Return the last day of every month from the first row to the
+        last
+        """
+        if not self.dates:
+            return []
+
+        result = []
+        year = self.dates[0].year
+        month = self.dates[0].month
+        last = (self.dates[-1].year, self.dates[-1].month)
+        while (year, month) <= last:
+            day = calendar.monthrange(year, month)[1]
+            result.append(datetime.date(year, month, day))
+            month += 1
+            if month > 12:
+                year += 1
+                month = 1
+        return result
+
+
+class LocationLedger(object):
+    """Contain the balance of each location "locn" bangtag.
+
+    A "!locn_xfer" row is recorded as a pair of signed entries - one
+    leaving the source location and one arriving at the destination -
+    without constructing any new Row objects for them.
+    """
+
+    def __init__(self):
+        # for each location, a list of (row, value, xfer_location) tuples
+        self.entries = {}
+        self._balances = {}
+        # for each location, a dict of the total change in each month
+        self._deltas = {}
+
+    def _add_entry(self, location, row, value, xfer):
+        """Add a single signed entry to the given location"""
+        if location not in self.entries:
+            self.entries[location] = []
+            self._balances[location] = decimal.Decimal(0)
+            self._deltas[location] = {}
+
+        self.entries[location].append((row, value, xfer))
+        self._balances[location] += value
+
+        if row.date is None:
+            # Pragmas, comments and blank lines have no month
+            return
+
+        month = row.date.replace(day=1)
+        deltas = self._deltas[location]
+        deltas[month] = deltas.get(month, 0) + value
+
+    def _add_xfer(self, row):
+        """Add both sides of a locn_xfer row"""
+        if row.value != 0:
+            raise ValueError('locn_xfer unbalanced - '
+                             'value is {}'.format(row.value))
+        if 'locn' in row.bangtags:
+            raise ValueError('Row has multiple !locn tags')
+
+        source = row.bangtags['locn_xfer'][0]
+        dest = row.bangtags['locn_xfer'][1]
+        amount = decimal.Decimal(row.bangtags['locn_xfer'][2])
+
+        # The locations named in the transfer are held to the same
+        # validation as any other !locn tag
+        row._xtag_validate('!', 'locn:' + source)
+        row._xtag_validate('!', 'locn:' + dest)
+
+        self._add_entry(source, row, -amount, source)
+        self._add_entry(dest, row, amount, dest)
+
+    def load_RowSet(self, rowset):
+        """Load a RowSet into the ledger"""
+        for row in rowset:
+            if row.isdata and 'locn_xfer' in row.bangtags:
+                self._add_xfer(row)
+                continue
+
+            location = row.location
+            if location is None:
+                location = 'unknown'
+
+            self._add_entry(location, row, row.value, None)
+
+    @property
+    def locations(self):
+        """Return the name of each location found"""
+        return self.entries.keys()
+
+    @property
+    def locations_width(self):
+        """How wide do we need to make a column to fit all the locations?
+        mostly intended as a helper for jinja templates.
+        """
+
+        return max([len(i) for i in self.locations], default=0)
+
+    def value(self, location):
+        """Return the balance held at the given location"""
+        return value_normalise(self._balances[location])
+
+    def entries_str(self, location):
+        """Return the entries for one location, in the same format as the
+        input file - with transfers shown as their location specific side
+        """
+        s = []
+        for row, value, xfer in self.entries[location]:
+            if xfer is None:
+                s.append(str(row))
+            else:
+                s.append('{} {} {} !locn:{}'.format(
+                    value, row.date, row.comment, xfer
+                ))
+            s.append("\n")
+        return ''.join(s)
+
+    @property
+    def months(self):
+        """Return a sorted list of every month with any location activity"""
+        months = set()
+        for deltas in self._deltas.values():
+            months.update(deltas.keys())
+        return sorted(months)
+
+    def timeline(self):
+        """Return a list of (month, {location: balance}) tuples, giving the
+        running balance of each location at the end of every month
+        """
+        running = {location: 0 for location in self._deltas}
+        result = []
+        for month in self.months:
+            for location, deltas in self._deltas.items():
+                running[location] += deltas.get(month, 0)
+            result.append((month, {
+                location: value_normalise(decimal.Decimal(value))
+                for location, value in running.items()
+            }))
+        return result
@@ -0,0 +1,144 @@
+# Licensed under GPLv3
+import hashlib
+import http.server
+import mimetypes
+import os
+import threading
+
+from lib.cache import digest_files
+
+
+class PageModel(object):
+    """The pages offered by the HTTP server, with the input rows kept in
+    memory between requests.
+
+    The inputs function returns the list of files that the pages are made
+    from and the loader function reads them, returning a dict of the
+    functions that render each page.  A page is rendered the first time
+    it is asked for and is then kept until the inputs change - which is
+    checked cheaply with the size and modification time of each file,
+    only digesting their content if those change.
+
+    The optional salt function returns anything else that the pages
+    depend on (eg: today's date)
+
+    Requests may come from many threads at once, so a lock is held while
+    loading or rendering to make sure that each is only done once.
+    """
+
+    def __init__(self, inputs, loader, salt=None):
+        self.inputs = inputs
+        self.loader = loader
+        self.salt = salt
+        self.lock = threading.Lock()
+        self.etag = None
+        self._signature = None
+        self._pages = {}
+        self._output = {}
+
+    def _stat(self, files):
+        signature = []
+        for filename in files:
+            st = os.stat(filename)
+            signature.append((filename, st.st_mtime_ns, st.st_size))
+        if self.salt is not None:
+            signature.append(self.salt())
+        return signature
+
+    def refresh(self):
+        """Load the inputs again, if they have changed.  The lock must be
+        held by the caller
+        """
+        files = self.inputs()
+        signature = self._stat(files)
+        if signature == self._signature:
+            return
+
+        h = hashlib.sha256(digest_files(files).encode('utf8'))
+        if self.salt is not None:
+            h.update(str(self.salt()).encode('utf8'))
+        etag = '"{}"'.format(h.hexdigest())
+
+        if etag != self.etag:
+            # If the loader fails, the signature is left unchanged so
+            # that the next request will try again
+            self._pages = self.loader()
+            self._output = {}
+            self.etag = etag
+
+        self._signature = signature
+
+    def get(self, name):
+        """Return a (etag, body) tuple for the named page, or None if there
+        is no such page
+        """
+        with self.lock:
+            self.refresh()
+            if name not in self._pages:
+                return None
+
+            if name not in self._output:
+                body = self._pages[name]()
+                if isinstance(body, str):
+                    body = body.encode('utf8')
+                self._output[name] = body
+
+            return (self.etag, self._output[name])
+
+
+def content_type(name):
+    """Return the Content-Type header to send with the named page"""
+    mimetype, encoding = mimetypes.guess_type(name)
+    if mimetype is None:
+        mimetype = 'application/octet-stream'
+    if mimetype.startswith('text/') or mimetype == 'application/json':
+        mimetype += '; charset=utf-8'
+    return mimetype
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    """Answer GET requests from the PageModel of the server"""
+
+    def _send(self, head=False):
+        name = self.path.split('?')[0].lstrip('/') or 'index.html'
+
+        try:
+            page = self.server.model.get(name)
+        except Exception as e:
+            self.send_error(500, explain=str(e))
+            return
+
+        if page is None:
+            self.send_error(404)
+            return
+
+        etag, body = page
+        match = self.headers.get('If-None-Match', '')
+        if etag in [x.strip() for x in match.split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type(name))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._send()
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+
+def make_server(model, port, bind=''):
+    """Return a threaded HTTP server for the given PageModel"""
+    server = http.server.ThreadingHTTPServer((bind, port), PageHandler)
+    server.daemon_threads = True
+    server.model = model
+    return server
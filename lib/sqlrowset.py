@@ -0,0 +1,296 @@
+# Licensed under GPLv3
+import datetime
+import decimal
+import re
+
+from lib.row import Row
+from lib.rowset import RowSet, RowGrid, value_normalise
+
+
+def _decimal(number, scale):
+    """Turn a number from the database back into the exact Decimal, given
+    the number of decimal places of the values that it was made from
+    """
+    if number is None:
+        return decimal.Decimal(0)
+
+    number = decimal.Decimal(number)
+    if scale:
+        number = number.quantize(
+            decimal.Decimal(1).scaleb(-scale),
+            rounding=decimal.ROUND_HALF_EVEN,
+        )
+
+    # floating point sums can end up as a tiny negative number
+    if number.is_zero():
+        number = number.copy_abs()
+    return number
+
+
+class SQLRowSet(RowSet):
+    """A RowSet storage engine that keeps the rows in a LedgerDB.
+
+    Instead of holding a list of rows, this holds the SQL conditions that
+    select its rows.  Filtering or grouping just adds more conditions and
+    the values are summed by the database - the rows are only loaded when
+    something iterates over them.
+
+    The database only holds the split rows, so autosplit() does nothing.
+    """
+
+    # The SQL for each of the row fields that can be used in a filter or
+    # to group by.  Anything that is None when using the in-memory engine
+    # is NULL here
+    FIELDS = {
+        'value': 'rows.value',
+        'date': 'rows.date',
+        'month': 'rows.month',
+        'hashtag': 'rows.hashtag',
+        'location': 'rows.location',
+        'taxyearhk': 'rows.taxyearhk',
+        'comment': 'rows.comment',
+        'isdata': '1',
+        'direction':
+            "CASE WHEN rows.value < 0 THEN 'outgoing' ELSE 'incoming' END",
+        'isforecast':
+            'EXISTS (SELECT 1 FROM bangtags WHERE bangtags.row_id = rows.id'
+            " AND bangtags.name = 'forecast')",
+        'category_prefix1':
+            "CASE WHEN instr(rows.hashtag, ':') > 0"
+            " THEN substr(rows.hashtag, 1, instr(rows.hashtag, ':') - 1)"
+            ' ELSE rows.hashtag END',
+        # approximate the relative number of months with 28 days per
+        # month, exactly as the rows do
+        'rel_months':
+            "CAST((julianday(rows.month || '-01') - julianday('{now}'))"
+            ' / 28.0 AS INTEGER)',
+    }
+
+    def __init__(self, db, where=None, params=None):
+        self.db = db
+        self.where = where or []
+        self.params = params or []
+        self._value = None
+        self._isforecast = None
+
+    def _field(self, field):
+        """Return the SQL for the named row field"""
+        if field not in self.FIELDS:
+            raise ValueError('Cannot use the field "{}" with SQL'.format(field))
+
+        now = datetime.datetime.now().date()
+        return self.FIELDS[field].format(now=now.replace(day=1).isoformat())
+
+    def _derive(self, where, params):
+        """Return a new SQLRowSet with an additional condition"""
+        return SQLRowSet(self.db, self.where + [where], self.params + params)
+
+    def _where(self):
+        if not self.where:
+            return ''
+        return ' WHERE ' + ' AND '.join(self.where)
+
+    def _execute(self, select, tail=''):
+        sql = 'SELECT {} FROM rows{}{}'.format(select, self._where(), tail)
+        return self.db.db.execute(sql, self.params)
+
+    def _rows(self, tail=''):
+        """Generate the Row objects that match, loading each source line
+        once and splitting it again to get its split rows
+        """
+        sql = (
+            'SELECT rows.line_id, rows.split_index,'
+            ' lines.filename, lines.line, lines.text'
+            ' FROM rows JOIN lines ON lines.id = rows.line_id'
+            '{}{}'
+        ).format(self._where(), tail or ' ORDER BY rows.id')
+        cursor = self.db.db.execute(sql, self.params)
+
+        split_line = None
+        split = None
+        for line_id, index, filename, line_number, text in cursor:
+            if line_id != split_line:
+                line = Row.fromTxt(text)
+                line.filename = filename
+                line.line_number = line_number
+                split = line.autosplit()
+                split_line = line_id
+            yield split[index]
+
+    def __iter__(self):
+        return self._rows()
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def __len__(self):
+        return self._execute('count(*)').fetchone()[0]
+
+    def __str__(self):
+        return ''.join([str(row) + "\n" for row in self])
+
+    @property
+    def value(self):
+        if self._value is None:
+            total, scale = self._execute(
+                'sum(rows.value), max(rows.scale)'
+            ).fetchone()
+            self._value = value_normalise(_decimal(total, scale))
+        return self._value
+
+    @property
+    def isforecast(self):
+        if self._isforecast is None:
+            found = self._execute('max({})'.format(self._field('isforecast')))
+            self._isforecast = bool(found.fetchone()[0])
+        return self._isforecast
+
+    def append(self, item):
+        raise ValueError('A SQLRowSet cannot be appended to')
+
+    def _filter_one(self, string):
+        """Translate one human readable filter into a SQL condition"""
+        m = re.match("([a-z0-9_]+)([=!<>~]{1,2})(.*)", string, re.I)
+        if not m:
+            raise ValueError('filters must be <key><op><value>')
+
+        field = self._field(m.group(1))
+        op = m.group(2)
+        value_match = m.group(3)
+
+        if op == '=~':
+            return ('regexp(?, {})'.format(field), [value_match])
+        if op == '!~':
+            return ('NOT regexp(?, {})'.format(field), [value_match])
+
+        # coerce our value to match into a number, if that looks possible
+        try:
+            value_match = float(value_match)
+        except ValueError:
+            pass
+
+        # The in-memory rows treat a None as very negative when comparing
+        if op == '==':
+            return ('{} = ?'.format(field), [value_match])
+        if op == '!=':
+            return ('({0} IS NULL OR {0} != ?)'.format(field), [value_match])
+        if op in ('<', '<='):
+            return (
+                '({0} IS NULL OR {0} {1} ?)'.format(field, op),
+                [value_match]
+            )
+        if op in ('>', '>='):
+            return ('{} {} ?'.format(field, op), [value_match])
+
+        raise ValueError('Unknown filter operation "{}"'.format(op))
+
+    def filter(self, filter_strings):
+        """Apply the given list of human readable filters to the rows
+        """
+        result = self
+        for s in filter_strings or []:
+            result = result._derive(*self._filter_one(s))
+        return result
+
+    def filter_asof(self, asof_date):
+        """Filter out all rows after the asof_date
+        """
+        return self._derive('rows.date <= ?', [asof_date.isoformat()])
+
+    def filter_forecast(self):
+        """Attempt to remove forecast lines that have a matching actual line.
+        This is only done in memory, but with no forecasts there is nothing
+        to remove
+        """
+        if not self.isforecast:
+            return self
+
+        rows = RowSet()
+        rows.append(list(self))
+        return rows.filter_forecast()
+
+    def autosplit(self):
+        return self
+
+    @staticmethod
+    def _key(field, key):
+        """Convert a group key from the database to match the in-memory
+        engine
+        """
+        if key is None:
+            return 'unknown'
+        if field == 'month':
+            return datetime.datetime.strptime(key, '%Y-%m').date()
+        if field == 'isforecast':
+            return bool(key)
+        if field == 'value':
+            return decimal.Decimal(key)
+        return key
+
+    @staticmethod
+    def _key_where(sql, key):
+        """Return the condition that selects the rows with the given key"""
+        if key is None:
+            return ('{} IS NULL'.format(sql), [])
+        return ('{} = ?'.format(sql), [key])
+
+    def group_by(self, field):
+        """Group the rowset by the given row field and return groups as a dict
+        """
+        sql = self._field(field)
+        cursor = self._execute(
+            '{}, sum(rows.value), max(rows.scale)'.format(sql),
+            ' GROUP BY 1 ORDER BY min(rows.id)'
+        )
+
+        result = {}
+        for key, total, scale in cursor.fetchall():
+            group = self._derive(*self._key_where(sql, key))
+            group._value = value_normalise(_decimal(total, scale))
+            result[self._key(field, key)] = group
+        return result
+
+    def grid_by(self, field_x, field_y):
+        """Group the rowset into a grid by the given two fields and return
+        a grid object"""
+        sql_x = self._field(field_x)
+        sql_y = self._field(field_y)
+        cursor = self._execute(
+            '{}, {}, sum(rows.value), max(rows.scale), max({})'.format(
+                sql_x, sql_y, self._field('isforecast')
+            ),
+            ' GROUP BY 1, 2 ORDER BY min(rows.id)'
+        )
+
+        grid = RowGrid()
+        grid.field_x = field_x
+        grid.field_y = field_y
+
+        for x, y, total, scale, isforecast in cursor.fetchall():
+            key_x = self._key(field_x, x)
+            key_y = self._key(field_y, y)
+
+            heading = grid._headings_x.get(key_x)
+            if heading is None:
+                heading = self._derive(*self._key_where(sql_x, x))
+                heading._isforecast = False
+                grid._headings_x[key_x] = heading
+
+            cell = heading._derive(*self._key_where(sql_y, y))
+            cell._value = value_normalise(_decimal(total, scale))
+            cell._isforecast = bool(isforecast)
+
+            grid.rows.setdefault(key_y, {})[key_x] = cell
+
+            if isforecast:
+                heading._isforecast = True
+                grid.isforecast = True
+
+        return grid
+
+    def last(self):
+        """Return the chronologically last row from the rowset
+        """
+        for row in self._rows(' ORDER BY rows.date DESC, rows.id LIMIT 1'):
+            return row
+        raise ValueError('last() of an empty rowset')
@@ -0,0 +1,354 @@
+# Licensed under GPLv3
+import collections
+import datetime
+import decimal
+import json
+import os
+import tempfile
+
+from lib.rowset import value_normalise
+
+
+class StatsColumn(object):
+    """Accumulate the finance stats for one column of the stats report.
+
+    Each row is looked at only once, adding it to every total that it
+    belongs to - rather than filtering a RowSet once for each total.
+    """
+
+    def __init__(self):
+        self.incoming = decimal.Decimal(0)
+        self.outgoing = decimal.Decimal(0)
+        self.dues = decimal.Decimal(0)
+        self.other = decimal.Decimal(0)
+        self.members = set()
+        self.outgoing_months = set()
+
+    def add(self, row):
+        """Add a single row to the totals"""
+        value = row.value
+        hashtag = row.hashtag
+        isdues = hashtag is not None and hashtag.startswith('dues:')
+
+        if value > 0:
+            self.incoming += value
+            if not isdues:
+                self.other += value
+        elif value < 0:
+            self.outgoing += value
+            if row.date is not None:
+                self.outgoing_months.add(row.date.replace(day=1))
+
+        # TODO - values of zero?  we have one member as such, but it is a
+        # exceptional case
+        if isdues:
+            self.dues += value
+            self.members.add(hashtag)
+
+    def merge(self, other):
+        """Add the totals from another column into this one"""
+        self.incoming += other.incoming
+        self.outgoing += other.outgoing
+        self.dues += other.dues
+        self.other += other.other
+        self.members |= other.members
+        self.outgoing_months |= other.outgoing_months
+
+    def to_dict(self):
+        """Return the accumulated totals as simple types, ready for json"""
+        return {
+            'incoming': str(self.incoming),
+            'outgoing': str(self.outgoing),
+            'dues': str(self.dues),
+            'other': str(self.other),
+            'members': sorted(self.members),
+            'outgoing_months': sorted(
+                [x.isoformat() for x in self.outgoing_months]
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """Return a new column from the output of to_dict()"""
+        column = cls()
+        for tag in ('incoming', 'outgoing', 'dues', 'other'):
+            setattr(column, tag, decimal.Decimal(d[tag]))
+        column.members = set(d['members'])
+        column.outgoing_months = set([
+            datetime.date.fromisoformat(x) for x in d['outgoing_months']
+        ])
+        return column
+
+    def result(self):
+        """Return a dict of the stats values for this column"""
+        r = {}
+        for tag in ('incoming', 'outgoing', 'dues', 'other'):
+            r[tag] = value_normalise(getattr(self, tag))
+
+        r['members'] = len(self.members)
+        if r['members']:
+            r['ARPM'] = int(r['dues'] / r['members'])
+        else:
+            r['ARPM'] = -1
+
+        # How many months had any outgoing transactions
+        r['months'] = len(self.outgoing_months)
+
+        return r
+
+
+class Stats(object):
+    """Sweep a RowSet once, accumulating the stats for each past month, the
+    total of all past months and the current month-to-date
+    """
+
+    def __init__(self):
+        self.months = {}
+        self.monthtd = StatsColumn()
+
+    @staticmethod
+    def _past_month(row):
+        """Return the month that a row is counted in by load_RowSet(), as
+        the date of the first day of that month.  Returns None for a row
+        in the current month or a future month, and for a row without a
+        date (eg: a pragma), as these are not counted in any past month
+        """
+        rel_months = row.rel_months
+        if rel_months is not None and rel_months >= 0:
+            return None
+
+        if row.date is None:
+            return None
+
+        return row.date.replace(day=1)
+
+    def load_RowSet(self, rowset, store=None):
+        """Load a RowSet into the stats.
+
+        If a StatsStore is given, any past month that it holds which has
+        not had any of its source files changed is taken from the store
+        and only the remaining months are calculated from the rows.
+        """
+        dirty = None
+        # the months taken from the store, which are not calculated again.
+        # Any other month is calculated, even if it was not dirty (eg: the
+        # month that was the current month when the store was saved)
+        stored = set()
+        if store is not None:
+            dirty = store.dirty_months(rowset, self._past_month)
+            for month, column in store.columns().items():
+                if month not in dirty:
+                    self.months[month] = column
+                    stored.add(month)
+
+        for row in rowset:
+            rel_months = row.rel_months
+            if rel_months == 0:
+                self.monthtd.add(row)
+                continue
+
+            # stats are only likely to be valid for previous months
+            if rel_months is not None and rel_months > 0:
+                continue
+            if row.date is None:
+                continue
+
+            month = row.date.replace(day=1)
+            if month in stored:
+                continue
+
+            if month not in self.months:
+                self.months[month] = StatsColumn()
+            self.months[month].add(row)
+
+            if store is not None:
+                store.add_source(month, row.filename)
+
+        if store is not None:
+            store.update(self.months, dirty)
+
+    def total(self):
+        """Return a column with the totals of all the past months"""
+        total = StatsColumn()
+        for column in self.months.values():
+            total.merge(column)
+        return total
+
+
+class RollingWindow(object):
+    """Slide a window of a fixed number of months along the monthly stats,
+    keeping running sums so that each step costs the same no matter how
+    big the window is
+    """
+
+    FIELDS = ('outgoing', 'incoming', 'dues', 'members')
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("a window must contain at least one month")
+        self.size = size
+        self._window = collections.deque()
+        self._sums = {field: 0 for field in self.FIELDS}
+
+    def add(self, result):
+        """Add the next month's stats result to the window.  Returns the
+        window stats, or None if the window is not yet full
+        """
+        self._window.append(result)
+        for field in self.FIELDS:
+            self._sums[field] += result[field]
+
+        if len(self._window) > self.size:
+            old = self._window.popleft()
+            for field in self.FIELDS:
+                self._sums[field] -= old[field]
+
+        if len(self._window) < self.size:
+            return None
+
+        return self.result()
+
+    def result(self):
+        """Return a dict of the sums and averages in the current window"""
+        r = {}
+        for field in self.FIELDS:
+            r[field + '_sum'] = value_normalise(
+                decimal.Decimal(self._sums[field])
+            )
+            r[field + '_avg'] = r[field + '_sum'] / self.size
+
+        r['members_avg'] = int(r['members_avg'])
+
+        # Average revenue per member month
+        if self._sums['members']:
+            r['ARPM'] = int(self._sums['dues'] / self._sums['members'])
+        else:
+            r['ARPM'] = -1
+
+        return r
+
+
+def rolling(results, months, size):
+    """Given the stats results for a sorted list of months, return a dict
+    of the rolling window stats ending at each month
+    """
+    window = RollingWindow(size)
+    return {month: window.add(results[month]) for month in months}
+
+
+class StatsStore(object):
+    """A persistent store of the stats for each past month.
+
+    Along with the stats, the store remembers which source files each
+    month was calculated from, and the digest of every source file.  A
+    month only needs to be calculated again if one of the files it was
+    calculated from changes, or if a changed file now has rows in that
+    month (eg: a "!months" split reaching back into it).
+
+    The config should describe everything else that the stats depend on
+    (eg: commandline options), if it changes then the store is discarded.
+    """
+
+    def __init__(self, filename, config, digests):
+        """The digests are a dict of the current digest of each source
+        file that might be loaded
+        """
+        self.filename = filename
+        self.config = config
+        self.digests = digests
+        self._sources = {}
+        self._stored = set()
+
+        self.data = {'config': config, 'digests': {}, 'months': {}}
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get('config') == config:
+            self.data = data
+
+    def _changed_files(self):
+        """Return the set of filenames that have changed since last time"""
+        old = self.data['digests']
+        changed = set()
+        for filename in set(old.keys()) | set(self.digests.keys()):
+            if old.get(filename) != self.digests.get(filename):
+                changed.add(filename)
+        return changed
+
+    def dirty_months(self, rowset, past_month):
+        """Return the set of past months that need to be calculated again.
+        Any month not in the store at all is dirty too, but as it will not
+        be taken from the store it does not need to be listed.
+        """
+        changed = self._changed_files()
+
+        dirty = set()
+        for monthstr, entry in self.data['months'].items():
+            for filename in entry['sources']:
+                if filename in changed or filename not in self.digests:
+                    dirty.add(datetime.date.fromisoformat(monthstr))
+                    break
+
+        # The changed files may now have rows in months that they did not
+        # have before
+        for row in rowset:
+            if row.filename in changed or row.filename not in self.digests:
+                month = past_month(row)
+                if month is not None:
+                    dirty.add(month)
+
+        self._stored = set([
+            datetime.date.fromisoformat(x) for x in self.data['months']
+        ])
+        return dirty
+
+    def columns(self):
+        """Return a dict of all the stored columns"""
+        return {
+            datetime.date.fromisoformat(month):
+                StatsColumn.from_dict(entry['column'])
+            for month, entry in self.data['months'].items()
+        }
+
+    def add_source(self, month, filename):
+        """Record that a row from the given file was counted in the month"""
+        self._sources.setdefault(month, set()).add(filename)
+
+    def update(self, months, dirty):
+        """Replace the dirty or missing months with newly calculated ones"""
+        for month, column in months.items():
+            if month in self._stored and month not in dirty:
+                continue
+
+            sources = self._sources.get(month, set())
+            if None in sources:
+                # Rows that did not come from a file cannot be tracked
+                self.data['months'].pop(month.isoformat(), None)
+                continue
+
+            self.data['months'][month.isoformat()] = {
+                'sources': sorted(sources),
+                'column': column.to_dict(),
+            }
+
+        # Any dirty month that had no rows this time has gone away
+        for month in dirty:
+            if month not in months:
+                self.data['months'].pop(month.isoformat(), None)
+
+        self.data['digests'] = self.digests
+
+    def save(self):
+        """Write the store back to its file"""
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+            os.replace(tmpname, self.filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
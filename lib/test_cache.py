@@ -0,0 +1,52 @@
+""" Perform tests on the cache.py
+"""
+
+import os
+
+from lib import cache
+from lib.testcase import TmpDirTestCase
+
+
+class TestOutputCache(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = cache.OutputCache(self.dir)
+
+    def test_key(self):
+        key1 = cache.OutputCache.key({'a': 1, 'b': 2})
+        key2 = cache.OutputCache.key({'b': 2, 'a': 1})
+        key3 = cache.OutputCache.key({'a': 1, 'b': 3})
+
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_get_put(self):
+        key = cache.OutputCache.key({'a': 1})
+
+        self.assertEqual(self.cache.get(key), (False, None))
+
+        self.cache.put(key, "some output")
+        self.assertEqual(self.cache.get(key), (True, "some output"))
+
+        self.cache.put(key, None)
+        self.assertEqual(self.cache.get(key), (True, None))
+
+    def test_put_failed(self):
+        """A failed write leaves nothing behind in the cache"""
+        key = cache.OutputCache.key({'a': 1})
+
+        with self.assertRaises(TypeError):
+            self.cache.put(key, object())
+
+        self.assertEqual(self.cache.get(key), (False, None))
+        self.assertEqual(os.listdir(os.path.join(self.dir, key[0:2])), [])
+
+    def test_digest_files(self):
+        filename = self._write('a.txt', 'one')
+        digest1 = cache.digest_files([filename])
+
+        self._write('a.txt', 'two')
+        digest2 = cache.digest_files([filename])
+
+        self.assertNotEqual(digest1, digest2)
@@ -0,0 +1,90 @@
+""" Perform tests on the duplicates.py
+"""
+
+import unittest
+
+from io import StringIO
+
+from lib import rowset
+from lib.duplicates import DuplicateIndex
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    input_data = """#balance 0
+500 1970-01-03 #dues:test1
+500 1970-01-20 #dues:test1
+500 1970-02-03 #dues:test1
+10 1970-01-05 #fridge
+10 1970-01-07 #fridge
+10 1970-01-30 #fridge
+20 1970-01-05 !id:cac:1234
+20 1970-03-05 !id:cac:1234
+300 1970-04-01 #dues:test2 !months:3 !id:cac:99
+"""
+
+    def setUp(self):
+        self.rows = rowset.RowSet()
+        self.rows.load_file(StringIO(self.input_data))
+        self.rows = self.rows.autosplit()
+
+    def tearDown(self):
+        self.rows = None
+
+    def collisions(self, **kwargs):
+        index = DuplicateIndex(**kwargs)
+        index.load_RowSet(self.rows)
+        return [
+            (keyname, [row.line_number for row in rows])
+            for keyname, rows in index.collisions()
+        ]
+
+    def test_default(self):
+        self.assertEqual(
+            self.collisions(),
+            [('dues', [2, 3]), ('id', [8, 9])]
+        )
+
+    def test_tag(self):
+        self.assertEqual(
+            self.collisions(keys=('tag',)),
+            [('tag', [2, 3]), ('tag', [5, 6, 7])]
+        )
+
+    def test_near(self):
+        self.assertEqual(
+            self.collisions(keys=('near',), days=2),
+            [('near', [5, 6])]
+        )
+        self.assertEqual(
+            self.collisions(keys=('near',), days=25),
+            [('near', [2, 3, 4]), ('near', [5, 6, 7])]
+        )
+
+    def test_unknown_key(self):
+        with self.assertRaises(ValueError):
+            DuplicateIndex(keys=('apple',))
+
+    def test_dict(self):
+        index = DuplicateIndex(keys=('id',))
+        index.load_RowSet(self.rows)
+        got = index.collisions_dict(index.collisions())
+
+        self.assertEqual(got, [{
+            'key': 'id',
+            'rows': [
+                {
+                    'file': '(stream)',
+                    'line': 8,
+                    'date': '1970-01-05',
+                    'value': '20',
+                    'row': '20 1970-01-05 !id:cac:1234',
+                },
+                {
+                    'file': '(stream)',
+                    'line': 9,
+                    'date': '1970-03-05',
+                    'value': '20',
+                    'row': '20 1970-03-05 !id:cac:1234',
+                },
+            ],
+        }])
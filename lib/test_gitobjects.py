@@ -0,0 +1,78 @@
+""" Perform tests on the gitobjects.py
+"""
+
+import os
+import subprocess
+
+from lib import gitobjects
+from lib.testcase import TmpDirTestCase
+
+
+def make_repo(dirname, commits):
+    """Create a git repository with a commit for each dict of files given,
+    returning the hash of each commit
+    """
+    def git(*args):
+        return subprocess.run(
+            ['git', '-C', dirname, '-c', 'user.name=test',
+             '-c', 'user.email=test@example.com'] + list(args),
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        ).stdout.decode('ascii').strip()
+
+    git('init', '-q')
+    result = []
+    for files in commits:
+        for name, data in files.items():
+            filename = os.path.join(dirname, name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(data)
+        git('add', '.')
+        git('commit', '-q', '-m', 'test')
+        result.append(git('rev-parse', 'HEAD'))
+    return result
+
+
+class TestGitObjects(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.revs = make_repo(self.dir, [
+            {'cash/a.txt': "one\n", 'cash/future/b.txt': "two\n"},
+            {'cash/a.txt': "three\n"},
+        ])
+        self.git = gitobjects.GitObjects(os.path.join(self.dir, 'cash'))
+
+    def tearDown(self):
+        self.git.close()
+        super().tearDown()
+
+    def test_ls_tree(self):
+        files = self.git.ls_tree(self.revs[0])
+        self.assertEqual([name for name, blob in files], ['cash/a.txt'])
+        self.assertEqual(self.git.read(files[0][1]), b"one\n")
+
+        files = self.git.ls_tree(self.revs[1], 'future')
+        self.assertEqual([name for name, blob in files], ['cash/future/b.txt'])
+        self.assertEqual(self.git.read(files[0][1]), b"two\n")
+
+        # the working tree is not used
+        self._write('cash/a.txt', "four\n")
+        files = self.git.ls_tree('HEAD')
+        self.assertEqual(self.git.read(files[0][1]), b"three\n")
+
+    def test_tree(self):
+        self.assertEqual(self.git.prefix(), 'cash/')
+        self.assertNotEqual(
+            self.git.tree(self.revs[0]), self.git.tree(self.revs[1])
+        )
+        self.assertEqual(
+            self.git.tree(self.revs[0], 'future'),
+            self.git.tree(self.revs[1], 'future'),
+        )
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.git.ls_tree('nonexistant')
+        with self.assertRaises(ValueError):
+            self.git.read(self.git.tree('HEAD'))
@@ -0,0 +1,109 @@
+""" Perform tests on the ledgerdb.py
+"""
+
+import os
+
+from lib.ledgerdb import LedgerDB
+from lib.testcase import TmpDirTestCase
+
+
+class TestLedgerDB(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dbname = os.path.join(self.tmpdir.name, 'ledger.db')
+        self.files = {
+            'a': self._write('a.txt', [
+                "#balance 0",
+                "100 1990-04-03 #dues:test1",
+                "-30 1990-04-05 #bills:rent !locn:test_location",
+            ]),
+            'b': self._write('b.txt', [
+                "#balance 70",
+                "300 1990-05-03 #dues:test1 !months:3",
+            ]),
+        }
+        self.digests = {self.files['a']: 'a1', self.files['b']: 'b1'}
+
+    def test_load(self):
+        db = LedgerDB(self.dbname)
+        self.assertEqual(db.update(self.digests), list(self.digests))
+
+        columns, rows = db.query(
+            'SELECT month, value, hashtag, location FROM rows ORDER BY id'
+        )
+        self.assertEqual(columns, ['month', 'value', 'hashtag', 'location'])
+        self.assertEqual(rows, [
+            ('1990-04', 100, 'dues:test1', None),
+            ('1990-04', -30, 'bills:rent', 'test_location'),
+            ('1990-05', 100, 'dues:test1', None),
+            ('1990-06', 100, 'dues:test1', None),
+            ('1990-07', 100, 'dues:test1', None),
+        ])
+
+        # The split children all refer back to the one line
+        columns, rows = db.query(
+            'SELECT lines.line, count(*) FROM lines'
+            ' JOIN rows ON rows.line_id = lines.id'
+            ' WHERE lines.filename = ? GROUP BY lines.id',
+            (self.files['b'],)
+        )
+        self.assertEqual(rows, [(2, 3)])
+
+        columns, rows = db.query(
+            "SELECT args FROM bangtags WHERE name = 'months'"
+        )
+        self.assertEqual(rows, [('child',)] * 3)
+
+        self.assertEqual(db.query('DELETE FROM meta WHERE 0'), ([], []))
+        db.close()
+
+    def test_update(self):
+        db = LedgerDB(self.dbname)
+        db.update(self.digests)
+        db.close()
+
+        # nothing has changed
+        db = LedgerDB(self.dbname)
+        self.assertEqual(db.update(self.digests), [])
+
+        # a changed file is loaded with the balance from the previous files
+        self._write('b.txt', [
+            "#balance 70",
+            "5 1990-05-03 #donation",
+        ])
+        self.digests[self.files['b']] = 'b2'
+        self.assertEqual(db.update(self.digests), [self.files['b']])
+
+        columns, rows = db.query('SELECT sum(value) FROM rows')
+        self.assertEqual(rows, [(75,)])
+
+        # a removed file takes its rows with it
+        del self.digests[self.files['b']]
+        self.assertEqual(db.update(self.digests), [])
+        columns, rows = db.query('SELECT count(*) FROM lines')
+        self.assertEqual(rows, [(2,)])
+        db.close()
+
+    def test_config(self):
+        db = LedgerDB(self.dbname, {'a': 1})
+        db.update(self.digests)
+        db.close()
+
+        db = LedgerDB(self.dbname, {'a': 2})
+        self.assertEqual(db.update(self.digests), list(self.digests))
+        db.close()
+
+    def test_balance(self):
+        self._write('b.txt', [
+            "#balance 71",
+        ])
+
+        db = LedgerDB(self.dbname)
+        with self.assertRaises(ValueError):
+            db.update(self.digests)
+
+        # the failed update has been rolled back
+        columns, rows = db.query('SELECT count(*) FROM files')
+        self.assertEqual(rows, [(0,)])
+        db.close()
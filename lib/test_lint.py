@@ -0,0 +1,142 @@
+""" Perform tests on the lint.py
+"""
+
+import os
+
+from lib import lint
+from lib import verify
+from lib.testcase import TmpDirTestCase
+
+
+class TestLinter(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.mkdir(os.path.join(self.dir, 'future'))
+
+    def _lint(self, validators=None):
+        linter = lint.Linter(validators)
+        linter.lint_directory(self.dir)
+        linter.lint_directory(os.path.join(self.dir, 'future'), future=True)
+        return [
+            (os.path.basename(x.filename), x.line_number, x.severity, x.message)
+            for x in linter.finish()
+        ]
+
+    def test_clean(self):
+        self._write('a.txt', [
+            "#balance 0",
+            "100 1990-04-03 #dues:test1",
+            "0 1990-04-04 !locn_xfer:paypal:nic:100",
+        ])
+        self._write('b.txt', [
+            "#balance 100",
+            "-30 2025-01-02 #bills:rent !locn:nic",
+            "60 2025-01-03 #dues:test1 !months:2 !locn:nic",
+        ])
+        self._write('future/dues.txt', [
+            "100 2025-03-01 #dues:test1 !forecast",
+        ])
+        self.assertEqual(self._lint(), [])
+
+    def test_diagnostic(self):
+        diagnostic = lint.Diagnostic('a.txt', 3, lint.ERROR, 'Bad thing')
+        self.assertEqual(str(diagnostic), 'a.txt:3: error: Bad thing')
+
+    def test_errors(self):
+        self._write('a.txt', [
+            "100 1990-04-03 #dues:test1",
+            "#balance 0",
+            "10 1990-04-04 #nosuchtag",
+            "10 1990-04-04 #dues:test1 !months:1:0",
+            "100 1990-04-05 #dues:test1",
+            "0 1990-04-06 !locn_xfer:paypal:nic",
+            "5 1990-04-07 !locn_xfer:paypal:nic:5",
+            "0 1990-04-08 !locn_xfer:paypal:nobody:5",
+            "#balance 115",
+        ])
+        self._write('b.txt', [
+            "#balance 115",
+            "-30 2025-01-02 #bills:rent",
+            "-30 2025-01-02 #bills:rent !forecast",
+        ])
+        self._write('future/dues.txt', [
+            "100 2025-03-01 #dues:test1 !forecast",
+            "100 2025-03-01 #dues:test1",
+            "bad line",
+        ])
+
+        self.assertEqual(self._lint(), [
+            ('a.txt', 1, 'error', 'Data before the opening balance pragma'),
+            ('a.txt', 2, 'error',
+             'Failed to balance - expected 0 but calculated 100'
+             ' (difference -100)'),
+            ('a.txt', 3, 'error', 'Syntax error: Unknown tag #nosuchtag'),
+            ('a.txt', 4, 'error',
+             'Cannot split: would divide by zero, splitting children'
+             ' from 1990-04-04'),
+            ('a.txt', 5, 'error', 'Duplicate transaction (dues) of {}:1'.format(
+                os.path.join(self.dir, 'a.txt'))),
+            ('a.txt', 6, 'error',
+             'locn_xfer must be !locn_xfer:<from>:<to>:<amount>'),
+            ('a.txt', 7, 'error', 'locn_xfer unbalanced - value is 5'),
+            ('a.txt', 8, 'error', 'Unknown tag !locn:nobody'),
+            ('b.txt', 2, 'error',
+             'row without location tag (!locn): -30 2025-01-02 #bills:rent'),
+            ('b.txt', 3, 'warning', 'Forecast row in a regular cash file'),
+            ('dues.txt', 2, 'error',
+             'row without location tag (!locn): 100 2025-03-01 #dues:test1'),
+            ('dues.txt', 2, 'warning',
+             'Row in a future file without a !forecast tag'),
+            ('dues.txt', 3, 'error',
+             'Syntax error: not enough values to unpack (expected 3, got 2)'),
+        ])
+
+    def test_split_location(self):
+        """A row split into months that need a location is reported once"""
+        self._write('a.txt', [
+            "#balance 0",
+            "90 2024-12-03 #dues:test1 !months:3",
+        ])
+        self.assertEqual(self._lint(), [
+            ('a.txt', 2, 'error',
+             'row without location tag (!locn): 30 2025-01-03 #dues:test1'
+             ' !months:child'),
+        ])
+
+    def test_negative(self):
+        self._write('a.txt', [
+            "#balance 0",
+            "10 1990-04-03 #dues:test1",
+            "-20 1990-04-04 #bills:rent",
+        ])
+        self.assertEqual(self._lint(), [
+            ('a.txt', 3, 'error', 'Impossible negative value cash balance: -10'),
+        ])
+
+    def test_seal(self):
+        lines = [
+            "#balance 0",
+            "100 1990-04-03 #dues:test1",
+            "#balance 100",
+        ]
+        filename = self._write('a.txt', lines)
+        self._write('b.txt', ["#balance 100"])
+
+        with open(filename) as f:
+            seal, content = verify.seal_content(f.readlines(), 3)
+        seal = verify.chain_digest(None, content)
+
+        validator = lint.ChainValidator()
+        lines[2] += " !seal:" + seal
+        self._write('a.txt', lines)
+        self.assertEqual(self._lint([validator]), [])
+        self.assertEqual(validator.sealed, 1)
+
+        lines[1] = "100 1990-04-03 #dues:test1 edited"
+        self._write('a.txt', lines)
+        self.assertEqual(self._lint([lint.ChainValidator()]), [
+            ('a.txt', 3, 'error',
+             'Seal does not match, the file or one before it has changed'
+             ' since it was sealed'),
+        ])
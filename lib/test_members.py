@@ -0,0 +1,81 @@
+""" Perform tests on the members.py
+"""
+
+import unittest
+
+from datetime import date as Date
+from decimal import Decimal
+from io import StringIO
+
+from lib import rowset
+from lib.members import MemberCoverage
+
+
+class TestMemberCoverage(unittest.TestCase):
+    input_data = """
+#balance 0 Opening Balance
+500 1990-01-03 #dues:test1
+500 1990-03-03 #dues:test1
+1000 1990-04-03 #dues:test1 !months:2
+700 1990-02-04 #dues:test2
+300 1990-03-04 #dues:test2
+-100 1990-03-20 #bills:rent
+20 1990-04-03 Unknown
+"""
+
+    forecast_data = """
+500 1990-05-01 #dues:test1 !forecast:monthly:until:1990-08-01
+700 1990-02-01 #dues:test2 !forecast:monthly:until:1990-08-01
+700 1990-02-01 #dues:test3 !forecast:monthly:until:1990-08-01
+"""
+
+    def setUp(self):
+        rows = rowset.RowSet()
+        rows.load_file(StringIO(self.input_data))
+        future = rowset.RowSet()
+        future.load_file(StringIO(self.forecast_data), skip_balance_check=True)
+
+        self.coverage = MemberCoverage()
+        self.coverage.load_RowSet(rows.autosplit())
+        self.coverage.load_RowSet(future.autosplit())
+
+    def test_members(self):
+        self.assertEqual(
+            self.coverage.members(),
+            ['dues:test1', 'dues:test2', 'dues:test3']
+        )
+
+    def test_paid_through(self):
+        self.assertEqual(self.coverage.first('dues:test1'), Date(1990, 1, 1))
+        self.assertEqual(
+            self.coverage.paid_through('dues:test1'), Date(1990, 5, 1)
+        )
+        self.assertEqual(self.coverage.paid_through('dues:test3'), None)
+        self.assertEqual(self.coverage.first('dues:test3'), None)
+
+    def test_gaps(self):
+        self.assertEqual(self.coverage.gaps('dues:test1'), [Date(1990, 2, 1)])
+        self.assertEqual(self.coverage.gaps('dues:test2'), [])
+        self.assertEqual(self.coverage.gaps('dues:test3'), [])
+
+    def test_arrears(self):
+        self.assertEqual(self.coverage.arrears('dues:test1', Date(1990, 6, 1)), [
+            (Date(1990, 6, 1), Decimal(500)),
+        ])
+        self.assertEqual(self.coverage.arrears('dues:test2', Date(1990, 4, 1)), [
+            (Date(1990, 3, 1), Decimal(400)),
+            (Date(1990, 4, 1), Decimal(700)),
+        ])
+
+    def test_result(self):
+        result = self.coverage.result(Date(1990, 3, 1))
+        self.assertEqual(result['dues:test3'], {
+            'first': None,
+            'paid_through': None,
+            'gaps': [],
+            'forecast': True,
+            'arrears_months': [Date(1990, 2, 1), Date(1990, 3, 1)],
+            'arrears': Decimal(1400),
+        })
+        self.assertEqual(result['dues:test1']['arrears'], 0)
+        self.assertEqual(result['dues:test1']['forecast'], True)
@@ -0,0 +1,62 @@
+""" Perform tests on the profiler.py
+"""
+
+import unittest
+import json
+
+from lib import profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def tearDown(self):
+        profiler.stop()
+
+    def test_disabled(self):
+        self.assertEqual(profiler.stop(), None)
+
+        with profiler.phase('load') as p:
+            p.rows([1, 2, 3])
+
+        # all phases share the one null phase
+        self.assertIs(profiler.phase('load'), profiler.phase('other'))
+
+    def test_phases(self):
+        profiler.start()
+
+        with profiler.phase('load') as p:
+            p.rows([1, 2, 3])
+            with profiler.phase('split'):
+                data = [x for x in range(10000)]
+        with profiler.phase('render'):
+            pass
+
+        report = profiler.stop().report()
+
+        names = [x['name'] for x in report['phases']]
+        self.assertEqual(names, ['load', 'load/split', 'render'])
+
+        depths = [x['depth'] for x in report['phases']]
+        self.assertEqual(depths, [0, 1, 0])
+
+        load = report['phases'][0]
+        self.assertEqual(load['rows'], 3)
+        self.assertGreaterEqual(load['seconds'], 0)
+        self.assertGreater(load['allocated'], 0)
+        self.assertEqual(report['phases'][1]['rows'], None)
+
+        self.assertGreater(report['peak_memory'], 0)
+        self.assertGreaterEqual(report['elapsed'], load['seconds'])
+
+        # The report must be able to be output as json
+        json.dumps(report)
+        self.assertEqual(len(data), 10000)
+
+    def test_no_trace_malloc(self):
+        profiler.start(trace_malloc=False)
+        with profiler.phase('load'):
+            pass
+        report = profiler.stop().report()
+
+        self.assertEqual(report['peak_memory'], None)
+        self.assertEqual(report['phases'][0]['allocated'], None)
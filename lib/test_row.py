@@ -237,6 +237,20 @@ class TestRowDataClass(unittest.TestCase):
         with self.assertRaises(ValueError):
             row.RowData(10, 'notadate', "A Comment")
 
+    def test_canonical(self):
+        obj = row.Row.fromTxt(
+            "-10\t1970-10-20\t!locn:test_location  a #test_hashtag\tb"
+            " !forecast"
+        )
+        self.assertEqual(
+            obj.canonical(5),
+            "-10    1970-10-20  a b #test_hashtag !forecast"
+            " !locn:test_location"
+        )
+
+        self.assertEqual(row.Row.fromTxt("# comment ").canonical(5), "# comment")
+        self.assertEqual(row.Row.fromTxt("").canonical(5), "")
+
     def test_forecast_simple(self):
         obj = row.RowData(10, Date(1970, 10, 21), "A Comment !forecast")
         self.assertEqual(obj.isforecast, True)
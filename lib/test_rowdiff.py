@@ -0,0 +1,70 @@
+""" Perform tests on the rowdiff.py
+"""
+
+import unittest
+
+from datetime import date as Date
+from io import StringIO
+
+from lib import rowdiff, rowset
+
+
+class TestRowDiff(unittest.TestCase):
+
+    def _rows(self, filename, data):
+        rows = rowset.RowSet()
+        rows.load_rows(rows.parse_lines(StringIO(data).readlines(), filename), filename)
+        return rows
+
+    def test_diff(self):
+        old = self._rows('old/a.txt', """#balance 0
+100 1990-04-03 #dues:test1
+-10 1990-04-04 #bills:rent
+20  1990-04-05 #donation !locn:nic !id:cac:1
+30 1990-04-06 gift
+""")
+        new = self._rows('new/a.txt', """#balance 0
+100 1990-04-03 #dues:test1
+-12 1990-04-04 #bills:rent
+20 1990-04-05 !id:cac:1   #donation !locn:nic
+30 1990-04-06 gift from a friend
+60 1990-04-07 #dues:test2 !months:3
+""")
+        diff = rowdiff.RowDiff()
+        diff.load_RowSets(old, new, 'old', 'new')
+
+        self.assertEqual(diff.removed, [])
+        self.assertEqual(
+            [str(row) for row in diff.added], ['60 1990-04-07 #dues:test2 !months:3']
+        )
+        self.assertEqual(
+            [(str(a), str(b)) for a, b in diff.changed],
+            [
+                ('-10 1990-04-04 #bills:rent', '-12 1990-04-04 #bills:rent'),
+                ('30 1990-04-06 gift', '30 1990-04-06 gift from a friend'),
+            ]
+        )
+        self.assertEqual(diff.cells, {
+            (Date(1990, 4, 1), 'bills:rent'): -2,
+            (Date(1990, 4, 1), 'dues:test2'): 20,
+            (Date(1990, 5, 1), 'dues:test2'): 20,
+            (Date(1990, 6, 1), 'dues:test2'): 20,
+        })
+        self.assertEqual(diff.balance, 58)
+
+    def test_files(self):
+        """The same row in another file is removed from one and added to
+        the other
+        """
+        old = self._rows('old/a.txt', "#balance 0\n10 1990-04-03 gift\n")
+        new = self._rows('new/b.txt', "#balance 0\n10 1990-04-03 gift\n")
+
+        diff = rowdiff.RowDiff(split=False)
+        diff.load_RowSets(old, new, 'old', 'new')
+        self.assertEqual(len(diff.added), 1)
+        self.assertEqual(len(diff.removed), 1)
+        self.assertEqual(diff.changed, [])
+
+        # which cancel out in the grid
+        self.assertEqual(diff.cells, {})
+        self.assertEqual(diff.balance, 0)
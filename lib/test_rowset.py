@@ -10,7 +10,9 @@ from datetime import date as Date
 from io import StringIO
 from unittest import mock
 
-from lib import row, rowset
+from lib import gitobjects, row, rowset
+from lib.test_gitobjects import make_repo
+from lib.testcase import TmpDirTestCase
 
 
 class fakedatetime(datetime.datetime):
@@ -46,6 +48,20 @@ class TestRowSet(unittest.TestCase):
     def test_str(self):
         self.assertEqual(str(self.rows), self.input_data)
 
+    def test_write(self):
+        stream = StringIO()
+        self.rows.write(stream)
+        self.assertEqual(stream.getvalue(), self.input_data)
+
+        stream = StringIO()
+        self.rows.write(stream, canonical=True)
+        self.assertEqual(stream.getvalue().split("\n")[4:8], [
+            "#balance 0 Opening Balance",
+            "-10  1970-02-06  comment4",
+            "10   1970-01-05  comment1",
+            "-10  1970-01-10  comment2 #bills:rent",
+        ])
+
     def test_value(self):
         self.assertEqual(self.rows.value, -45)
 
@@ -415,6 +431,9 @@ class TestAutoSplit(unittest.TestCase):
 
         self.assertEqual(expected, got)
 
+        # the original row is unchanged, so it can be split again
+        self.assertEqual(str(rows.autosplit()), got)
+
     @mock.patch('row.datetime.datetime', fakedatetime)
     def test_forecast_endless(self):
         input_data = """
@@ -472,6 +491,44 @@ class TestLocn(unittest.TestCase):
 
         self.assertEqual(expected, got)
 
+    def test_ledger_value(self):
+        ledger = self.rows.location_ledger()
+
+        self.assertEqual(
+            sorted(ledger.locations),
+            ['test_location', 'test_location2']
+        )
+        self.assertEqual(ledger.value('test_location'), -100)
+        self.assertEqual(ledger.value('test_location2'), 100)
+
+    def test_ledger_entries_str(self):
+        """The ledger shows the same text as the split rows"""
+        ledger = self.rows.location_ledger()
+        split = self.rows._split_locn_xfer().group_by('location')
+
+        for locn in ledger.locations:
+            self.assertEqual(ledger.entries_str(locn), str(split[locn]))
+
+    def test_ledger_timeline(self):
+        ledger = self.rows.location_ledger()
+
+        expected = [
+            (Date(1970, 10, 1), {'test_location': -10, 'test_location2': 0}),
+            (Date(1970, 11, 1), {'test_location': 0, 'test_location2': 0}),
+            (Date(1970, 12, 1), {'test_location': -100, 'test_location2': 100}),
+        ]
+        self.assertEqual(ledger.timeline(), expected)
+
+    def test_ledger_unbalanced(self):
+        rows = rowset.RowSet()
+        rows.append(row.RowData(
+            "10", Date(1970, 12, 11),
+            "!locn_xfer:test_location:test_location2:100"
+        ))
+
+        with self.assertRaises(ValueError):
+            rows.location_ledger()
+
 
 class TestRowGrid(unittest.TestCase):
     input_data = """
@@ -527,10 +584,143 @@ class TestRowGrid(unittest.TestCase):
         self.assertEqual(cell.isforecast, False)
 
     def test_forecast_column(self):
-        # TODO: should there be a public accessor for this _headings_x dict?
-
-        column = self.grid._headings_x[Date(1970, 3, 1)]
+        column = self.grid.column(Date(1970, 3, 1))
         self.assertEqual(column.isforecast, True)
 
-        column = self.grid._headings_x[Date(1970, 1, 1)]
+        column = self.grid.column(Date(1970, 1, 1))
         self.assertEqual(column.isforecast, False)
+
+    def test_running_balance(self):
+        self.assertEqual(self.grid.running_balance(), {
+            Date(1970, 1, 1): (-25, False),
+            Date(1970, 2, 1): (-35, False),
+            Date(1970, 3, 1): (-45, True),
+        })
+
+
+class TestLoadGit(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.revs = make_repo(self.dir, [
+            {
+                'cash/a.txt': "#balance 0\n10 1970-01-02 comment1\n",
+                'cash/b.txt': "#balance 10\n5 1970-02-02 comment2\n",
+                'cash/README.md': "not a cash file\n",
+            },
+            {'cash/b.txt': "#balance 10\n7 1970-02-02 comment2\n"},
+        ])
+        self.git = gitobjects.GitObjects(self.dir)
+
+    def tearDown(self):
+        self.git.close()
+        super().tearDown()
+
+    def test_load_git(self):
+        rows = rowset.RowSet()
+        rows.load_git(self.revs[0], git=self.git)
+        self.assertEqual(rows.value, 15)
+        self.assertEqual(rows[3].filename, 'cash/b.txt')
+        self.assertEqual(rows[3].line_number, 2)
+
+        rows = rowset.RowSet()
+        rows.load_git(self.revs[1], git=self.git)
+        self.assertEqual(rows.value, 17)
+
+        # the unchanged file was only parsed once
+        self.assertEqual(len(self.git.parsed), 3)
+
+    def test_balance(self):
+        make_repo(self.dir, [
+            {'cash/b.txt': "#balance 11\n5 1970-02-02 comment2\n"},
+        ])
+        with self.assertRaises(ValueError):
+            rowset.RowSet().load_git('HEAD', git=self.git)
+
+
+class TestAsofIndex(unittest.TestCase):
+    input_data = """
+#balance 0
+100 1970-01-02 comment1
+-10 1970-02-10 comment2
+-5 1970-01-02 comment3
+#balance 85
+20 1970-04-01 comment4
+"""
+
+    def setUp(self):
+        f = StringIO(self.input_data)
+        self.rows = rowset.RowSet()
+        self.rows.load_file(f)
+
+        self.index = self.rows.asof_index()
+
+    def test_balance(self):
+        self.assertEqual(self.index.dates, [
+            Date(1970, 1, 2), Date(1970, 2, 10), Date(1970, 4, 1),
+        ])
+        self.assertEqual(self.index.balance(Date(1970, 1, 1)), 0)
+        self.assertEqual(self.index.balance(Date(1970, 1, 2)), 95)
+        self.assertEqual(self.index.balance(Date(1970, 3, 31)), 85)
+        self.assertEqual(self.index.balance(Date(2000, 1, 1)), 105)
+
+    def test_month_ends(self):
+        self.assertEqual(self.index.month_ends(), [
+            Date(1970, 1, 31), Date(1970, 2, 28), Date(1970, 3, 31),
+            Date(1970, 4, 30),
+        ])
+        self.assertEqual(rowset.RowSet().asof_index().month_ends(), [])
+
+
+class TestBillMatrix(unittest.TestCase):
+    input_data = """
+#balance 0
+100 1970-01-02 comment1
+-10 1970-01-10 comment2 #bills:rent
+-5 1970-01-20 comment3 #bills:rent
+-10 1970-01-01 comment4 #bills:water
+-10 1970-02-06 comment5
+-10 1970-03-01 comment6 #bills:rent !forecast
+"""
+
+    def setUp(self):
+        f = StringIO(self.input_data)
+        rows = rowset.RowSet()
+        rows.load_file(f)
+
+        self.bills = rows.bill_matrix()
+
+    def test_headings(self):
+        self.assertEqual(self.bills.months, [
+            Date(1970, 1, 1), Date(1970, 2, 1), Date(1970, 3, 1),
+        ])
+        self.assertEqual(
+            self.bills.tags, ['bills:rent', 'bills:water', 'unknown']
+        )
+
+    def test_cell(self):
+        cell = self.bills.cell(Date(1970, 1, 1), 'bills:rent')
+        self.assertEqual(cell.value, -15)
+        self.assertEqual(cell.last, Date(1970, 1, 20))
+        self.assertEqual(cell.isforecast, False)
+
+        cell = self.bills.cell(Date(1970, 3, 1), 'bills:rent')
+        self.assertEqual(cell.isforecast, True)
+
+        # incoming rows are not bills
+        self.assertEqual(self.bills.cell(Date(1970, 1, 1), 'unknown'), None)
+        self.assertEqual(self.bills.cell(Date(1970, 2, 1), 'bills:rent'), None)
+
+    def test_missing(self):
+        self.assertEqual(self.bills.missing(Date(1970, 2, 14)), [
+            'bills:rent', 'bills:water',
+        ])
+        self.assertEqual(
+            self.bills.missing(Date(1970, 1, 14), ['bills:rent', 'bills:gas']),
+            ['bills:gas']
+        )
+
+        # only a forecast has been paid
+        self.assertEqual(
+            self.bills.missing(Date(1970, 3, 14), ['bills:rent']), ['bills:rent']
+        )
@@ -0,0 +1,128 @@
+""" Perform tests on the server.py
+"""
+
+import unittest
+import threading
+import urllib.error
+import urllib.request
+
+from lib import server
+from lib.testcase import TmpDirTestCase
+
+
+class TestPageModel(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.filename = self._write('a.txt', 'one')
+        self.loads = 0
+        self.renders = 0
+        self.model = server.PageModel(self.inputs, self.loader)
+
+    def inputs(self):
+        return [self.filename]
+
+    def loader(self):
+        self.loads += 1
+        with open(self.filename) as f:
+            data = f.read()
+
+        def render():
+            self.renders += 1
+            return data
+
+        return {'index.html': render}
+
+    def test_get(self):
+        etag, body = self.model.get('index.html')
+        self.assertEqual(body, b'one')
+        self.assertEqual(self.model.get('index.html'), (etag, b'one'))
+        self.assertEqual(self.model.get('nonexistant'), None)
+
+        # loaded and rendered only once
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.renders, 1)
+
+    def test_reload(self):
+        etag1, body = self.model.get('index.html')
+
+        self._write('a.txt', 'two')
+        etag2, body = self.model.get('index.html')
+        self.assertEqual(body, b'two')
+        self.assertNotEqual(etag1, etag2)
+
+        # the same content again gives the same etag
+        self._write('a.txt', 'one')
+        etag3, body = self.model.get('index.html')
+        self.assertEqual(etag1, etag3)
+        self.assertEqual(self.loads, 3)
+
+    def test_salt(self):
+        salt = ['a']
+        self.model.salt = lambda: salt[0]
+        etag1, body = self.model.get('index.html')
+
+        salt[0] = 'b'
+        etag2, body = self.model.get('index.html')
+        self.assertNotEqual(etag1, etag2)
+
+    def test_content_type(self):
+        self.assertEqual(
+            server.content_type('payments.json'),
+            'application/json; charset=utf-8'
+        )
+        self.assertEqual(server.content_type('circle.svg'), 'image/svg+xml')
+        self.assertEqual(
+            server.content_type('nonexistant'), 'application/octet-stream'
+        )
+
+
+class TestPageHandler(unittest.TestCase):
+
+    def setUp(self):
+        def loader():
+            def fail():
+                raise ValueError('Failed to balance')
+            return {'index.html': lambda: 'hello', 'fail.txt': fail}
+
+        model = server.PageModel(lambda: [], loader)
+        self.server = server.make_server(model, 0, '127.0.0.1')
+        # keep the test output clean
+        self.server.RequestHandlerClass = type(
+            'QuietHandler', (server.PageHandler,),
+            {'log_message': lambda *args: None},
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _get(self, path, headers=None):
+        request = urllib.request.Request(self.url + path, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            e.close()
+            return e.code, e.headers, None
+
+    def test_get(self):
+        status, headers, body = self._get('')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'hello')
+        self.assertEqual(headers['Content-Type'], 'text/html; charset=utf-8')
+
+        status, headers, body = self._get(
+            'index.html', {'If-None-Match': headers['ETag']}
+        )
+        self.assertEqual(status, 304)
+
+        status, headers, body = self._get('nonexistant')
+        self.assertEqual(status, 404)
+
+        status, headers, body = self._get('fail.txt')
+        self.assertEqual(status, 500)
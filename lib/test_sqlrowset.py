@@ -0,0 +1,205 @@
+""" Perform tests on the sqlrowset.py
+
+The same tests are run against both the in-memory RowSet and the
+SQLRowSet, to show that the two storage engines give the same results
+"""
+
+import unittest
+import datetime
+import os
+
+from datetime import date as Date
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from lib.rowset import RowSet
+from lib.ledgerdb import LedgerDB
+from lib.sqlrowset import SQLRowSet
+from lib.testcase import TmpDirTestCase
+
+
+class fakedatetime(datetime.datetime):
+
+    @classmethod
+    def now(cls):
+        return cls(1990, 5, 4, 12, 12, 12, 0)
+
+
+@mock.patch('lib.row.datetime.datetime', fakedatetime)
+@mock.patch('lib.sqlrowset.datetime.datetime', fakedatetime)
+class EngineTests(object):
+    input_data = """#balance 0 Opening Balance
+500 1990-03-03 #dues:test1
+20 1990-03-04 Unknown
+-12500 1990-04-15 #bills:rent
+-1500.50 1990-04-26 #fridge
+1500.50 1990-04-27 #fridge
+300 1990-04-27 #dues:test2 !months:3
+-488 1990-05-25 #bills:internet !locn:test_location
+13152 1990-05-25 balance books
+"""
+
+    def values(self, rows):
+        return [str(row.value) for row in rows]
+
+    def test_value(self):
+        self.assertEqual(self.rows.value, 984)
+        self.assertEqual(len(self.rows), 10)
+        self.assertEqual(self.rows.isforecast, False)
+
+    def test_iter(self):
+        self.assertEqual(self.values(self.rows), [
+            '500', '20', '-12500', '-1500.50', '1500.50', '100', '100',
+            '100', '-488', '13152',
+        ])
+        self.assertEqual(
+            str(self.rows[5]), '100 1990-04-27 #dues:test2 !months:child'
+        )
+        self.assertEqual(self.rows[5].bangtags, {'months': ['child']})
+        self.assertEqual(self.rows[6].date, Date(1990, 5, 27))
+        self.assertEqual(self.rows[6].line_number, 7)
+        self.assertEqual(self.rows[-1].comment, 'balance books')
+
+    def test_filter(self):
+        tests = [
+            (['hashtag==fridge'], ['-1500.50', '1500.50']),
+            (['hashtag!=fridge', 'value>200'], ['500', '13152']),
+            (['hashtag=~^dues'], ['500', '100', '100', '100']),
+            (['hashtag!~:'], ['20', '-1500.50', '1500.50', '13152']),
+            (['month==1990-05'], ['100', '-488', '13152']),
+            (['rel_months<0'], [
+                '500', '20', '-12500', '-1500.50', '1500.50', '100',
+            ]),
+            (['rel_months>=1'], ['100']),
+            (['direction==outgoing'], ['-12500', '-1500.50', '-488']),
+            (['hashtag=~:', 'category_prefix1==bills'], ['-12500', '-488']),
+            (['location==test_location'], ['-488']),
+            (['location!=test_location'], [
+                '500', '20', '-12500', '-1500.50', '1500.50', '100', '100',
+                '100', '13152',
+            ]),
+            (['value<=-1500.5'], ['-12500', '-1500.50']),
+            (['date>1990-05-25'], ['100', '100']),
+            (['taxyearhk==ye1991', 'isdata==1'], [
+                '-12500', '-1500.50', '1500.50', '100', '100', '100', '-488',
+                '13152',
+            ]),
+            (['isforecast==1'], []),
+        ]
+        for filters, expect in tests:
+            got = self.rows.filter(filters)
+            self.assertEqual(self.values(got), expect, filters)
+
+        self.assertEqual(self.rows.filter(['hashtag==fridge']).value, 0)
+        self.assertEqual(self.rows.filter(['hashtag=~dues']).value, 800)
+
+        with self.assertRaises(ValueError):
+            self.rows.filter(['hashtag'])
+
+    def test_filter_asof(self):
+        got = self.rows.filter_asof(Date(1990, 4, 26))
+        self.assertEqual(self.values(got), [
+            '500', '20', '-12500', '-1500.50',
+        ])
+        self.assertEqual(got.value, Decimal('-13480.50'))
+
+    def test_group_by(self):
+        got = self.rows.group_by('hashtag')
+        self.assertEqual(list(got.keys()), [
+            'dues:test1', 'unknown', 'bills:rent', 'fridge', 'dues:test2',
+            'bills:internet',
+        ])
+        self.assertEqual(got['unknown'].value, 13172)
+        self.assertEqual(got['dues:test2'].last().date, Date(1990, 6, 27))
+
+        got = self.rows.group_by('month')
+        self.assertEqual(list(got.keys()), [
+            Date(1990, 3, 1), Date(1990, 4, 1), Date(1990, 5, 1),
+            Date(1990, 6, 1),
+        ])
+        self.assertEqual(
+            [x.value for x in got.values()],
+            [520, -12400, 12764, 100]
+        )
+
+        got = self.rows.group_by('taxyearhk')
+        self.assertEqual(list(got.keys()), ['ye1990', 'ye1991'])
+
+    def test_grid_by(self):
+        grid = self.rows.grid_by('month', 'hashtag')
+
+        self.assertEqual(list(grid.headings_x), [
+            Date(1990, 3, 1), Date(1990, 4, 1), Date(1990, 5, 1),
+            Date(1990, 6, 1),
+        ])
+        self.assertEqual(list(grid.headings_y), [
+            'dues:test1', 'unknown', 'bills:rent', 'fridge', 'dues:test2',
+            'bills:internet',
+        ])
+        self.assertEqual(grid.headings_y_width, 14)
+        self.assertEqual(list(grid.rows['unknown'].keys()), [
+            Date(1990, 3, 1), Date(1990, 5, 1),
+        ])
+        self.assertEqual(grid.rows['unknown'][Date(1990, 5, 1)].value, 13152)
+        self.assertEqual(grid.rows['fridge'][Date(1990, 4, 1)].value, 0)
+        self.assertEqual(grid.column(Date(1990, 4, 1)).value, -12400)
+        self.assertEqual(grid.isforecast, False)
+
+    def test_bill_matrix(self):
+        bills = self.rows.bill_matrix()
+        self.assertEqual(bills.tags, ['bills:internet', 'bills:rent', 'fridge'])
+        self.assertEqual(bills.months, [Date(1990, 4, 1), Date(1990, 5, 1)])
+        self.assertEqual(
+            bills.cell(Date(1990, 5, 1), 'bills:internet').last,
+            Date(1990, 5, 25)
+        )
+        self.assertEqual(bills.missing(Date(1990, 5, 1)), [
+            'bills:rent', 'fridge',
+        ])
+
+    def test_last(self):
+        self.assertEqual(
+            str(self.rows.last()), '100 1990-06-27 #dues:test2 !months:child'
+        )
+        self.assertEqual(
+            str(self.rows.filter(['hashtag=~bills']).last()),
+            '-488 1990-05-25 #bills:internet !locn:test_location'
+        )
+
+
+class TestMemory(EngineTests, unittest.TestCase):
+
+    def setUp(self):
+        rows = RowSet()
+        rows.load_file(StringIO(self.input_data))
+        # The SQLRowSet only holds the split data rows
+        self.rows = rows.autosplit().filter(['isdata==1'])
+
+
+class TestSQL(EngineTests, TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        filename = self._write('a.txt', self.input_data)
+
+        self.db = LedgerDB(os.path.join(self.dir, 'ledger.db'))
+        self.db.update({filename: 'a'})
+        self.rows = SQLRowSet(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        super().tearDown()
+
+    def test_readonly(self):
+        with self.assertRaises(ValueError):
+            self.rows.append([])
+        self.assertIs(self.rows.autosplit(), self.rows)
+        self.assertIs(self.rows.filter_forecast(), self.rows)
+
+        with self.assertRaises(ValueError):
+            self.rows.filter(['nosuchfield==1'])
+        with self.assertRaises(ValueError):
+            self.rows.filter(['hashtag=>1'])
+        with self.assertRaises(ValueError):
+            self.rows.filter(['hashtag==none']).last()
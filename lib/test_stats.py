@@ -0,0 +1,233 @@
+""" Perform tests on the stats.py
+"""
+
+import unittest
+import datetime
+import os
+
+from datetime import date as Date
+from io import StringIO
+from unittest import mock
+
+from lib import rowset
+from lib.stats import Stats, StatsColumn, StatsStore, RollingWindow, rolling
+from lib.testcase import TmpDirTestCase
+
+
+class fakedatetime(datetime.datetime):
+
+    @classmethod
+    def now(cls):
+        return cls(1990, 5, 4, 12, 12, 12, 0)
+
+
+class fakedatetime_april(datetime.datetime):
+
+    @classmethod
+    def now(cls):
+        return cls(1990, 4, 15, 12, 12, 12, 0)
+
+
+class TestStats(unittest.TestCase):
+    input_data = """
+#balance 0 Opening Balance
+500 1990-03-03 #dues:test1
+700 1990-03-04 #dues:test2
+-100 1990-03-20 #bills:rent
+500 1990-04-03 #dues:test1
+0 1990-04-03 #dues:test3
+20 1990-04-03 Unknown
+-1500 1990-04-26 #fridge
+500 1990-05-02 #dues:test1
+-488 1990-05-25 #bills:internet
+"""
+
+    def setUp(self):
+        self.rows = rowset.RowSet()
+        self.rows.load_file(StringIO(self.input_data))
+
+    def tearDown(self):
+        self.rows = None
+
+    @mock.patch('lib.row.datetime.datetime', fakedatetime)
+    def test_months(self):
+        stats = Stats()
+        stats.load_RowSet(self.rows)
+
+        self.assertEqual(
+            sorted(stats.months.keys()),
+            [Date(1990, 3, 1), Date(1990, 4, 1)]
+        )
+
+        got = stats.months[Date(1990, 4, 1)].result()
+        self.assertEqual(got, {
+            'incoming': 520,
+            'outgoing': -1500,
+            'dues': 500,
+            'other': 20,
+            'members': 2,
+            'ARPM': 250,
+            'months': 1,
+        })
+
+    @mock.patch('lib.row.datetime.datetime', fakedatetime)
+    def test_total(self):
+        stats = Stats()
+        stats.load_RowSet(self.rows)
+
+        got = stats.total().result()
+        self.assertEqual(got, {
+            'incoming': 1720,
+            'outgoing': -1600,
+            'dues': 1700,
+            'other': 20,
+            'members': 3,
+            'ARPM': 566,
+            'months': 2,
+        })
+
+    @mock.patch('lib.row.datetime.datetime', fakedatetime)
+    def test_monthtd(self):
+        stats = Stats()
+        stats.load_RowSet(self.rows)
+
+        got = stats.monthtd.result()
+        self.assertEqual(got['incoming'], 500)
+        self.assertEqual(got['outgoing'], -488)
+        self.assertEqual(got['members'], 1)
+
+    def test_empty(self):
+        got = StatsColumn().result()
+        self.assertEqual(got['members'], 0)
+        self.assertEqual(got['ARPM'], -1)
+
+
+class TestStatsStore(TmpDirTestCase):
+    file1 = """#balance 0
+500 1990-03-03 #dues:test1
+-100 1990-03-20 #bills:rent
+"""
+    file2 = """#balance 400
+500 1990-04-03 #dues:test1
+-1500 1990-04-26 #fridge
+"""
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(self.dir, 'store.json')
+
+    def load(self, file1, file2):
+        rows = rowset.RowSet()
+        for name, data in (('file1', file1), ('file2', file2)):
+            f = StringIO(data)
+            start = len(rows)
+            rows.load_file(f)
+            for row in rows[start:]:
+                row.filename = name
+        return rows.autosplit()
+
+    def stats(self, rows, digests):
+        store = StatsStore(self.filename, {'a': 1}, digests)
+        stats = Stats()
+        stats.load_RowSet(rows, store)
+        store.save()
+        return stats
+
+    @mock.patch('lib.row.datetime.datetime', fakedatetime)
+    def test_unchanged(self):
+        rows = self.load(self.file1, self.file2)
+        digests = {'file1': '1', 'file2': '2'}
+        self.stats(rows, digests)
+
+        # The stored months are used in preference to the rows
+        stats = self.stats(rowset.RowSet(), digests)
+        got = stats.months[Date(1990, 3, 1)].result()
+        self.assertEqual(got['dues'], 500)
+        self.assertEqual(stats.total().result()['outgoing'], -1600)
+
+    @mock.patch('lib.row.datetime.datetime', fakedatetime)
+    def test_changed(self):
+        rows = self.load(self.file1, self.file2)
+        self.stats(rows, {'file1': '1', 'file2': '2'})
+
+        # A changed file reaching back into an otherwise unchanged month
+        file2 = self.file2 + "300 1990-04-04 #dues:test2 !months:-1:2\n"
+        rows = self.load(self.file1, file2)
+        stats = self.stats(rows, {'file1': '1', 'file2': '3'})
+
+        got = stats.months[Date(1990, 3, 1)].result()
+        self.assertEqual(got['dues'], 650)
+        self.assertEqual(got['members'], 2)
+
+        got = stats.months[Date(1990, 4, 1)].result()
+        self.assertEqual(got['dues'], 650)
+
+    def test_rollover(self):
+        """The month that was the current month when the store was saved
+        is calculated once it is in the past, even though no file changed
+        """
+        rows = self.load(self.file1, self.file2)
+        digests = {'file1': '1', 'file2': '2'}
+        with mock.patch('lib.row.datetime.datetime', fakedatetime_april):
+            stats = self.stats(rows, digests)
+        self.assertEqual(list(stats.months), [Date(1990, 3, 1)])
+
+        with mock.patch('lib.row.datetime.datetime', fakedatetime):
+            stats = self.stats(rows, digests)
+        self.assertEqual(
+            sorted(stats.months), [Date(1990, 3, 1), Date(1990, 4, 1)]
+        )
+        self.assertEqual(stats.total().result()['outgoing'], -1600)
+
+        # and it is stored for the next time
+        with mock.patch('lib.row.datetime.datetime', fakedatetime):
+            stats = self.stats(rowset.RowSet(), digests)
+        self.assertEqual(
+            sorted(stats.months), [Date(1990, 3, 1), Date(1990, 4, 1)]
+        )
+
+
+class TestRollingWindow(unittest.TestCase):
+
+    def month(self, outgoing, members, dues):
+        return {
+            'outgoing': outgoing,
+            'incoming': 0,
+            'dues': dues,
+            'members': members,
+        }
+
+    def test_window(self):
+        window = RollingWindow(2)
+
+        self.assertEqual(window.add(self.month(-10, 1, 500)), None)
+
+        got = window.add(self.month(-20, 3, 1500))
+        self.assertEqual(got['outgoing_sum'], -30)
+        self.assertEqual(got['outgoing_avg'], -15)
+        self.assertEqual(got['members_avg'], 2)
+        self.assertEqual(got['ARPM'], 500)
+
+        got = window.add(self.month(-40, 0, 0))
+        self.assertEqual(got['outgoing_sum'], -60)
+        self.assertEqual(got['members_sum'], 3)
+        self.assertEqual(got['ARPM'], 500)
+
+        got = window.add(self.month(-40, 0, 0))
+        self.assertEqual(got['ARPM'], -1)
+
+    def test_rolling(self):
+        results = {
+            1: self.month(-10, 1, 500),
+            2: self.month(-20, 1, 500),
+            3: self.month(-30, 1, 500),
+        }
+        got = rolling(results, [1, 2, 3], 2)
+
+        self.assertEqual(got[1], None)
+        self.assertEqual(got[2]['outgoing_sum'], -30)
+        self.assertEqual(got[3]['outgoing_sum'], -50)
+
+    def test_size(self):
+        with self.assertRaises(ValueError):
+            RollingWindow(0)
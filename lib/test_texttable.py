@@ -0,0 +1,47 @@
+""" Perform tests on the texttable.py
+"""
+
+import unittest
+
+from decimal import Decimal
+from io import StringIO
+
+from lib.texttable import TextTable
+
+
+class TestTextTable(unittest.TestCase):
+
+    def test_render(self):
+        table = TextTable([('<', 6), ('>', 5), ('>', 5, ' |')])
+        table.add_row(['', 'a', 'b'])
+        table.add_row(['one', Decimal('1.50'), 2])
+        table.add_line()
+        table.add_line('a {literal}')
+        table.add_row(['two', '~3'])
+
+        self.assertEqual(str(table).split("\n"), [
+            "          a    b |",
+            "one    1.50    2 |",
+            "",
+            "a {literal}",
+            "two      ~3",
+            "",
+        ])
+
+        stream = StringIO()
+        table.write(stream)
+        self.assertEqual(stream.getvalue(), str(table))
+
+    def test_widths(self):
+        table = TextTable([('<', None, ' '), ('>', None), ('<', 0)])
+        table.add_row(['a', 1])
+        table.add_row(['long', 100, 'x'])
+        table.add_line('ignored for the widths')
+
+        self.assertEqual(table.widths(), [4, 3, 0])
+        self.assertEqual(str(table), "a      1\nlong 100x\nignored for the widths\n")
+
+    def test_too_many_cells(self):
+        table = TextTable([('<', 1)])
+        with self.assertRaises(ValueError):
+            table.add_row([1, 2])
@@ -0,0 +1,146 @@
+""" Perform tests on the verify.py
+"""
+
+from decimal import Decimal
+
+from lib import verify
+from lib.testcase import TmpDirTestCase
+
+
+class TestVerify(TmpDirTestCase):
+
+    def _summary(self, name, lines):
+        filename = self._write(name, lines)
+        return (name, verify.file_summary(filename))
+
+    def test_summary(self):
+        name, summary = self._summary('a.txt', [
+            "# a comment",
+            "#balance 0",
+            "100 1990-04-03 #dues:test1",
+            "-30.50 1990-04-05 #bills:rent",
+            "#balance 69.50 closing",
+        ])
+        self.assertEqual(summary, {
+            'delta': '69.50',
+            'pragmas': [(2, '0', '0'), (5, '69.50', '69.50')],
+            'errors': [],
+            'first_data': 3,
+            'closing': 5,
+            'seal': None,
+            'content': summary['content'],
+        })
+
+        # the seal is not part of the content digest
+        name, sealed = self._summary('b.txt', [
+            "# a comment",
+            "#balance 0",
+            "100 1990-04-03 #dues:test1",
+            "-30.50 1990-04-05 #bills:rent",
+            "#balance 69.50 closing !seal:" + 'a' * 64,
+        ])
+        self.assertEqual(sealed['seal'], 'a' * 64)
+        self.assertEqual(sealed['content'], summary['content'])
+
+        # a file with data after the last pragma is not closed
+        name, summary = self._summary('c.txt', [
+            "#balance 0",
+            "100 1990-04-03 #dues:test1",
+        ])
+        self.assertEqual(summary['closing'], None)
+
+    def test_chain(self):
+        summaries = [
+            self._summary('a.txt', [
+                "#balance 0",
+                "100 1990-04-03 #dues:test1",
+            ]),
+            # wrong opening balance
+            self._summary('b.txt', [
+                "#balance 90",
+                "5 1990-05-03 #donation",
+                "#balance 95",
+            ]),
+            # correct, given the balance stated in the previous file
+            self._summary('c.txt', [
+                "#balance 95",
+                "5 1990-06-01 #donation",
+                "5 1990-06-31 #donation",
+                "#balance 101",
+            ]),
+            self._summary('d.txt', [
+                "5 1990-07-01 #donation",
+            ]),
+        ]
+
+        problems, balance = verify.check_chain(summaries)
+        self.assertEqual([str(x) for x in problems], [
+            'b.txt:1: Failed to balance - expected 90 but calculated 100'
+            ' (difference -10)',
+            'c.txt:3: Syntax error: day is out of range for month',
+            'c.txt:4: Failed to balance - expected 101 but calculated 100'
+            ' (difference 1)',
+            'd.txt:1: Data before the opening balance pragma',
+        ])
+        self.assertEqual(problems[0].difference, -10)
+        self.assertEqual(balance, Decimal(106))
+
+    def test_chain_ok(self):
+        problems, balance = verify.check_chain([
+            self._summary('a.txt', ["#balance 0", "100 1990-04-03 #dues:test1"]),
+            self._summary('b.txt', ["#balance 100"]),
+        ])
+        self.assertEqual(problems, [])
+        self.assertEqual(balance, 100)
+
+    def test_seal_line(self):
+        seal = 'a' * 64
+        for line in (
+            "#balance 10\n",
+            "#balance 10 closing  \t\n",
+            "#balance 10",
+            "#balance 10 !seal:" + 'b' * 64 + "\n",
+        ):
+            sealed = verify.seal_line(line, seal)
+            self.assertEqual(verify.SEAL_RE.search(sealed).group(1), seal)
+            self.assertEqual(
+                verify.SEAL_RE.sub('', sealed), verify.SEAL_RE.sub('', line)
+            )
+
+        self.assertEqual(
+            verify.seal_line("#balance 10  \n", seal),
+            "#balance 10 !seal:" + seal + "  \n"
+        )
+
+    def test_seals(self):
+        summaries = [
+            ('a.txt', {'content': 'a', 'closing': 3, 'seal': None}),
+            ('b.txt', {'content': 'b', 'closing': 5, 'seal': None}),
+            ('c.txt', {'content': 'c', 'closing': None, 'seal': None}),
+        ]
+
+        changes, broken = verify.seal_changes(summaries)
+        self.assertEqual(list(changes), ['a.txt', 'b.txt'])
+        self.assertEqual(broken, [])
+        self.assertEqual(
+            changes['b.txt'], verify.chain_digest(changes['a.txt'], 'b')
+        )
+
+        summaries[0][1]['seal'] = changes['a.txt']
+        summaries[1][1]['seal'] = changes['b.txt']
+        self.assertEqual(verify.check_seals(summaries), ([], 2))
+        self.assertEqual(verify.seal_changes(summaries), ({}, []))
+
+        # a change to the first file breaks its seal, but only it is
+        # reported as the chain carries on from its stated seal
+        summaries[0][1]['content'] = 'changed'
+        problems, sealed = verify.check_seals(summaries)
+        self.assertEqual([str(x) for x in problems], [
+            'a.txt:3: Seal does not match, the file or one before it has'
+            ' changed since it was sealed',
+        ])
+        self.assertEqual(verify.seal_changes(summaries), ({}, ['a.txt']))
+
+        # sealing it again also seals every file after it
+        changes, broken = verify.seal_changes(summaries, force=True)
+        self.assertEqual(list(changes), ['a.txt', 'b.txt'])
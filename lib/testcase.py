@@ -0,0 +1,31 @@
+""" Common fixtures for the tests
+"""
+
+import unittest
+import os
+import tempfile
+
+
+class TmpDirTestCase(unittest.TestCase):
+    """A test case with a temporary directory to write its files in,
+    which is removed after each test
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, data):
+        """Write a file in the directory and return its full name.  The
+        data is either a string or a list of lines
+        """
+        if isinstance(data, list):
+            data = "\n".join(data) + "\n"
+
+        filename = os.path.join(self.dir, name)
+        with open(filename, 'w') as f:
+            f.write(data)
+        return filename
@@ -0,0 +1,73 @@
+# Licensed under GPLv3
+import io
+
+
+class TextTable(object):
+    """A table of text, rendered as fixed width columns.
+
+    Each column is given as an (align, width) tuple, using the same align
+    characters as str.format(), optionally followed by some literal text
+    to output after the column.  A width of None is replaced by the width
+    of the widest cell in that column.
+
+    The widths are only worked out once, when the table is written, and
+    the format string for each length of row is only built once - so each
+    row is rendered with a single format call.  A row can have fewer cells
+    than there are columns, but not more.
+    """
+
+    def __init__(self, columns):
+        self.columns = [tuple(column) for column in columns]
+        # each entry is either a list of cells or a literal line of text
+        self.rows = []
+
+    def add_row(self, cells):
+        """Add a row of cells, each is converted to a string"""
+        cells = [str(cell) for cell in cells]
+        if len(cells) > len(self.columns):
+            raise ValueError('Row has {} cells but only {} columns'.format(
+                len(cells), len(self.columns)
+            ))
+        self.rows.append(cells)
+
+    def add_line(self, text=''):
+        """Add a line of text that is output as-is"""
+        self.rows.append(text)
+
+    def widths(self):
+        """Return the width of each column"""
+        widths = []
+        for i, column in enumerate(self.columns):
+            width = column[1]
+            if width is None:
+                width = max([
+                    len(row[i]) for row in self.rows
+                    if isinstance(row, list) and len(row) > i
+                ], default=0)
+            widths.append(width)
+        return widths
+
+    def write(self, stream):
+        """Write the rendered table to the stream"""
+        fields = []
+        for column, width in zip(self.columns, self.widths()):
+            after = column[2] if len(column) > 2 else ''
+            after = after.replace('{', '{{').replace('}', '}}')
+            fields.append('{:' + column[0] + str(width) + '}' + after)
+
+        formats = {}
+        for row in self.rows:
+            if not isinstance(row, list):
+                stream.write(row + "\n")
+                continue
+
+            fmt = formats.get(len(row))
+            if fmt is None:
+                fmt = ''.join(fields[:len(row)]) + "\n"
+                formats[len(row)] = fmt
+            stream.write(fmt.format(*row))
+
+    def __str__(self):
+        stream = io.StringIO()
+        self.write(stream)
+        return stream.getvalue()
@@ -0,0 +1,254 @@
+# Licensed under GPLv3
+import decimal
+import hashlib
+import re
+
+from lib.row import Row, RowData, RowPragmaBalance
+
+# The seal on the closing balance pragma of a file
+SEAL_RE = re.compile(r'\s*!seal:([0-9a-f]{64})')
+
+
+def chain_digest(previous, content):
+    """Return the seal for a file with the given content digest, following
+    the file with the given seal (or None for the first file)
+    """
+    h = hashlib.sha256((previous or '').encode('utf8'))
+    h.update(b'\0')
+    h.update(content.encode('utf8'))
+    return h.hexdigest()
+
+
+def seal_line(line, seal):
+    """Return the line with the given seal on it, replacing any old seal.
+
+    The seal goes before any trailing whitespace and line ending, so that
+    removing it again gives back exactly the line that was digested
+    """
+    line = SEAL_RE.sub('', line)
+    text = line.rstrip()
+    return '{} !seal:{}{}'.format(text, seal, line[len(text):])
+
+
+def closing_pragma(pragma_lines, last_data):
+    """Return the line number of the closing balance pragma of a file, or
+    None if the file is not closed
+    """
+    if len(pragma_lines) < 2:
+        return None
+    if last_data is not None and pragma_lines[-1] < last_data:
+        return None
+    return pragma_lines[-1]
+
+
+def seal_content(lines, closing):
+    """Return the seal found on the closing line of a file (if any) and the
+    digest of the file content without that seal
+    """
+    seal = None
+    if closing is not None:
+        m = SEAL_RE.search(lines[closing - 1])
+        if m:
+            seal = m.group(1)
+            lines = list(lines)
+            lines[closing - 1] = SEAL_RE.sub('', lines[closing - 1])
+
+    content = hashlib.sha256(''.join(lines).encode('utf8')).hexdigest()
+    return seal, content
+
+
+class FileSummary(object):
+    """Accumulate the summary of one cash file, one row at a time"""
+
+    def __init__(self):
+        self.delta = decimal.Decimal(0)
+        self.pragmas = []
+        self.errors = []
+        self.first_data = None
+        self.last_data = None
+
+    def add(self, line_number, row):
+        """Add the row found on the given line"""
+        if isinstance(row, RowPragmaBalance):
+            self.pragmas.append(
+                (line_number, str(row.balance), str(self.delta))
+            )
+        elif isinstance(row, RowData):
+            if self.first_data is None:
+                self.first_data = line_number
+            self.last_data = line_number
+            self.delta += row.value
+
+    def error(self, line_number, message):
+        """Record a line that could not be parsed"""
+        self.errors.append((line_number, message))
+
+    def result(self, lines):
+        """Return the summary, given all of the lines of the file"""
+        closing = closing_pragma(
+            [pragma[0] for pragma in self.pragmas], self.last_data
+        )
+        seal, content = seal_content(lines, closing)
+
+        return {
+            'delta': str(self.delta),
+            'pragmas': self.pragmas,
+            'errors': self.errors,
+            'first_data': self.first_data,
+            'closing': closing,
+            'seal': seal,
+            'content': content,
+        }
+
+
+def file_summary(filename):
+    """Read one cash file and summarise what is needed to check its balance
+    pragmas, without needing any of the other files.
+
+    Each pragma is recorded with the total of the rows before it in this
+    file, so that the running balance it should match can be found later
+    from just the opening balance of the file.  Any syntax errors are
+    recorded instead of being raised, so that every problem can be
+    reported.  The summary only contains simple types, so that it can be
+    cached as JSON.
+
+    A file is closed if its last balance pragma comes after all of the
+    data.  The closing pragma can carry a seal, and the digest of the file
+    content without that seal is recorded to check it against.
+    """
+    summary = FileSummary()
+
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    for line_number, text in enumerate(lines, 1):
+        try:
+            row = Row.fromTxt(text.rstrip('\n'))
+        except Exception as e:
+            summary.error(line_number, 'Syntax error: {}'.format(e))
+            continue
+        summary.add(line_number, row)
+
+    return summary.result(lines)
+
+
+class Mismatch(object):
+    """A problem found in one file"""
+
+    def __init__(self, filename, line_number, message, difference=None):
+        self.filename = filename
+        self.line_number = line_number
+        self.message = message
+        self.difference = difference
+
+    def __str__(self):
+        return '{}:{}: {}'.format(self.filename, self.line_number, self.message)
+
+
+def check_chain(summaries):
+    """Check the balance pragmas of each file, in the order given, against
+    the running balance of all the rows before them.
+
+    After a mismatch the chain carries on from the balance that the pragma
+    states, so that each mistake is only reported once and does not hide
+    any of the others.  Returns the list of every Mismatch found and the
+    final balance
+    """
+    result = []
+    balance = decimal.Decimal(0)
+
+    for filename, summary in summaries:
+        found = []
+        for line_number, message in summary['errors']:
+            found.append(Mismatch(filename, line_number, message))
+
+        pragmas = summary['pragmas']
+        first_data = summary['first_data']
+        if first_data is not None and (
+                not pragmas or pragmas[0][0] > first_data):
+            found.append(Mismatch(
+                filename, first_data,
+                'Data before the opening balance pragma'
+            ))
+
+        # the balance at the start of this file
+        opening = balance
+        for line_number, stated, offset in pragmas:
+            stated = decimal.Decimal(stated)
+            expected = opening + decimal.Decimal(offset)
+            if stated != expected:
+                difference = stated - expected
+                found.append(Mismatch(
+                    filename, line_number,
+                    'Failed to balance - expected {} but calculated {}'
+                    ' (difference {})'.format(stated, expected, difference),
+                    difference,
+                ))
+                opening = stated - decimal.Decimal(offset)
+
+        balance = opening + decimal.Decimal(summary['delta'])
+        result += sorted(found, key=lambda x: x.line_number)
+
+    return result, balance
+
+
+def check_seals(summaries):
+    """Check the seal of each sealed file, in the order given, against the
+    digest of its content and the seal of the file before it.
+
+    After a broken seal the chain carries on from the seal that the file
+    states, so each changed file is only reported once.  Returns the list
+    of every Mismatch found and the number of sealed files
+    """
+    result = []
+    sealed = 0
+    previous = None
+
+    for filename, summary in summaries:
+        expected = chain_digest(previous, summary['content'])
+        previous = expected
+
+        if summary['seal'] is None:
+            continue
+
+        sealed += 1
+        if summary['seal'] != expected:
+            result.append(Mismatch(
+                filename, summary['closing'],
+                'Seal does not match, the file or one before it has'
+                ' changed since it was sealed'
+            ))
+            previous = summary['seal']
+
+    return result, sealed
+
+
+def seal_changes(summaries, force=False):
+    """Work out the seal needed on each closed file, in the order given.
+
+    Returns a dict of the new seal for each closed file that needs to be
+    written, and the list of files whose existing seal is broken.  A
+    broken seal is only replaced if a file before it has been sealed
+    again (which changes every later seal), or if forced
+    """
+    changes = {}
+    broken = []
+    previous = None
+    resealed = False
+
+    for filename, summary in summaries:
+        expected = chain_digest(previous, summary['content'])
+        previous = expected
+
+        if summary['closing'] is None or summary['seal'] == expected:
+            continue
+
+        if summary['seal'] is not None and not resealed and not force:
+            broken.append(filename)
+            previous = summary['seal']
+            continue
+
+        changes[filename] = expected
+        resealed = True
+
+    return changes, broken
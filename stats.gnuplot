@@ -43,3 +43,12 @@ set ylabel 'ARPM'
 plot \
     'pages/stats.tsv' using 1:10  title 'ARPM',
 
+set title 'Members needed to break even, for each dues rate'
+set ylabel 'number of members'
+plot for [i=3:*] \
+    'pages/sweep.tsv' index 0 using 1:i title columnhead(i),
+
+set title 'Dues needed to break even, for each membership count'
+set ylabel 'HKD'
+plot for [i=3:*] \
+    'pages/sweep.tsv' index 1 using 1:i title columnhead(i),
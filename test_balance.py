@@ -3,14 +3,19 @@
 """
 
 import unittest
+import argparse
 import datetime
 from datetime import date as Date
 import json
+import os
+import subprocess
+import sys
 
 from unittest import mock  # pragma: no cover
 from io import StringIO
 
 import balance
+from lib.testcase import TmpDirTestCase
 
 
 class fakedatetime(datetime.datetime):
@@ -37,6 +42,432 @@ class TestTime(unittest.TestCase):
             )
 
 
+class TestStartup(TmpDirTestCase):
+
+    # Modules that are only needed by some of the sub-commands and should
+    # not be loaded by a simple "sum"
+    heavy = (
+        'jinja2',
+        'json',
+        'csv',
+        'zoneinfo',
+        'subprocess',
+        'concurrent.futures',
+        'lib.stats',
+        'lib.duplicates',
+    )
+
+    def test_sum_imports(self):
+        self._write('2020-01.txt', "#balance 0\n10 2020-01-03 #donation\n")
+
+        result = subprocess.run(
+            [
+                sys.executable, '-X', 'importtime',
+                balance.__file__, '--dir', self.dir, 'sum',
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+
+        self.assertEqual(result.stdout, "10\n")
+
+        imported = set()
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:'):
+                imported.add(line.split('|')[-1].strip())
+
+        # make sure that we are actually seeing the import times
+        self.assertIn('lib.rowset', imported)
+        for module in self.heavy:
+            self.assertNotIn(module, imported)
+
+
+class TestPages(TmpDirTestCase):
+
+    def test_describe(self):
+        """The version is of the data directory, not where we are run from"""
+        from lib.test_gitobjects import make_repo
+
+        revs = make_repo(self.dir, [{'cash/a.txt': "#balance 0\n"}])
+        args = argparse.Namespace(dir=os.path.join(self.dir, 'cash'))
+
+        got = balance._pages_describe(args).strip()
+        self.assertTrue(got)
+        self.assertTrue(revs[0].startswith(got))
+
+    @mock.patch('balance._pages_describe', return_value="abc123\n")
+    def test_sections(self, describe):
+        expect = [
+            "abc123",
+            "",
+            "10",
+            "",
+            "20",
+            "",
+        ]
+
+        got = balance._pages_sections(None, ["10\n\n", "20\n"]).split("\n")
+        self.assertEqual(got, expect)
+
+
+class TestFmt(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.args = argparse.Namespace(
+            dir=self.dir,
+            includefuture=False,
+            files=[],
+            check=False,
+        )
+        self.a = self._write('a.txt', "#balance 0\n10\t1990-04-03\t#donation x\n")
+        self.b = self._write('b.txt', "#balance 10\n5  1990-05-03  x #donation\n")
+
+    def _read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_fmt(self):
+        self.args.check = True
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_fmt(self.args)
+        self.assertEqual(cm.exception.report, self.a + "\n")
+
+        self.args.check = False
+        mtime = os.stat(self.b).st_mtime_ns
+        self.assertEqual(balance.subp_fmt(self.args), self.a + "\n")
+        self.assertEqual(self._read(self.a), "#balance 0\n10  1990-04-03  x #donation\n")
+
+        # the already formatted file is not touched
+        self.assertEqual(os.stat(self.b).st_mtime_ns, mtime)
+        self.assertEqual(balance.subp_fmt(self.args), None)
+
+    def test_syntax_error(self):
+        self._write('c.txt', "#balance 15\n5 1990-05-99 #donation\n")
+        with self.assertRaises(ValueError):
+            balance.subp_fmt(self.args)
+
+        # nothing is written unless every file can be formatted
+        self.assertEqual(
+            self._read(self.a), "#balance 0\n10\t1990-04-03\t#donation x\n"
+        )
+
+
+class TestVerify(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.args = argparse.Namespace(
+            dir=os.path.join(self.dir, 'cash'),
+            cache=os.path.join(self.dir, 'cache'),
+            jobs=1,
+        )
+        os.mkdir(self.args.dir)
+        self.dir = self.args.dir
+        self._write('a.txt', "#balance 0\n10 1990-04-03 #donation\n")
+        self._write('b.txt', "#balance 10\n5 1990-05-03 #donation\n")
+
+    def test_verify(self):
+        expect = "2 files verified (0 sealed), closing balance 15"
+        self.assertEqual(balance.subp_verify(self.args), expect)
+
+        # everything is cached, so no files are read
+        with mock.patch('concurrent.futures.ProcessPoolExecutor') as pool:
+            self.assertEqual(balance.subp_verify(self.args), expect)
+            pool.assert_not_called()
+
+    def test_seal(self):
+        self._write('a.txt', "#balance 0\n10 1990-04-03 #donation\n#balance 10\n")
+        a = os.path.join(self.args.dir, 'a.txt')
+        self.args.force = False
+
+        self.assertEqual(balance.subp_seal(self.args), a + "\n")
+        self.assertEqual(balance.subp_seal(self.args), None)
+        self.assertEqual(
+            balance.subp_verify(self.args),
+            "2 files verified (1 sealed), closing balance 15"
+        )
+
+        # a sealed file is not reformatted
+        self.assertEqual(balance.fmt_file(a), None)
+
+        # a change to the sealed file is found
+        with open(a) as f:
+            data = f.read()
+        self._write('a.txt', data.replace('#donation', '#donation edited'))
+
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_verify(self.args)
+        self.assertIn(a + ":3: Seal does not match", cm.exception.report)
+        with self.assertRaises(balance.CheckFailed):
+            balance.subp_seal(self.args)
+
+        self.args.force = True
+        self.assertEqual(balance.subp_seal(self.args), a + "\n")
+        self.assertEqual(
+            balance.subp_verify(self.args),
+            "2 files verified (1 sealed), closing balance 15"
+        )
+
+    def test_seal_roundtrip(self):
+        """A seal still matches when the closing pragma has trailing
+        whitespace, or is the last line without a newline
+        """
+        self.args.force = False
+        for data in (
+            "#balance 0\n10 1990-04-03 #donation\n#balance 10  \n",
+            "#balance 0\n10 1990-04-03 #donation\n#balance 10",
+        ):
+            a = self._write('a.txt', data)
+            self.assertEqual(balance.subp_seal(self.args), a + "\n")
+            self.assertEqual(
+                balance.subp_verify(self.args),
+                "2 files verified (1 sealed), closing balance 15"
+            )
+
+    def test_mismatch(self):
+        self._write('a.txt', "#balance 0\n9 1990-04-03 #donation\n")
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_verify(self.args)
+
+        b = os.path.join(self.args.dir, 'b.txt')
+        self.assertEqual(cm.exception.report.split("\n"), [
+            b + ":1: Failed to balance - expected 10 but calculated 9"
+            " (difference 1)",
+            "",
+            "1 problem(s) found, the chain first breaks at " + b + ":1",
+        ])
+
+    def test_mismatch_order(self):
+        """A broken seal is reported in file order with the balance
+        mismatches
+        """
+        a = self._write('a.txt', "#balance 0\n10 1990-04-03 #donation\n#balance 10\n")
+        self.args.force = False
+        balance.subp_seal(self.args)
+
+        with open(a) as f:
+            data = f.read()
+        self._write('a.txt', data.replace('#donation', '#donation edited'))
+        b = self._write('b.txt', "#balance 11\n5 1990-05-03 #donation\n")
+
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_verify(self.args)
+        self.assertEqual(cm.exception.report.split("\n"), [
+            a + ":3: Seal does not match, the file or one before it has"
+            " changed since it was sealed",
+            b + ":1: Failed to balance - expected 11 but calculated 10"
+            " (difference 1)",
+            "",
+            "2 problem(s) found, the chain first breaks at " + a + ":3",
+        ])
+
+
+class TestLint(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.args = argparse.Namespace(dir=self.dir)
+        os.mkdir(os.path.join(self.dir, 'future'))
+        self._write('a.txt', "#balance 0\n10 1990-04-03 #donation\n")
+        self._write('future/a.txt', "10 1990-05-03 #donation !forecast\n")
+
+    def test_lint(self):
+        self.assertEqual(
+            balance.subp_lint(self.args),
+            "2 files checked, 0 error(s), 0 warning(s)"
+        )
+
+        # warnings alone do not fail
+        b = self._write('b.txt', "#balance 10\n5 1990-05-03 #donation !forecast\n")
+        self.assertEqual(balance.subp_lint(self.args).split("\n"), [
+            b + ":2: warning: Forecast row in a regular cash file",
+            "3 files checked, 0 error(s), 1 warning(s)",
+        ])
+
+        # every error is reported
+        self._write('b.txt', "#balance 9\n5 1990-05-03 #nosuchtag\n")
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_lint(self.args)
+        self.assertEqual(cm.exception.report.split("\n"), [
+            b + ":1: error: Failed to balance - expected 9 but calculated 10"
+            " (difference -1)",
+            b + ":2: error: Syntax error: Unknown tag #nosuchtag",
+            "3 files checked, 2 error(s), 0 warning(s)",
+        ])
+
+
+class TestStatsStore(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.args = argparse.Namespace(
+            dir=os.path.join(self.dir, 'cash'),
+            includefuture=False,
+            split=False,
+            filter=['rel_months>-3'],
+            asof=None,
+            stats_store=os.path.join(self.dir, 'stats.json'),
+        )
+        os.mkdir(self.args.dir)
+        self._write('cash/a.txt', ["#balance 0"] + [
+            "10 2023-{:02}-03 #dues:test1".format(month)
+            for month in range(4, 10)
+        ])
+
+    def _months(self, now):
+        class fake(datetime.datetime):
+            @classmethod
+            def now(cls):
+                return now
+
+        with mock.patch('lib.row.datetime.datetime', fake):
+            rows = balance.load_rows(self.args)
+            self.args.rows = balance.prepare_rows(self.args, rows, False)
+            result, months = balance.create_stats(self.args)
+        return [x for x in months if isinstance(x, Date)]
+
+    def test_relative_filter(self):
+        """The months that a relative filter drops as time goes by are not
+        kept in the store
+        """
+        self.assertEqual(
+            self._months(datetime.datetime(2023, 6, 15)),
+            [Date(2023, 4, 1), Date(2023, 5, 1)]
+        )
+        self.assertEqual(
+            self._months(datetime.datetime(2023, 9, 15)),
+            [Date(2023, 7, 1), Date(2023, 8, 1)]
+        )
+
+
+class TestCacheKey(TmpDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.args = argparse.Namespace(
+            dir='cash',
+            includefuture=False,
+            asof=None,
+            cache='/nonexistant',
+            func=None,
+        )
+
+    def test_key(self):
+        self.args.cmd = 'sum'
+        key1 = balance.cache_key(self.args)
+        self.assertEqual(key1, balance.cache_key(self.args))
+
+        self.args.includefuture = True
+        self.assertNotEqual(key1, balance.cache_key(self.args))
+
+    def test_files(self):
+        """The dues forecasts read by the members command are in the key"""
+        self.args.dir = self.dir
+        self.args.cmd = 'members'
+        self.args.asof = Date(1990, 5, 4)
+        os.mkdir(os.path.join(self.dir, 'future'))
+        key1 = balance.cache_key(self.args)
+
+        self._write('future/dues.txt', "500 1990-04-01 #dues:test1 !forecast\n")
+        key2 = balance.cache_key(self.args)
+        self.assertNotEqual(key1, key2)
+
+        self._write('future/dues.txt', "600 1990-04-01 #dues:test1 !forecast\n")
+        self.assertNotEqual(key2, balance.cache_key(self.args))
+
+    def test_clock(self):
+        self.args.cmd = 'make_balance'
+        self.assertEqual(balance.cache_key(self.args), None)
+
+        self.args.asof = Date(1990, 5, 4)
+        self.assertNotEqual(balance.cache_key(self.args), None)
+
+    def test_nocache(self):
+        self.args.cmd = 'pages'
+        self.assertEqual(balance.cache_key(self.args), None)
+
+
+class TestRev(TmpDirTestCase):
+
+    def setUp(self):
+        from lib.test_gitobjects import make_repo
+
+        super().setUp()
+        self.revs = make_repo(self.dir, [
+            {
+                'cash/a.txt': "#balance 0\n10 1990-04-03 #donation\n",
+                'cash/future/a.txt': "5 1990-05-03 #donation !forecast\n",
+            },
+            {'cash/a.txt': "#balance 0\n12 1990-04-03 #donation\n"},
+        ])
+        self.args = argparse.Namespace(
+            dir=os.path.join(self.dir, 'cash'),
+            includefuture=False,
+            asof=None,
+            cache='/nonexistant',
+            func=None,
+            cmd='sum',
+            rev=self.revs[0],
+        )
+
+    def test_load_rows(self):
+        self.assertEqual(balance.load_rows(self.args).value, 10)
+        self.assertEqual(balance.load_rows(self.args, True).value, 15)
+
+        self.args.rev = self.revs[1]
+        self.assertEqual(balance.load_rows(self.args).value, 12)
+
+    def test_cache_key(self):
+        key1 = balance.cache_key(self.args)
+        self.args.rev = 'HEAD'
+        key2 = balance.cache_key(self.args)
+        self.assertNotEqual(key1, key2)
+
+        # a change to the working tree does not change the key
+        self._write('cash/a.txt', "#balance 0\n")
+        self.assertEqual(key2, balance.cache_key(self.args))
+
+
+class TestDiff(TmpDirTestCase):
+
+    def setUp(self):
+        from lib.test_gitobjects import make_repo
+
+        super().setUp()
+        make_repo(self.dir, [{
+            'cash/a.txt': "#balance 0\n10 1990-04-03 #donation\n",
+        }])
+        self.args = argparse.Namespace(
+            dir=os.path.join(self.dir, 'cash'),
+            includefuture=False,
+            split=True,
+            old='HEAD',
+            new=os.path.join(self.dir, 'cash'),
+        )
+
+    def test_diff(self):
+        self.assertEqual(
+            balance.subp_diff(self.args),
+            "0 added, 0 removed, 0 changed, balance 10 -> 10 (0)"
+        )
+
+        self._write('cash/a.txt', "#balance 0\n12 1990-04-03 #donation\n5 1990-05-01 gift\n")
+        self.assertEqual(balance.subp_diff(self.args).split("\n"), [
+            "+ a.txt:3 5 1990-05-01 gift",
+            "~ a.txt:2 10 1990-04-03 #donation",
+            "  a.txt:2 12 1990-04-03 #donation",
+            "",
+            "Month    Hashtag   Change",
+            "1990-04  donation       2",
+            "1990-05  unknown        5",
+            "",
+            "1 added, 0 removed, 1 changed, balance 10 -> 17 (7)",
+        ])
+
+
 class TestSubp(unittest.TestCase):
     input_data = """
 #balance 0 Opening Balance
@@ -72,6 +503,19 @@ class TestSubp(unittest.TestCase):
         with self.assertRaises(ValueError):
             balance.subp_sum(self)
 
+    def test_history(self):
+        self.dates = []
+        self.assertEqual(balance.subp_history(self).split("\n"), [
+            "1990-04-30  -13154",
+            "1990-05-31      10",
+        ])
+
+        self.dates = [Date(1990, 1, 1), Date(1990, 5, 14)]
+        self.assertEqual(balance.subp_history(self).split("\n"), [
+            "1990-01-01       0",
+            "1990-05-14  -12654",
+        ])
+
     def test_topay(self):
         expect = [
             "Date: 1990-04",
@@ -93,6 +537,27 @@ class TestSubp(unittest.TestCase):
         got = balance.subp_topay(self).split("\n")
         self.assertEqual(got, expect)
 
+    def test_bills_missing(self):
+        self.asof = Date(1990, 4, 30)
+        self.assertEqual(balance.subp_bills_missing(self), "bills:internet")
+
+        self.asof = Date(1990, 5, 30)
+        self.tags = ['bills:rent', 'fridge']
+        self.assertEqual(
+            balance.subp_bills_missing(self), "bills:rent\nfridge"
+        )
+
+        # a forecast payment has not been paid
+        self.rows.append(balance.RowData(
+            "-12500", Date(1990, 5, 15), "#bills:rent !forecast"
+        ))
+        self.assertEqual(
+            balance.subp_bills_missing(self), "bills:rent\nfridge"
+        )
+
+        self.tags = ['bills:internet']
+        self.assertEqual(balance.subp_bills_missing(self), None)
+
     def test_topay_html(self):
         expect = [
             "<h2>Date: <i>1990-04</i></h2>",
@@ -163,11 +628,29 @@ class TestSubp(unittest.TestCase):
             'Sum\r',
             '10\r',
             '',
+            '',
         ]
 
-        got = balance.subp_csv(self).split("\n")
+        self.stream = StringIO()
+        self.assertEqual(balance.subp_csv(self), None)
+        got = self.stream.getvalue().split("\n")
         self.assertEqual(got, expect)
 
+    def test_csv_rows(self):
+        rows = balance.RowSet()
+        rows.append([
+            balance.RowData("1", Date(1990, 5, 3), "a"),
+            balance.RowData("2", Date(1990, 5, 1), "b"),
+            balance.RowData("3", Date(1990, 4, 20), "c"),
+            balance.RowData("4", Date(1990, 5, 1), "d"),
+            balance.RowData("5", Date(1990, 4, 1), "e"),
+        ])
+        for row, filename in zip(rows, ['f1', 'f1', 'f2', 'f2', 'f1']):
+            row.filename = filename
+
+        got = [row.comment for row in balance.csv_rows(rows)]
+        self.assertEqual(got, ['e', 'c', 'b', 'd', 'a'])
+
     def test_grid2(self):
         expect = [
             "                    1990-04  1990-05 ",
@@ -200,6 +683,37 @@ class TestSubp(unittest.TestCase):
         got = json.loads(balance.subp_json_payments(self))
         self.assertEqual(got, expect)
 
+    def test_json_payments_coverage(self):
+        expect = {
+            'dues:test1': {
+                'first': '1990-04',
+                'paid_through': '1990-05',
+                'gaps': [],
+                'forecast': False,
+                'arrears_months': [],
+                'arrears': '0',
+            },
+        }
+        self.coverage = True
+        self.includefuture = True
+        self.asof = Date(1990, 5, 30)
+        got = json.loads(balance.subp_json_payments(self))
+        self.assertEqual(got, expect)
+
+    def test_members(self):
+        expect = [
+            "member         first   paid to gaps  arrears",
+            "dues:test1   1990-04   1990-05    0",
+            "",
+        ]
+        self.includefuture = True
+        self.asof = Date(1990, 5, 30)
+        got = balance.subp_members(self).split("\n")
+        self.assertEqual(got, expect)
+
+        self.rows = balance.RowSet()
+        self.assertEqual(balance.subp_members(self), '')
+
     @mock.patch('balance.datetime.datetime', fakedatetime)
     def test_make_balance(self):
         got = balance.subp_make_balance(self)
@@ -223,8 +737,9 @@ class TestSubp(unittest.TestCase):
         self.assertTrue(want in got)
 
     def test_roundtrip(self):
-        got = balance.subp_roundtrip(self)
-        self.assertEqual(got, self.input_data)
+        self.stream = StringIO()
+        self.assertEqual(balance.subp_roundtrip(self), None)
+        self.assertEqual(self.stream.getvalue(), self.input_data + "\n")
 
 # TODO
 # - test create_stats() independantly
@@ -283,6 +798,52 @@ class TestSubp(unittest.TestCase):
         got = balance.subp_statstsv(self).split("\n")
         self.assertEqual(got, expect)
 
+    @mock.patch('balance.datetime.datetime', fakedatetime)
+    def test_statstsv_window(self):
+        self.window = [1]
+        got = balance.subp_statstsv(self).split("\n")
+
+        self.assertEqual(got[9], '#column 11 outgoing_sum_1')
+        self.assertEqual(got[16], '#column 18 ARPM_1')
+        self.assertEqual(
+            got[17],
+            '638928000 1990-04 -13154 -13154 -15174 2020 500 1520 1 500 '
+            '-15174 2020 500 -15174 2020 500 1 500 '
+        )
+        self.assertEqual(
+            got[18],
+            '# x Average -26308 -13154 -15174 2020 500 1520 1 500 '
+            'NaN NaN NaN NaN NaN NaN NaN NaN '
+        )
+
+    @mock.patch('balance.datetime.datetime', fakedatetime)
+    def test_stats_sweep(self):
+        expect = [
+            '# members needed',
+            'timestamp month dues_500 dues_700',
+            '638928000 1990-04 31 22',
+            '# x Average 31 22',
+            '',
+            '',
+            '# dues needed',
+            'timestamp month members_1 members_17',
+            '638928000 1990-04 15174 892',
+            '# x Average 15174 892',
+            '',
+        ]
+
+        self.sweep = True
+        self.sweep_dues = '500:700:200'
+        self.sweep_members = '1:17:16'
+        got = balance.subp_stats(self).split("\n")
+        self.assertEqual(got, expect)
+
+    def test_parse_range(self):
+        self.assertEqual(list(balance._parse_range('1:3')), [1, 2, 3])
+        self.assertEqual(list(balance._parse_range('0:10:5')), [0, 5, 10])
+        with self.assertRaises(ValueError):
+            balance._parse_range('1')
+
     def test_subp_check_doubletxn(self):
         self.assertEqual(balance.subp_check_doubletxn(self), None)
 
@@ -292,6 +853,24 @@ class TestSubp(unittest.TestCase):
         with self.assertRaises(ValueError):
             balance.subp_check_doubletxn(self)
 
+    def test_subp_check_doubletxn_json(self):
+        self.format = 'json'
+        self.assertEqual(balance.subp_check_doubletxn(self), "[]")
+
+        self.rows.append(
+            balance.RowData(   "500", Date(1990, 5,12), "#dues:test1 unwanted second payment") # noqa
+        )
+        with self.assertRaises(balance.CheckFailed) as cm:
+            balance.subp_check_doubletxn(self)
+
+        got = json.loads(cm.exception.report)
+        self.assertEqual(len(got), 1)
+        self.assertEqual(got[0]['key'], 'dues')
+        self.assertEqual(
+            [row['line'] for row in got[0]['rows']],
+            [None, 9]
+        )
+
     def test_subp_report_location(self):
         expect = [
             'test_location:',
@@ -327,3 +906,29 @@ class TestSubp(unittest.TestCase):
 
         got = balance.subp_report_location(self).split("\n")
         self.assertEqual(got, expect)
+
+    @mock.patch('balance._pages_describe', return_value="abc123\n")
+    def test_pages_render_location(self, describe):
+        """The served page is the report body, without anything about the
+        directory that it was generated in
+        """
+        stream = StringIO()
+        views = {'split': self.rows, 'stats': self.rows}
+        page = ('report_location.txt', 'split', balance._pages_report_location)
+        balance.pages_render(self, views, page, stream)
+
+        got = stream.getvalue().split("\n")
+        self.assertEqual(got[:3], ['abc123', '', 'test_location:'])
+        self.assertEqual(got[-3:], ['unknown -490', '', ''])
+        self.assertNotIn(os.getcwd(), stream.getvalue())
+
+    def test_subp_locations_timeline(self):
+        expect = [
+            '         test_location test_location2        unknown',
+            '1990-04              0              0         -13154',
+            '1990-05            300            200           -490',
+            '',
+        ]
+
+        got = balance.subp_locations_timeline(self).split("\n")
+        self.assertEqual(got, expect)